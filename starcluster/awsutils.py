@@ -21,6 +21,7 @@ EC2/S3 Utility Classes
 
 import os
 import re
+import sys
 import time
 import base64
 import string
@@ -28,6 +29,7 @@ import tempfile
 
 import boto
 import boto.ec2
+import boto.vpc
 import boto.s3.connection
 from boto import config as boto_config
 from boto.connection import HAVE_HTTPS_CONNECTION
@@ -38,12 +40,160 @@ from starcluster import static
 from starcluster import spinner
 from starcluster import sshutils
 from starcluster import webtools
+from starcluster import ratelimit
 from starcluster import exception
 from starcluster import progressbar
 from starcluster.utils import print_timing
 from starcluster.logger import log
 
 
+# EC2 error codes returned when a client sends requests too quickly
+THROTTLE_ERRORS = ['RequestLimitExceeded', 'Throttling',
+                   'ThrottlingException', 'RequestThrottled']
+# EC2 error codes caused by eventual consistency, e.g. tagging an instance
+# right after launching it. Only retried for requests that aren't Describe*
+# requests so that lookups of missing resources still fail fast.
+EVENTUAL_CONSISTENCY_ERRORS = [
+    'InvalidInstanceID.NotFound', 'InvalidSpotInstanceRequestID.NotFound',
+    'InvalidVolume.NotFound', 'InvalidSnapshot.NotFound',
+    'InvalidGroup.NotFound', 'InvalidPlacementGroup.Unknown',
+    'InvalidAMIID.NotFound']
+# modules whose frames are skipped when looking up the caller of a request
+_API_INTERNAL_MODULES = ['starcluster.awsutils', 'starcluster.ratelimit']
+_api_profile = None
+
+
+def enable_api_profiling():
+    """
+    Starts counting the calls, bytes and latency of every EC2 API request
+    per action and per caller (see get_api_caller) in this process. Returns
+    the ratelimit.CallStats object that holds the counters.
+    """
+    global _api_profile
+    if _api_profile is None:
+        _api_profile = ratelimit.CallStats()
+    return _api_profile
+
+
+def get_api_profile():
+    """
+    Returns the API profile's ratelimit.CallStats or None if profiling is
+    not enabled
+    """
+    return _api_profile
+
+
+def get_api_caller(depth=1):
+    """
+    Returns 'Class.method' (or 'module.function') of the innermost
+    StarCluster frame outside of awsutils on the current call stack, e.g.
+    'Cluster.nodes' for requests made while fetching a cluster's nodes
+    """
+    frame = sys._getframe(depth)
+    while frame:
+        module = frame.f_globals.get('__name__', '')
+        if (module.startswith('starcluster') and
+                module not in _API_INTERNAL_MODULES):
+            name = frame.f_code.co_name
+            obj = frame.f_locals.get('self')
+            if obj is not None:
+                return '%s.%s' % (obj.__class__.__name__, name)
+            return '%s.%s' % (module.split('.')[-1], name)
+        frame = frame.f_back
+    return 'unknown'
+
+
+class RequestThrottle(object):
+    """
+    Client-side rate limiting and retries for EC2 API requests
+
+    Every request takes a token from a token bucket that allows burst
+    requests and refills at rate requests/second. Requests that fail with a
+    throttling error (or an eventual consistency error for requests that
+    aren't Describe* requests) are retried up to max_retries times with
+    exponential backoff and jitter. Throttling errors also halve the
+    bucket's refill rate, which then recovers gradually as requests succeed.
+    Per-action latency and retry counters are kept in self.stats.
+    """
+    def __init__(self, rate=static.AWS_REQUEST_RATE,
+                 burst=static.AWS_REQUEST_BURST, max_retries=8,
+                 base_delay=0.5, max_delay=20, min_rate=0.5):
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.bucket = ratelimit.TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = ratelimit.CallStats()
+
+    def _get_error_code(self, response):
+        match = re.search('<Code>(.*?)</Code>', response.read() or '')
+        if match:
+            return match.group(1)
+
+    def _should_retry(self, action, code):
+        if code in THROTTLE_ERRORS:
+            return True
+        return (code in EVENTUAL_CONSISTENCY_ERRORS and
+                not action.startswith('Describe'))
+
+    def request(self, make_request, action, *args, **kwargs):
+        """
+        Calls make_request(action, *args, **kwargs) which returns an HTTP
+        response, retrying throttled requests as described above
+        """
+        delays = ratelimit.backoff_delays(self.base_delay, self.max_delay)
+        retries = throttled = 0
+        start = time.time()
+        while True:
+            self.bucket.acquire()
+            response = make_request(action, *args, **kwargs)
+            if response.status < 400:
+                self.bucket.rate = min(self.rate,
+                                       self.bucket.rate + self.rate / 20.)
+                break
+            code = self._get_error_code(response)
+            if not self._should_retry(action, code):
+                break
+            if code in THROTTLE_ERRORS:
+                throttled += 1
+                self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+            if retries >= self.max_retries:
+                break
+            retries += 1
+            delay = delays.next()
+            log.debug("%s failed with %s - retrying in %.1fs (%d/%d)" %
+                      (action, code, delay, retries, self.max_retries))
+            time.sleep(delay)
+        latency = time.time() - start
+        error = response.status >= 400
+        self.stats.record(action, latency, retries=retries,
+                          throttled=throttled, error=error)
+        if _api_profile is not None:
+            params = args and args[0] or {}
+            sent = sum([len(str(k)) + len(str(v)) + 2
+                        for k, v in params.items()])
+            _api_profile.record(action, latency, caller=get_api_caller(2),
+                                retries=retries, throttled=throttled,
+                                error=error, bytes_sent=sent,
+                                bytes_received=len(response.read() or ''))
+        return response
+
+
+class ThrottledVPCConnection(boto.vpc.VPCConnection):
+    """
+    VPCConnection that sends every request, including those made by boto
+    objects such as Instance.update(), through a RequestThrottle
+    """
+    throttle = None
+
+    def make_request(self, action, params=None, path='/', verb='GET'):
+        make_request = super(ThrottledVPCConnection, self).make_request
+        if self.throttle is None:
+            return make_request(action, params, path, verb)
+        return self.throttle.request(make_request, action, params, path, verb)
+
+
 class EasyAWS(object):
     def __init__(self, aws_access_key_id, aws_secret_access_key,
                  connection_authenticator, **kwargs):
@@ -102,7 +252,9 @@ class EasyEC2(EasyAWS):
                  aws_port=None, aws_region_name=None, aws_is_secure=True,
                  aws_region_host=None, aws_proxy=None, aws_proxy_port=None,
                  aws_proxy_user=None, aws_proxy_pass=None,
-                 aws_validate_certs=True, **kwargs):
+                 aws_validate_certs=True,
+                 aws_request_rate=static.AWS_REQUEST_RATE,
+                 aws_request_burst=static.AWS_REQUEST_BURST, **kwargs):
         aws_region = None
         if aws_region_name and aws_region_host:
             aws_region = boto.ec2.regioninfo.RegionInfo(
@@ -112,8 +264,10 @@ class EasyEC2(EasyAWS):
                     proxy_port=aws_proxy_port, proxy_user=aws_proxy_user,
                     proxy_pass=aws_proxy_pass,
                     validate_certs=aws_validate_certs)
+        self.throttle = RequestThrottle(rate=aws_request_rate,
+                                        burst=aws_request_burst)
         super(EasyEC2, self).__init__(aws_access_key_id, aws_secret_access_key,
-                                      boto.connect_vpc, **kwds)
+                                      self._connect_vpc, **kwds)
         self._conn = kwargs.get('connection')
         kwds = dict(aws_s3_host=aws_s3_host, aws_s3_path=aws_s3_path,
                     aws_port=aws_port, aws_is_secure=aws_is_secure,
@@ -129,6 +283,13 @@ class EasyEC2(EasyAWS):
     def __repr__(self):
         return '<EasyEC2: %s (%s)>' % (self.region.name, self.region.endpoint)
 
+    def _connect_vpc(self, aws_access_key_id, aws_secret_access_key,
+                     **kwargs):
+        conn = ThrottledVPCConnection(aws_access_key_id,
+                                      aws_secret_access_key, **kwargs)
+        conn.throttle = self.throttle
+        return conn
+
     def _fetch_account_attrs(self):
         acct_attrs = self._account_attrs
         if not acct_attrs or self._account_attrs_region != self.region.name:
@@ -220,13 +381,14 @@ class EasyEC2(EasyAWS):
                 return img
 
     def _wait_for_group_deletion_propagation(self, group):
+        delays = ratelimit.backoff_delays(1, 5)
         if isinstance(group, boto.ec2.placementgroup.PlacementGroup):
             while self.get_placement_group_or_none(group.name):
-                time.sleep(5)
+                time.sleep(delays.next())
         else:
             assert isinstance(group, boto.ec2.securitygroup.SecurityGroup)
             while self.get_group_or_none(group.name):
-                time.sleep(5)
+                time.sleep(delays.next())
 
     def get_subnet(self, subnet_id):
         try:
@@ -551,12 +713,16 @@ class EasyEC2(EasyAWS):
         return self.conn.request_spot_instances(**kwargs)
 
     def _wait_for_propagation(self, obj_ids, fetch_func, id_filter, obj_name,
-                              max_retries=60, interval=5):
+                              max_retries=60, interval=5, progress=True):
         """
         Wait for a list of object ids to appear in the AWS API. Requires a
         function that fetches the objects and also takes a filters kwarg. The
         id_filter specifies the id filter to use for the objects and
-        obj_name describes the objects for log messages.
+        obj_name describes the objects for log messages. Pass progress=False
+        to skip the progress bar (e.g. when waiting from several threads).
+
+        The objects are polled with exponential backoff from 1 second up to
+        interval seconds for a total of max_retries * interval seconds.
         """
         filters = {id_filter: obj_ids}
         num_objs = len(obj_ids)
@@ -564,37 +730,43 @@ class EasyEC2(EasyAWS):
         reqs_ids = []
         max_retries = max(1, max_retries)
         interval = max(1, interval)
+        timeout = max_retries * interval
+        delays = ratelimit.backoff_delays(1, interval)
         widgets = ['', progressbar.Fraction(), ' ',
                    progressbar.Bar(marker=progressbar.RotatingMarker()), ' ',
                    progressbar.Percentage(), ' ', ' ']
         log.info("Waiting for %s to propagate..." % obj_name)
-        pbar = progressbar.ProgressBar(widgets=widgets,
-                                       maxval=num_objs).start()
+        pbar = None
+        if progress:
+            pbar = progressbar.ProgressBar(widgets=widgets,
+                                           maxval=num_objs).start()
+        start = time.time()
         try:
-            for i in range(max_retries + 1):
+            while True:
                 reqs = fetch_func(filters=filters)
                 reqs_ids = [req.id for req in reqs]
                 num_reqs = len(reqs)
-                pbar.update(num_reqs)
-                if num_reqs != num_objs:
-                    log.debug("%d: only %d/%d %s have "
-                              "propagated - sleeping..." %
-                              (i, num_reqs, num_objs, obj_name))
-                    if i != max_retries:
-                        time.sleep(interval)
-                else:
+                if pbar:
+                    pbar.update(num_reqs)
+                if num_reqs == num_objs:
                     return
+                remaining = timeout - (time.time() - start)
+                if remaining <= 0:
+                    break
+                log.debug("only %d/%d %s have propagated - sleeping..." %
+                          (num_reqs, num_objs, obj_name))
+                time.sleep(min(delays.next(), remaining))
         finally:
-            if not pbar.finished:
+            if pbar and not pbar.finished:
                 pbar.finish()
         missing = [oid for oid in obj_ids if oid not in reqs_ids]
         raise exception.PropagationException(
             "Failed to fetch %d/%d %s after %d seconds: %s" %
-            (num_reqs, num_objs, obj_name, max_retries * interval,
+            (num_reqs, num_objs, obj_name, timeout,
              ', '.join(missing)))
 
     def wait_for_propagation(self, instances=None, spot_requests=None,
-                             max_retries=60, interval=5):
+                             max_retries=60, interval=5, progress=True):
         """
         Wait for newly created instances and/or spot_requests to register in
         the AWS API by repeatedly calling get_all_{instances, spot_requests}.
@@ -607,12 +779,13 @@ class EasyEC2(EasyAWS):
             self._wait_for_propagation(
                 spot_ids, self.get_all_spot_requests,
                 'spot-instance-request-id', 'spot requests',
-                max_retries=max_retries, interval=interval)
+                max_retries=max_retries, interval=interval, progress=progress)
         if instances:
             instance_ids = [getattr(i, 'id', i) for i in instances]
             self._wait_for_propagation(
                 instance_ids, self.get_all_instances, 'instance-id',
-                'instances', max_retries=max_retries, interval=interval)
+                'instances', max_retries=max_retries, interval=interval,
+                progress=progress)
 
     def run_instances(self, image_id, instance_type='m1.small', min_count=1,
                       max_count=1, key_name=None, security_groups=None,
@@ -1346,6 +1519,17 @@ class EasyEC2(EasyAWS):
         if instances:
             self.conn.terminate_instances(instances)
 
+    def create_tags(self, resource_ids, tags):
+        """
+        Adds tags (a dict) to each resource (instance, spot request, etc.) in
+        resource_ids
+        """
+        return self.conn.create_tags(resource_ids, tags)
+
+    def cancel_spot_requests(self, request_ids=None):
+        if request_ids:
+            self.conn.cancel_spot_instance_requests(request_ids)
+
     def get_volumes(self, filters=None):
         """
         Returns a list of all EBS volumes
@@ -1383,8 +1567,9 @@ class EasyEC2(EasyAWS):
                      extra=dict(__nonewline__=True))
             s = spinner.Spinner()
             s.start()
+            delays = ratelimit.backoff_delays(1, refresh_interval)
             while volume.update() != status:
-                time.sleep(refresh_interval)
+                time.sleep(delays.next())
             s.stop()
         if state:
             log_func("Waiting for %s to transition to: %s... " %
@@ -1393,8 +1578,9 @@ class EasyEC2(EasyAWS):
                 volume.update()
             s = spinner.Spinner()
             s.start()
+            delays = ratelimit.backoff_delays(1, refresh_interval)
             while volume.attachment_state() != state:
-                time.sleep(refresh_interval)
+                time.sleep(delays.next())
                 volume.update()
             s.stop()
 
@@ -1405,6 +1591,7 @@ class EasyEC2(EasyAWS):
                    progressbar.Bar(marker=progressbar.RotatingMarker()),
                    '', progressbar.Percentage(), ' ', progressbar.ETA()]
         pbar = progressbar.ProgressBar(widgets=widgets, maxval=100).start()
+        delays = ratelimit.backoff_delays(5, refresh_interval)
         while snap.status != 'completed':
             try:
                 progress = int(snap.update().replace('%', ''))
@@ -1414,7 +1601,7 @@ class EasyEC2(EasyAWS):
                 time.sleep(5)
                 continue
             if snap.status != 'completed':
-                time.sleep(refresh_interval)
+                time.sleep(delays.next())
         if not pbar.finished:
             pbar.finish()
 
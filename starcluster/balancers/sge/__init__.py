@@ -17,44 +17,521 @@
 
 import os
 import re
+import math
 import time
+import json
+import zlib
+import heapq
+import pipes
+import base64
 import datetime
-import xml.dom.minidom
+import StringIO
+import xml.etree.cElementTree as ElementTree
 
 from starcluster import utils
 from starcluster import static
+from starcluster import sshutils
 from starcluster import exception
 from starcluster.balancers import LoadBalancer
+from starcluster.balancers.sge import costs as sge_costs
+from starcluster.balancers.sge import policy as sge_policy
+from starcluster.balancers.sge import timeseries
 from starcluster.logger import log
 
 
 SGE_STATS_DIR = os.path.join(static.STARCLUSTER_CFG_DIR, 'sge')
 DEFAULT_STATS_DIR = os.path.join(SGE_STATS_DIR, '%s')
-DEFAULT_STATS_FILE = os.path.join(DEFAULT_STATS_DIR, 'sge-stats.csv')
+DEFAULT_STATS_FILE = os.path.join(DEFAULT_STATS_DIR, 'sge-stats.dat')
+ACCOUNTING_STATE_FILE = os.path.join(DEFAULT_STATS_DIR, 'accounting.json')
+SGE_ACCOUNTING_FILE = '/opt/sge6/default/common/accounting'
+STATS_BUNDLE_MARKER = '__STARCLUSTER_SGE_STATS__'
+
+
+def iterparse_xml(xml_out, tags):
+    """
+    Incrementally parse SGE -xml output and yield (element, parent) for each
+    element whose tag is in tags as soon as it has been completely parsed.
+
+    xml_out can either be a string or a file-like object. Yielded elements are
+    detached from their parent once the caller is done with them so that the
+    memory used is bounded by the size of a single record rather than the size
+    of the whole document.
+    """
+    if isinstance(xml_out, unicode):
+        xml_out = xml_out.encode('utf-8')
+    if isinstance(xml_out, str):
+        xml_out = StringIO.StringIO(xml_out)
+    stack = []
+    events = ElementTree.iterparse(xml_out, events=('start', 'end'))
+    for event, elem in events:
+        if event == 'start':
+            stack.append(elem)
+            continue
+        stack.pop()
+        if elem.tag in tags:
+            parent = stack[-1] if stack else None
+            yield elem, parent
+            if parent is not None:
+                parent.remove(elem)
+
+
+class JobStatsWindow(object):
+    """
+    Sliding window of completed job statistics
+
+    Each completed job is stored as an (end_time, duration, wait_time) tuple
+    where end_time is seconds since the epoch and duration/wait_time are in
+    seconds. Jobs that ended more than window seconds before the time passed
+    to expire() are dropped. Running sums are kept so that count and averages
+    are O(1); percentiles sort the jobs currently in the window.
+    """
+    def __init__(self, window=3 * 60 * 60):
+        self.window = window
+        self._jobs = []
+        self.duration_sum = 0
+        self.wait_sum = 0
+
+    def __len__(self):
+        return len(self._jobs)
+
+    @property
+    def count(self):
+        return len(self._jobs)
+
+    def add(self, end_time, duration, wait_time):
+        heapq.heappush(self._jobs, (end_time, duration, wait_time))
+        self.duration_sum += duration
+        self.wait_sum += wait_time
+
+    def expire(self, now):
+        """
+        Drop all jobs that ended before now - window (now is an epoch time or
+        a datetime object)
+        """
+        if isinstance(now, datetime.datetime):
+            now = utils.datetime_to_unix_time(now)
+        cutoff = now - self.window
+        expired = 0
+        while self._jobs and self._jobs[0][0] < cutoff:
+            end_time, duration, wait_time = heapq.heappop(self._jobs)
+            self.duration_sum -= duration
+            self.wait_sum -= wait_time
+            expired += 1
+        return expired
+
+    def avg_duration(self):
+        if not self._jobs:
+            return 0
+        return self.duration_sum / len(self._jobs)
+
+    def avg_wait(self):
+        if not self._jobs:
+            return 0
+        return self.wait_sum / len(self._jobs)
+
+    def _percentile(self, index, pct):
+        if not self._jobs:
+            return 0
+        values = sorted([job[index] for job in self._jobs])
+        rank = int(math.ceil(pct / 100.0 * len(values))) - 1
+        return values[min(max(rank, 0), len(values) - 1)]
+
+    def duration_percentile(self, pct):
+        return self._percentile(1, pct)
+
+    def wait_percentile(self, pct):
+        return self._percentile(2, pct)
+
+
+def get_accounting_end_time(record):
+    """
+    Returns the end time of an SGE accounting record (see accounting(5)) or
+    None if the record is malformed or the job never ran
+    """
+    fields = record.split(':')
+    if len(fields) < 11:
+        return None
+    try:
+        return int(fields[10]) or None
+    except ValueError:
+        return None
+
+
+class AccountingCursor(object):
+    """
+    Tracks the byte offset of the SGE accounting file up to which completed
+    job records have already been ingested so that each poll only transfers
+    and parses records appended since the previous poll.
+
+    If state_file is given the offset is saved to it together with the
+    accounting file's inode and size after every poll. restore() reloads it
+    when the balancer starts so that a restart doesn't transfer the whole
+    accounting file again.
+    """
+    def __init__(self, path=SGE_ACCOUNTING_FILE, offset=0, state_file=None):
+        self.path = path
+        self.offset = offset
+        self.state_file = state_file
+        self.inode = None
+        self.size = None
+        self.restored = False
+
+    def save(self):
+        """
+        Saves the offset, inode and size to state_file (if any)
+        """
+        if not self.state_file:
+            return
+        state = dict(path=self.path, inode=self.inode, size=self.size,
+                     offset=self.offset)
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmp, self.state_file)
+
+    def load(self):
+        """
+        Returns the state saved for this accounting file or None
+        """
+        if not self.state_file or not os.path.exists(self.state_file):
+            return None
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            log.warn("Ignoring corrupt accounting state file: %s" %
+                     self.state_file)
+            return None
+        if state.get('path') == self.path:
+            return state
+
+    def _stat(self, ssh):
+        """
+        Returns the accounting file's (inode, size) or (None, None) if it
+        doesn't exist yet
+        """
+        result = ssh.run_command("stat -c '%%i %%s' %s" % self.path)
+        if result.failed:
+            return None, None
+        inode, size = result.stdout.split()
+        return inode, int(size)
+
+    def restore(self, ssh, start_time):
+        """
+        Positions the cursor when the balancer starts: at the saved offset if
+        it was saved for the same accounting file (same inode) and the file
+        hasn't shrunk since. Otherwise at the first record of a job that
+        ended at or after start_time (seconds since the epoch).
+        """
+        self.restored = True
+        inode, size = self._stat(ssh)
+        if inode is None:
+            self.offset = 0
+            return
+        state = self.load() or {}
+        if (state.get('inode') == inode and
+                state.get('offset', 0) <= state.get('size', 0) <= size):
+            self.offset = state['offset']
+            log.info("Resuming SGE accounting file at byte %d" % self.offset)
+        else:
+            acct = ssh.remote_file(self.path, 'r')
+            try:
+                self.offset = self.seek_to_time(acct, size, start_time)
+            finally:
+                acct.close()
+            log.debug("Starting SGE accounting file at byte %d of %d" %
+                      (self.offset, size))
+        self.inode = inode
+        self.size = size
+        self.save()
+
+    def seek_to_time(self, f, size, start_time, chunk=65536):
+        """
+        Returns the offset of the first record in file object f (size bytes
+        long) of a job that ended at or after start_time. Records are
+        appended as jobs finish so the file is binary searched by end time,
+        reading at most a few chunk sized blocks per probe.
+        """
+        def first_end_time(pos):
+            # end time of the first complete record starting after pos
+            f.seek(pos)
+            data = f.read(chunk)
+            start = 0
+            if pos:
+                start = data.find('\n') + 1
+                if not start:
+                    return None
+            while True:
+                end = data.find('\n', start)
+                if end < 0:
+                    return None
+                end_time = get_accounting_end_time(data[start:end])
+                if end_time:
+                    return end_time
+                start = end + 1
+        lo, hi = 0, size
+        while hi - lo > chunk:
+            mid = (lo + hi) // 2
+            end_time = first_end_time(mid)
+            if end_time is None or end_time >= start_time:
+                hi = mid
+            else:
+                lo = mid
+        # scan the remaining records from the record boundary after lo
+        f.seek(lo)
+        data = f.read(hi - lo + chunk)
+        pos = data.find('\n') + 1 if lo else 0
+        last = pos
+        while True:
+            end = data.find('\n', pos)
+            if end < 0:
+                return lo + last
+            end_time = get_accounting_end_time(data[pos:end])
+            if end_time and end_time >= start_time:
+                return lo + pos
+            pos = last = end + 1
+
+    def advance(self, data, size=None, inode=None):
+        """
+        Takes data read from the accounting file starting at self.offset and
+        returns the complete records it contains. The cursor is moved past
+        those records - a trailing partial record is left to be read again on
+        the next poll. If size (the file's current size) is smaller than the
+        offset or inode differs from the file's previous inode the file was
+        truncated or rotated and None is returned after resetting the offset.
+        """
+        rotated = (inode is not None and self.inode is not None and
+                   inode != self.inode)
+        if rotated or (size is not None and size < self.offset):
+            log.info("SGE accounting file was truncated - re-reading %s" %
+                     self.path)
+            self.offset = 0
+            self.inode = inode
+            return None
+        if inode is not None:
+            self.inode = inode
+        end = data.rfind('\n') + 1
+        self.offset += end
+        self.size = size
+        self.save()
+        return data[:end]
+
+    def read(self, ssh):
+        """
+        Read new complete records from the accounting file using ssh's sftp
+        connection. Returns '' if the file does not exist yet.
+        """
+        try:
+            acct = ssh.remote_file(self.path, 'r')
+        except IOError:
+            log.info("No jobs have completed yet!")
+            return ''
+        try:
+            size = acct.stat().st_size
+            records = None
+            while records is None:
+                acct.seek(self.offset)
+                data = acct.read(max(size - self.offset, 0))
+                records = self.advance(data, size=size)
+            return records
+        finally:
+            acct.close()
+
+
+def build_stats_script(commands, compress=False):
+    """
+    Returns a shell script that runs each (name, command) pair in commands on
+    the remote host and writes a single framed bundle to stdout. Each frame
+    consists of a "name exit_status elapsed_usecs num_bytes" header line
+    followed by exactly num_bytes of the command's stdout. If compress is True
+    the frames are gzipped and base64 encoded. Use parse_stats_bundle to
+    decode the output.
+    """
+    frame = ('sc_frame() { s=$(date +%s%N); eval "$2" > "$sc_tmp" '
+             '2>/dev/null; rc=$?; e=$(date +%s%N); '
+             'echo "$1 $rc $(( (e - s) / 1000 )) $(wc -c < "$sc_tmp")"; '
+             'cat "$sc_tmp"; }')
+    frames = ' '.join(['sc_frame %s %s;' % (name, pipes.quote(cmd))
+                       for name, cmd in commands])
+    script = [frame, 'sc_tmp=$(mktemp)', 'echo %s' % STATS_BUNDLE_MARKER]
+    if compress:
+        script.append('{ %s } | gzip -c | base64' % frames)
+    else:
+        script.append('{ %s }' % frames)
+    script.append('rm -f "$sc_tmp"')
+    return '; '.join(script)
+
+
+def parse_stats_bundle(bundle, compress=False):
+    """
+    Decodes the output of a script created by build_stats_script. Returns a
+    dictionary mapping each command's name to an sshutils.CommandResult
+    containing the command's exit status, stdout and elapsed time (seconds).
+    """
+    marker = STATS_BUNDLE_MARKER + '\n'
+    if marker not in bundle:
+        raise exception.BaseException("Invalid SGE stats bundle: marker "
+                                      "not found")
+    data = bundle[bundle.index(marker) + len(marker):]
+    if compress:
+        data = zlib.decompress(base64.b64decode(data), 16 + zlib.MAX_WBITS)
+    results = {}
+    pos = 0
+    while pos < len(data):
+        eol = data.index('\n', pos)
+        name, status, usecs, nbytes = data[pos:eol].split()
+        pos = eol + 1 + int(nbytes)
+        results[name] = sshutils.CommandResult(
+            name, exit_status=int(status), stdout=data[eol + 1:pos],
+            elapsed=int(usecs) / 1e6)
+    return results
+
+
+def memory_in_gb(value):
+    """
+    Converts an SGE memory specifier (e.g. 512M, 4G or 1073741824) to GB
+    """
+    value = str(value).strip()
+    units = dict(k=1024 ** -2, m=1024 ** -1, g=1, t=1024)
+    try:
+        if value and value[-1].lower() in units:
+            return float(value[:-1]) * units[value[-1].lower()]
+        return float(value) / 1024 ** 3
+    except ValueError:
+        log.debug("Invalid memory specifier: %s" % value)
+        return 0
+
+
+class SGEJob(object):
+    """
+    A single SGE job parsed from qstat -xml output
+
+    Task array jobs are stored as a single record with num_tasks set to the
+    number of tasks in the array rather than one record per task. Fields can
+    also be accessed using their qstat XML tag names, e.g. job['slots'] or
+    job['JB_job_number'], for compatibility with the old dict records.
+    """
+    __slots__ = ('job_number', 'name', 'owner', 'prio', 'state', 'job_state',
+                 'queue_name', 'slots', 'submission_time', 'start_time',
+                 'tasks', 'num_tasks', 'hard_queue', 'resources')
+
+    _tags = {'JB_job_number': 'job_number', 'JB_name': 'name',
+             'JB_owner': 'owner', 'JAT_prio': 'prio', 'state': 'state',
+             'job_state': 'job_state', 'queue_name': 'queue_name',
+             'slots': 'slots', 'JB_submission_time': 'submission_time',
+             'JAT_start_time': 'start_time', 'tasks': 'tasks',
+             'hard_req_queue': 'hard_queue'}
+
+    def __init__(self, job_number=None, name=None, owner=None, prio=None,
+                 state=None, job_state=None, queue_name=None, slots=1,
+                 submission_time=None, start_time=None, tasks=None,
+                 num_tasks=1, hard_queue=None, resources=None):
+        self.job_number = job_number
+        self.name = name
+        self.owner = owner
+        self.prio = prio
+        self.state = state
+        self.job_state = job_state
+        self.queue_name = queue_name
+        self.slots = slots
+        self.submission_time = submission_time
+        self.start_time = start_time
+        self.tasks = tasks
+        self.num_tasks = num_tasks
+        self.hard_queue = hard_queue
+        self.resources = resources or {}
+
+    def __repr__(self):
+        return "<SGEJob: %s (%s, %d task(s))>" % (self.job_number, self.state,
+                                                  self.num_tasks)
+
+    def get(self, key, default=None):
+        attr = self._tags.get(key)
+        if attr is None:
+            return default
+        value = getattr(self, attr)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    @property
+    def host(self):
+        """
+        Name of the exec host this job is running on (None if not running)
+        """
+        if self.queue_name and '@' in self.queue_name:
+            return self.queue_name.split('@', 1)[1]
+
+    @property
+    def cluster_queue(self):
+        """
+        Name of the cluster queue this job is running in or, for pending jobs,
+        the queue requested with qsub -q (None if no queue was requested)
+        """
+        queue = self.queue_name or self.hard_queue
+        if queue:
+            # hard queue requests may list several queues or queue instances
+            return queue.split(',')[0].split('@', 1)[0]
+
+    @property
+    def total_slots(self):
+        """
+        Total number of slots requested by all tasks of this job
+        """
+        return self.slots * self.num_tasks
+
+    @property
+    def gpus(self):
+        """
+        Number of GPUs needed by a single task of this job (qsub -l gpu=N,
+        per slot)
+        """
+        return int(float(self.resources.get('gpu', 0))) * self.slots
+
+    @property
+    def memory(self):
+        """
+        Memory in GB needed by a single task of this job (qsub -l h_vmem or
+        mem_free, per slot)
+        """
+        for name in ['h_vmem', 'mem_free']:
+            if name in self.resources:
+                return memory_in_gb(self.resources[name]) * self.slots
+        return 0
 
 
 class SGEStats(object):
     """
     SunGridEngine stats parser
     """
-    def __init__(self, remote_tzinfo=None):
-        self.jobstat_cachesize = 200
+    def __init__(self, remote_tzinfo=None, jobstats_window=3 * 60 * 60):
         self.hosts = []
         self.jobs = []
         self.queues = {}
-        self.jobstats = self.jobstat_cachesize * [None]
+        self._running_jobs = []
+        self._queued_jobs = []
+        self._jobs_by_id = {}
+        self._jobs_by_host = {}
+        self.jobstats = JobStatsWindow(window=jobstats_window)
         self.max_job_id = 0
         self.remote_tzinfo = remote_tzinfo or utils.get_utc_now().tzinfo
 
     @property
     def first_job_id(self):
         if self.jobs:
-            return int(self.jobs[0]['JB_job_number'])
+            return self.jobs[0].job_number
 
     @property
     def last_job_id(self):
         if self.jobs:
-            return int(self.jobs[-1]['JB_job_number'])
+            return self.jobs[-1].job_number
 
     def parse_qhost(self, qhost_out):
         """
@@ -62,19 +539,14 @@ class SGEStats(object):
         takes in a string, so we can pipe in output from ssh.exec('qhost -xml')
         """
         self.hosts = []  # clear the old hosts
-        doc = xml.dom.minidom.parseString(qhost_out)
-        for h in doc.getElementsByTagName("host"):
-            name = h.getAttribute("name")
+        for h, parent in iterparse_xml(qhost_out, ['host']):
+            name = h.get("name")
+            if name == 'global':
+                continue
             hash = {"name": name}
-            for stat in h.getElementsByTagName("hostvalue"):
-                for hvalue in stat.childNodes:
-                    attr = stat.attributes['name'].value
-                    val = ""
-                    if hvalue.nodeType == xml.dom.minidom.Node.TEXT_NODE:
-                        val = hvalue.data
-                    hash[attr] = val
-            if hash['name'] != u'global':
-                self.hosts.append(hash)
+            for stat in h.findall("hostvalue"):
+                hash[stat.get('name')] = stat.text or ""
+            self.hosts.append(hash)
         return self.hosts
 
     def parse_qstat(self, qstat_out):
@@ -83,28 +555,53 @@ class SGEStats(object):
         """
         self.jobs = []  # clear the old jobs
         self.queues = {}  # clear the old queues
-        doc = xml.dom.minidom.parseString(qstat_out)
-        for q in doc.getElementsByTagName("Queue-List"):
-            name = q.getElementsByTagName("name")[0].childNodes[0].data
-            slots = q.getElementsByTagName("slots_total")[0].childNodes[0].data
-            self.queues[name] = dict(slots=int(slots))
-            for job in q.getElementsByTagName("job_list"):
-                self.jobs.extend(self._parse_job(job, queue_name=name))
-        for job in doc.getElementsByTagName("job_list"):
-            if job.parentNode.nodeName == 'job_info':
-                self.jobs.extend(self._parse_job(job))
+        self._running_jobs = []
+        self._queued_jobs = []
+        self._jobs_by_id = {}
+        self._jobs_by_host = {}
+        tags = ['job_list', 'Queue-List']
+        for elem, parent in iterparse_xml(qstat_out, tags):
+            if elem.tag == 'Queue-List':
+                name = elem.findtext("name")
+                slots = elem.findtext("slots_total")
+                queue, sep, host = name.partition('@')
+                self.queues[name] = dict(slots=int(slots), queue=queue,
+                                         host=host)
+            elif parent.tag == 'Queue-List':
+                name = parent.findtext("name")
+                self._add_job(self._parse_job(elem, queue_name=name))
+            elif parent.tag == 'job_info':
+                self._add_job(self._parse_job(elem))
         return self.jobs
 
+    def _add_job(self, job):
+        """
+        Add job to the list of jobs and to the per-state, per-job-id and
+        per-host indexes used by the balancer
+        """
+        self.jobs.append(job)
+        if job.job_state == u'running':
+            self._running_jobs.append(job)
+        elif job.job_state == u'pending' and job.state == u'qw':
+            self._queued_jobs.append(job)
+        self._jobs_by_id.setdefault(job.job_number, []).append(job)
+        host = job.host
+        if host:
+            self._jobs_by_host.setdefault(host, []).append(job)
+
     def _parse_job(self, job, queue_name=None):
-        jstate = job.getAttribute("state")
-        jdict = dict(job_state=jstate, queue_name=queue_name)
-        for node in job.childNodes:
-            if node.nodeType == xml.dom.minidom.Node.ELEMENT_NODE:
-                for child in node.childNodes:
-                    jdict[node.nodeName] = child.data
-        num_tasks = self._count_tasks(jdict)
-        log.debug("Job contains %d tasks" % num_tasks)
-        return [jdict] * num_tasks
+        sge_job = SGEJob(job_state=job.get("state"), queue_name=queue_name)
+        for node in job:
+            if node.tag == 'hard_request':
+                sge_job.resources[node.get('name')] = node.text
+                continue
+            attr = SGEJob._tags.get(node.tag)
+            if attr is not None and node.text is not None:
+                setattr(sge_job, attr, node.text)
+        sge_job.job_number = int(sge_job.job_number)
+        sge_job.slots = int(sge_job.slots)
+        sge_job.num_tasks = self._count_tasks(sge_job)
+        return sge_job
 
     def _count_tasks(self, jdict):
         """
@@ -137,11 +634,14 @@ class SGEStats(object):
         dt = datetime.datetime.strptime(qacct, "%a %b %d %H:%M:%S %Y")
         return dt.replace(tzinfo=self.remote_tzinfo)
 
+    def _add_jobstat(self, job_id, queued, start, end):
+        self.max_job_id = max(self.max_job_id, job_id)
+        self.jobstats.add(end, end - start, start - queued)
+
     def parse_qacct(self, string, dtnow):
         """
-        This method parses qacct -j output and makes a neat array and
-        calculates some statistics.
-        Takes the string to parse, and a datetime object of the remote
+        This method parses qacct -j output and adds each job to the jobstats
+        window. Takes the string to parse, and a datetime object of the remote
         host's current time.
         """
         job_id = None
@@ -168,44 +668,94 @@ class SGEStats(object):
                     end = self.qacct_to_datetime_tuple(l[13:len(l)])
             if l.find('==========') != -1:
                 if qd is not None:
-                    self.max_job_id = job_id
-                    hash = {'queued': qd, 'start': start, 'end': end}
-                    self.jobstats[job_id % self.jobstat_cachesize] = hash
+                    qd, start, end = [utils.datetime_to_unix_time(t)
+                                      for t in (qd, start, end)]
+                    self._add_jobstat(job_id, qd, start, end)
+                    counter += 1
                 qd = None
                 start = None
                 end = None
-                counter = counter + 1
         log.debug("added %d new jobs" % counter)
-        log.debug("There are %d items in the jobstats cache" %
+        log.debug("There are %d items in the jobstats window" %
                   len(self.jobstats))
         return self.jobstats
 
+    def parse_accounting(self, records, since=None):
+        """
+        Parses records from the SGE accounting file (see accounting(5)) and
+        adds each completed job to the jobstats window. Jobs that ended
+        before since (seconds since the epoch) are skipped rather than added
+        and expired later. Returns the number of jobs added.
+        """
+        counter = 0
+        for line in StringIO.StringIO(records):
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(':')
+            if len(fields) < 11:
+                log.debug("Skipping malformed accounting record: %s" % line)
+                continue
+            try:
+                job_id = int(fields[5])
+                queued, start, end = [int(f) for f in fields[8:11]]
+            except ValueError:
+                log.debug("Skipping malformed accounting record: %s" % line)
+                continue
+            if not start or not end:
+                # job was deleted or failed before it started
+                continue
+            if since is not None and end < since:
+                continue
+            self._add_jobstat(job_id, queued, start, end)
+            counter += 1
+        log.debug("added %d new jobs" % counter)
+        return counter
+
     def is_jobstats_empty(self):
         """
-        This function will return True if half of the queue is empty, False if
-        there are enough entries in it.
+        This function will return True if there are no completed jobs in the
+        jobstats window
         """
-        return self.max_job_id < (self.jobstat_cachesize * 0.3)
+        return len(self.jobstats) == 0
 
     def get_running_jobs(self):
         """
-        returns an array of the running jobs, values stored in dictionary
+        returns an array of the running jobs. task array jobs are returned as
+        a single SGEJob - use count_running_tasks to count individual tasks
         """
-        running = []
-        for j in self.jobs:
-            if j['job_state'] == u'running':
-                running.append(j)
-        return running
+        return self._running_jobs
 
     def get_queued_jobs(self):
         """
-        returns an array of the queued jobs, values stored in dictionary
+        returns an array of the queued jobs. task array jobs are returned as
+        a single SGEJob - use count_queued_tasks to count individual tasks
         """
-        queued = []
-        for j in self.jobs:
-            if j['job_state'] == u'pending' and j['state'] == u'qw':
-                queued.append(j)
-        return queued
+        return self._queued_jobs
+
+    def count_running_tasks(self):
+        """
+        returns the number of running tasks (array job tasks count separately)
+        """
+        return sum([j.num_tasks for j in self.get_running_jobs()])
+
+    def count_queued_tasks(self):
+        """
+        returns the number of queued tasks (array job tasks count separately)
+        """
+        return sum([j.num_tasks for j in self.get_queued_jobs()])
+
+    def count_used_slots(self):
+        """
+        returns the number of slots used by all running tasks
+        """
+        return sum([j.total_slots for j in self.get_running_jobs()])
+
+    def count_queued_slots(self):
+        """
+        returns the number of slots requested by all queued tasks
+        """
+        return sum([j.total_slots for j in self.get_queued_jobs()])
 
     def count_hosts(self):
         """
@@ -214,34 +764,70 @@ class SGEStats(object):
         # todo: throw an exception if hosts not initialized
         return len(self.hosts)
 
-    def count_total_slots(self):
+    def count_total_slots(self, queue='all.q'):
         """
-        Returns a count of the total slots available in this cluster
+        Returns a count of the total slots available in the given cluster
+        queue
         """
-        slots = 0
-        for q in self.queues:
-            if q.startswith('all.q@'):
-                slots += self.queues.get(q).get('slots')
-        return slots
+        return sum(self.get_host_slots(queue).values())
 
-    def slots_per_host(self):
+    def get_host_slots(self, queue='all.q'):
         """
-        Returns the number of slots per host. If for some reason the cluster is
-        inconsistent, this will return -1 for example, if you have m1.large and
-        m1.small in the same cluster
+        Returns a dictionary mapping each host in the given cluster queue to
+        the number of slots it has in that queue
         """
-        total = self.count_total_slots()
-        if total == 0:
-            return total
-        single = 0
-        for q in self.queues:
-            if q.startswith('all.q@'):
-                single = self.queues.get(q).get('slots')
-                break
-        if (total != (single * len(self.hosts))):
-            raise exception.BaseException(
-                "ERROR: Number of slots not consistent across cluster")
-        return single
+        return dict([(q['host'], q['slots']) for q in self.queues.values()
+                     if q['queue'] == queue])
+
+    def slots_per_host(self, queue='all.q'):
+        """
+        Returns the number of slots per host in the given cluster queue. If
+        hosts have different numbers of slots, for example m1.large and
+        m1.small in the same cluster, the average number of slots per host is
+        returned (see get_queue_stats for per-host slots)
+        """
+        slots = self.get_host_slots(queue).values()
+        if not slots:
+            return 0
+        if min(slots) != max(slots):
+            avg = max(sum(slots) / len(slots), 1)
+            log.debug("Number of slots in %s varies across hosts (%d-%d), "
+                      "using average: %d" % (queue, min(slots), max(slots),
+                                             avg))
+            return avg
+        return slots[0]
+
+    def get_queue_stats(self, default_queue='all.q'):
+        """
+        Returns a dictionary mapping each cluster queue to a dictionary with
+        the queue's total_slots, used_slots and queued_slots, the slots of
+        each host in the queue (hosts) and the largest slots, GPUs and memory
+        (GB) requested by a single queued task (max_job_slots, max_job_gpus,
+        max_job_memory). Queued jobs that did not request a queue are counted
+        in default_queue.
+        """
+        stats = {}
+
+        def get_queue(name):
+            return stats.setdefault(name, dict(total_slots=0, used_slots=0,
+                                               queued_slots=0, hosts={},
+                                               max_job_slots=0,
+                                               max_job_gpus=0,
+                                               max_job_memory=0))
+        for q in self.queues.values():
+            queue = get_queue(q['queue'])
+            queue['total_slots'] += q['slots']
+            queue['hosts'][q['host']] = q['slots']
+        for job in self.get_running_jobs():
+            get_queue(job.cluster_queue)['used_slots'] += job.total_slots
+        for job in self.get_queued_jobs():
+            queue = get_queue(job.cluster_queue or default_queue)
+            queue['queued_slots'] += job.total_slots
+            queue['max_job_slots'] = max(queue['max_job_slots'], job.slots)
+            queue['max_job_gpus'] = max(queue['max_job_gpus'], job.gpus)
+            queue['max_job_memory'] = max(queue['max_job_memory'],
+                                          job.memory)
+        return stats
 
     def oldest_queued_job_age(self):
         """
@@ -249,23 +835,26 @@ class SGEStats(object):
         state
         """
         for j in self.jobs:
-            if 'JB_submission_time' in j and j['state'] == 'qw':
-                st = j['JB_submission_time']
+            if j.submission_time and j.state == 'qw':
+                st = j.submission_time
                 dt = utils.iso_to_datetime_tuple(st)
                 return dt.replace(tzinfo=self.remote_tzinfo)
         # todo: throw a "no queued jobs" exception
 
+    def get_jobs_for_host(self, hostname):
+        """
+        returns the jobs currently running on the exec host hostname
+        """
+        return self._jobs_by_host.get(hostname, [])
+
     def is_node_working(self, node):
         """
         This function returns true if the node is currently working on a task,
         or false if the node is currently idle.
         """
-        nodename = node.alias
-        for j in self.jobs:
-            qn = j.get('queue_name', '')
-            if nodename in qn:
-                log.debug("Node %s is working" % node.alias)
-                return True
+        if self.get_jobs_for_host(node.alias):
+            log.debug("Node %s is working" % node.alias)
+            return True
         log.debug("Node %s is IDLE" % node.id)
         return False
 
@@ -274,36 +863,21 @@ class SGEStats(object):
         returns the number of slots requested for the given job id
         returns None if job_id is invalid
         """
-        ujid = unicode(job_id)
-        for j in self.jobs:
-            if j['JB_job_number'] == ujid:
-                return int(j['slots'])
+        jobs = self._jobs_by_id.get(int(job_id))
+        if jobs:
+            return jobs[0].slots
 
     def avg_job_duration(self):
-        count = 0
-        total_seconds = 0
-        for job in self.jobstats:
-            if job is not None:
-                delta = job['end'] - job['start']
-                total_seconds += delta.seconds
-                count += 1
-        if count == 0:
-            return count
-        else:
-            return total_seconds / count
+        return self.jobstats.avg_duration()
 
     def avg_wait_time(self):
-        count = 0
-        total_seconds = 0
-        for job in self.jobstats:
-            if job is not None:
-                delta = job['start'] - job['queued']
-                total_seconds += delta.seconds
-                count += 1
-        if count == 0:
-            return count
-        else:
-            return total_seconds / count
+        return self.jobstats.avg_wait()
+
+    def job_duration_percentile(self, pct):
+        return self.jobstats.duration_percentile(pct)
+
+    def wait_time_percentile(self, pct):
+        return self.jobstats.wait_percentile(pct)
 
     def get_loads(self):
         """
@@ -334,9 +908,9 @@ class SGEStats(object):
         # second field is the number of hosts
         bits.append(self.count_hosts())
         # third field is # of running jobs
-        bits.append(len(self.get_running_jobs()))
+        bits.append(self.count_running_tasks())
         # fourth field is # of queued jobs
-        bits.append(len(self.get_queued_jobs()))
+        bits.append(self.count_queued_tasks())
         # fifth field is total # slots
         bits.append(self.count_total_slots())
         # sixth field is average job duration
@@ -354,20 +928,6 @@ class SGEStats(object):
         bits.append(avg_load)
         return bits
 
-    def write_stats_to_csv(self, filename):
-        """
-        Write important SGE stats to CSV file
-        Appends one line to the CSV
-        """
-        bits = self.get_all_stats()
-        try:
-            f = open(filename, 'a')
-            flat = ','.join(str(n) for n in bits) + '\n'
-            f.write(flat)
-            f.close()
-        except IOError as e:
-            raise exception.BaseException(str(e))
-
 
 class SGELoadBalancer(LoadBalancer):
     """
@@ -376,8 +936,8 @@ class SGELoadBalancer(LoadBalancer):
 
     *** All times are in SECONDS unless otherwise specified ***
 
-    The polling interval in seconds. Must be <= 300 seconds. The polling loop
-    with visualizer takes about 15 seconds.
+    The polling interval in seconds. Must be <= 300 seconds. Stats plots are
+    rendered in a background thread and do not slow down the polling loop.
     polling_interval = 60
 
     VERY IMPORTANT: Set this to the max nodes you're willing to have in your
@@ -410,20 +970,38 @@ class SGELoadBalancer(LoadBalancer):
     Visualizer off by default. Start it with "starcluster loadbalance -p tag"
     plot_stats = False
 
-    How many hours qacct should look back to gather past job data. lower
-    values minimize data transfer
+    How many hours of completed jobs from the SGE accounting file to include
+    in the job duration and wait time statistics
     lookback_window = 3
+
+    Autoscaling policy used to decide how many nodes to add: 'reactive' adds
+    nodes once a job has waited longer than wait_time, 'predictive' sizes the
+    cluster ahead of demand from the job arrival rate, average job duration
+    and node boot time (see starcluster.balancers.sge.policy)
+    policy = 'reactive'
+
+    CSV file with the slots, memory, GPUs and flat-rate/spot prices of the
+    instance types nodes may be added with. Each queue with waiting jobs is
+    scaled with the cheapest of the cluster's node_instance_type(s) and the
+    table's instance types that can run its jobs, launched as spot instances
+    when cheaper (see starcluster.balancers.sge.costs)
+    cost_table = None
     """
 
     def __init__(self, interval=60, max_nodes=None, wait_time=900,
                  add_pi=1, kill_after=45, stab=180, lookback_win=3,
                  min_nodes=None, kill_cluster=False, plot_stats=False,
-                 plot_output_dir=None, dump_stats=False, stats_file=None):
+                 plot_output_dir=None, dump_stats=False, stats_file=None,
+                 compress_stats=True, policy='reactive', cost_table=None):
         self._cluster = None
         self._keep_polling = True
         self._visualizer = None
+        self._stats_store = None
         self._stat = None
-        self.__last_cluster_mod_time = utils.get_utc_now()
+        self._accounting = AccountingCursor()
+        self._remote_time = None
+        self.stats_latency = {}
+        self.__last_cluster_mod_time = self._get_utc_now()
         self.polling_interval = interval
         self.kill_after = kill_after
         self.longest_allowed_queue_time = wait_time
@@ -437,16 +1015,29 @@ class SGELoadBalancer(LoadBalancer):
         self.stats_file = stats_file
         self.plot_stats = plot_stats
         self.plot_output_dir = plot_output_dir
+        self.compress_stats = compress_stats
+        self.policy = sge_policy.get_policy(
+            policy, longest_allowed_queue_time=wait_time)
+        self.costs = sge_costs.get_cost_table(cost_table)
+        self._state = None
         if plot_stats:
             assert self.visualizer is not None
 
     @property
     def stat(self):
         if not self._stat:
-            rtime = self.get_remote_time()
-            self._stat = SGEStats(remote_tzinfo=rtime.tzinfo)
+            rtime = self.get_remote_time(cached=True)
+            window = self.lookback_window * 60 * 60
+            self._stat = SGEStats(remote_tzinfo=rtime.tzinfo,
+                                  jobstats_window=window)
         return self._stat
 
+    @property
+    def stats_store(self):
+        if not self._stats_store or self._stats_store.path != self.stats_file:
+            self._stats_store = timeseries.TimeSeriesStore(self.stats_file)
+        return self._stats_store
+
     @property
     def visualizer(self):
         if not self._visualizer:
@@ -492,18 +1083,35 @@ class SGELoadBalancer(LoadBalancer):
             except IOError as e:
                 raise exception.BaseException(str(e))
 
-    def get_remote_time(self):
+    def _get_utc_now(self):
+        """
+        Returns the local time used to track cluster modifications
+        """
+        return utils.get_utc_now()
+
+    def get_remote_time(self, cached=False):
         """
         This function remotely executes 'date' on the master node
         and returns a datetime object with the master's time
         instead of fetching it from local machine, maybe inaccurate.
+
+        If cached is True and the master's time was recorded during the last
+        stats collection the current time is extrapolated from it instead of
+        making another round trip to the master.
         """
+        if cached and self._remote_time:
+            rtime, recorded = self._remote_time
+            return rtime + datetime.timedelta(seconds=time.time() - recorded)
         cmd = 'date --iso-8601=seconds'
         date_str = '\n'.join(self._cluster.master_node.ssh.execute(cmd))
         d = utils.iso_to_datetime_tuple(date_str)
+        self._set_remote_time(d)
+        return d
+
+    def _set_remote_time(self, d):
+        self._remote_time = (d, time.time())
         if self._stat:
             self._stat.remote_tzinfo = d.tzinfo
-        return d
 
     def get_qatime(self, now):
         """
@@ -521,27 +1129,65 @@ class SGELoadBalancer(LoadBalancer):
         now = now - datetime.timedelta(seconds=temp_lookback_window + 1)
         return now.strftime("%Y%m%d%H%M")
 
+    def _get_stats_commands(self):
+        acct = self._accounting
+        return [('date', 'date --iso-8601=seconds'),
+                ('qhost', 'qhost -xml'),
+                ('qstat', "qstat -u '*' -xml -f -r"),
+                ('acct_stat', "stat -c '%%i %%s' %s" % acct.path),
+                ('acct', 'tail -c +%d %s' % (acct.offset + 1, acct.path))]
+
     def _get_stats(self):
+        """
+        Collects the master's time, qhost, qstat and new accounting records
+        using a single remote command and feeds them to SGEStats
+        """
         master = self._cluster.master_node
-        now = self.get_remote_time()
-        qatime = self.get_qatime(now)
-        qacct_cmd = 'qacct -j -b ' + qatime
-        qstat_cmd = 'qstat -u \* -xml -f -r'
-        qhostxml = '\n'.join(master.ssh.execute('qhost -xml'))
-        qstatxml = '\n'.join(master.ssh.execute(qstat_cmd))
-        try:
-            qacct = '\n'.join(master.ssh.execute(qacct_cmd))
-        except exception.RemoteCommandFailed:
-            if master.ssh.isfile('/opt/sge6/default/common/accounting'):
-                raise
-            else:
-                log.info("No jobs have completed yet!")
-                qacct = ''
-        self.stat.parse_qhost(qhostxml)
-        self.stat.parse_qstat(qstatxml)
-        self.stat.parse_qacct(qacct, now)
-        log.debug("sizes: qhost: %d, qstat: %d, qacct: %d" %
-                  (len(qhostxml), len(qstatxml), len(qacct)))
+        if not self._accounting.restored:
+            start_time = time.time() - self.lookback_window * 60 * 60
+            self._accounting.restore(master.ssh, start_time)
+        script = build_stats_script(self._get_stats_commands(),
+                                    compress=self.compress_stats)
+        result = master.ssh.run_command(script, log_output=False)
+        if result.failed:
+            raise exception.RemoteCommandFailed(
+                "failed to collect SGE stats: %s" % result.stderr.strip(),
+                script, result.exit_status, result.output)
+        frames = parse_stats_bundle(result.stdout,
+                                    compress=self.compress_stats)
+        for name in ['date', 'qhost', 'qstat']:
+            if frames[name].failed:
+                raise exception.RemoteCommandFailed(
+                    "%s exited with status %d" % (name,
+                                                  frames[name].exit_status),
+                    name, frames[name].exit_status, frames[name].output)
+        now = utils.iso_to_datetime_tuple(frames['date'].stdout.strip())
+        self._set_remote_time(now)
+        if frames['acct_stat'].failed:
+            log.info("No jobs have completed yet!")
+            acct = ''
+        else:
+            inode, size = frames['acct_stat'].stdout.split()
+            acct = self._accounting.advance(frames['acct'].stdout,
+                                            size=int(size), inode=inode)
+            if acct is None:
+                acct = self._accounting.read(master.ssh)
+        self.stat.parse_qhost(frames['qhost'].stdout)
+        self.stat.parse_qstat(frames['qstat'].stdout)
+        since = utils.datetime_to_unix_time(now) - self.stat.jobstats.window
+        self.stat.parse_accounting(acct, since=since)
+        self.stat.jobstats.expire(now)
+        self.stats_latency = dict([(name, frame.elapsed)
+                                   for name, frame in frames.items()])
+        self.stats_latency['total'] = result.elapsed
+        log.debug("stats latency: total: %.3fs, %s" % (
+            result.elapsed, ', '.join(["%s: %.3fs" % (name, frame.elapsed)
+                                       for name, frame in frames.items()])))
+        log.debug("sizes: bundle: %d, qhost: %d, qstat: %d, accounting: %d "
+                  "(offset: %d)" % (len(result.stdout),
+                                    len(frames['qhost'].stdout),
+                                    len(frames['qstat'].stdout), len(acct),
+                                    self._accounting.offset))
         return self.stat
 
     @utils.print_timing("Fetching SGE stats", debug=True)
@@ -567,12 +1213,9 @@ class SGELoadBalancer(LoadBalancer):
             "Failed to retrieve SGE stats after trying %d times, exiting..." %
             retries)
 
-    def run(self, cluster):
+    def _init_cluster(self, cluster):
         """
-        This function will loop indefinitely, using SGELoadBalancer.get_stats()
-        to get the clusters status. It looks at the job queue and tries to
-        decide whether to add or remove a node.  It should later look at job
-        durations (currently doesn't)
+        Sets the cluster to balance and defaults min_nodes/max_nodes from it
         """
         self._cluster = cluster
         if self.max_nodes is None:
@@ -584,10 +1227,27 @@ class SGELoadBalancer(LoadBalancer):
         if self.min_nodes > self.max_nodes:
             raise exception.BaseException(
                 "min_nodes cannot be greater than max_nodes")
-        use_default_stats_file = self.dump_stats and not self.stats_file
-        use_default_plots_dir = self.plot_stats and not self.plot_output_dir
-        if use_default_stats_file or use_default_plots_dir:
-            self._mkdir(DEFAULT_STATS_DIR % cluster.cluster_tag, makedirs=True)
+
+    def _update_stats(self):
+        """
+        Fetches new stats from the master and feeds the resulting cluster
+        state to the autoscaling policy
+        """
+        self.get_stats()
+        self._state = None
+        self.policy.observe(self._get_cluster_state())
+
+    def run(self, cluster):
+        """
+        This function will loop indefinitely, using SGELoadBalancer.get_stats()
+        to get the clusters status. It looks at the job queue and tries to
+        decide whether to add or remove a node.  It should later look at job
+        durations (currently doesn't)
+        """
+        self._init_cluster(cluster)
+        self._mkdir(DEFAULT_STATS_DIR % cluster.cluster_tag, makedirs=True)
+        self._accounting.state_file = (ACCOUNTING_STATE_FILE %
+                                       cluster.cluster_tag)
         if not self.stats_file:
             self.stats_file = DEFAULT_STATS_FILE % cluster.cluster_tag
         if not self.plot_output_dir:
@@ -619,14 +1279,23 @@ class SGELoadBalancer(LoadBalancer):
             log.info("Writing stats to file: %s" % self.stats_file)
         if self.plot_stats:
             log.info("Plotting stats to directory: %s" % self.plot_output_dir)
+            self.visualizer.start()
+        try:
+            return self._poll(cluster)
+        finally:
+            if self._visualizer:
+                self._visualizer.stop()
+
+    def _poll(self, cluster):
+        raw = dict(__raw__=True)
         while(self._keep_polling):
             if not cluster.is_cluster_up():
                 log.info("Waiting for all nodes to come up...")
                 time.sleep(self.polling_interval)
                 continue
-            self.get_stats()
+            self._update_stats()
             log.info("Execution hosts: %d" % len(self.stat.hosts), extra=raw)
-            log.info("Queued jobs: %d" % len(self.stat.get_queued_jobs()),
+            log.info("Queued jobs: %d" % self.stat.count_queued_tasks(),
                      extra=raw)
             oldest_queued_job_age = self.stat.oldest_queued_job_age()
             if oldest_queued_job_age:
@@ -636,6 +1305,9 @@ class SGELoadBalancer(LoadBalancer):
                      self.stat.avg_job_duration(), extra=raw)
             log.info("Avg job wait time: %d secs" % self.stat.avg_wait_time(),
                      extra=raw)
+            log.info("Job duration p50/p95: %d/%d secs" %
+                     (self.stat.job_duration_percentile(50),
+                      self.stat.job_duration_percentile(95)), extra=raw)
             log.info("Last cluster modification time: %s" %
                      self.__last_cluster_mod_time.strftime("%Y-%m-%d %X%z"),
                      extra=dict(__raw__=True))
@@ -644,13 +1316,13 @@ class SGELoadBalancer(LoadBalancer):
             # evaluate if nodes need to be removed
             self._eval_remove_node()
             if self.dump_stats or self.plot_stats:
-                self.stat.write_stats_to_csv(self.stats_file)
-            # call the visualizer
-            if self.plot_stats:
                 try:
-                    self.visualizer.graph_all()
-                except IOError as e:
+                    self.stats_store.append(self.stat.get_all_stats())
+                except (IOError, OSError), e:
                     raise exception.BaseException(str(e))
+            # redraw the plots in the background
+            if self.plot_stats:
+                self.visualizer.notify()
             # evaluate if cluster should be terminated
             if self.kill_cluster:
                 if self._eval_terminate_cluster():
@@ -660,8 +1332,21 @@ class SGELoadBalancer(LoadBalancer):
                      self.polling_interval)
             time.sleep(self.polling_interval)
 
+    def _get_cluster_state(self):
+        """
+        Returns a policy.ClusterState for the current iteration's stats
+        """
+        if self._state is None:
+            now = self.get_remote_time(cached=True)
+            num_nodes = len(self._cluster.nodes)
+            host_types = dict([(n.alias, n.instance_type)
+                               for n in self._cluster.running_nodes])
+            self._state = sge_policy.ClusterState.from_stats(
+                self.stat, num_nodes, now, host_types=host_types)
+        return self._state
+
     def has_cluster_stabilized(self):
-        now = utils.get_utc_now()
+        now = self._get_utc_now()
         elapsed = (now - self.__last_cluster_mod_time).seconds
         is_stabilized = not (elapsed < self.stabilization_time)
         if not is_stabilized:
@@ -681,62 +1366,81 @@ class SGELoadBalancer(LoadBalancer):
             log.info("Not adding nodes: already at or above maximum (%d)" %
                      self.max_nodes)
             return
-        queued_jobs = self.stat.get_queued_jobs()
-        if not queued_jobs and num_nodes >= self.min_nodes:
+        # only the reactive policy can skip an empty queue: other policies
+        # may add nodes ahead of demand
+        qw_slots = self.stat.count_queued_slots()
+        if not qw_slots and num_nodes >= self.min_nodes and \
+                isinstance(self.policy, sge_policy.ReactivePolicy):
             log.info("Not adding nodes: at or above minimum nodes "
                      "and no queued jobs...")
             return
-        total_slots = self.stat.count_total_slots()
-        if not self.has_cluster_stabilized() and total_slots > 0:
+        state = self._get_cluster_state()
+        if not self.has_cluster_stabilized() and state.total_slots > 0:
             return
-        running_jobs = self.stat.get_running_jobs()
-        used_slots = sum([int(j['slots']) for j in running_jobs])
-        qw_slots = sum([int(j['slots']) for j in queued_jobs])
-        slots_per_host = self.stat.slots_per_host()
-        avail_slots = total_slots - used_slots
-        need_to_add = 0
         if num_nodes < self.min_nodes:
             log.info("Adding node: below minimum (%d)" % self.min_nodes)
             need_to_add = self.min_nodes - num_nodes
-        elif total_slots == 0:
-            # no slots, add one now
-            need_to_add = 1
-        elif qw_slots > avail_slots:
-            log.info("Queued jobs need more slots (%d) than available (%d)" %
-                     (qw_slots, avail_slots))
-            oldest_job_dt = self.stat.oldest_queued_job_age()
-            now = self.get_remote_time()
-            age_delta = now - oldest_job_dt
-            if age_delta.seconds > self.longest_allowed_queue_time:
-                log.info("A job has been waiting for %d seconds "
-                         "longer than max: %d" %
-                         (age_delta.seconds, self.longest_allowed_queue_time))
-                if slots_per_host != 0:
-                    need_to_add = qw_slots / slots_per_host
-                else:
-                    need_to_add = 1
-            else:
-                log.info("No queued jobs older than %d seconds" %
-                         self.longest_allowed_queue_time)
+        else:
+            need_to_add = self.policy.nodes_to_add(state)
         max_add = self.max_nodes - len(self._cluster.running_nodes)
         need_to_add = min(self.add_nodes_per_iteration, need_to_add, max_add)
         if need_to_add > 0:
             log.warn("Adding %d nodes at %s" %
-                     (need_to_add, str(utils.get_utc_now())))
+                     (need_to_add, str(self._get_utc_now())))
             try:
-                self._cluster.add_nodes(need_to_add)
-                self.__last_cluster_mod_time = utils.get_utc_now()
+                start = self._get_utc_now()
+                launch_types = self._get_launch_types()
+                plan = sge_policy.plan_additions(
+                    state, need_to_add, costs=self.costs,
+                    instance_types=sorted(launch_types))
+                for instance_type, count in plan:
+                    kwargs = self._get_launch_options(instance_type,
+                                                      launch_types)
+                    log.info("Adding %d node(s): %s" % (count, kwargs))
+                    self._cluster.add_nodes(count, **kwargs)
+                self.__last_cluster_mod_time = self._get_utc_now()
+                boot_time = self.__last_cluster_mod_time - start
+                self.policy.record_boot_time(boot_time.seconds)
                 log.info("Done adding nodes at %s" %
                          str(self.__last_cluster_mod_time))
             except Exception:
                 log.error("Failed to add new host", exc_info=True)
 
+    def _get_launch_types(self):
+        """
+        Returns a dictionary mapping the instance types nodes may be added
+        with to their image id (None for the cluster's node_image_id): the
+        cluster's node_instance_type, the types in its node_instance_type
+        launch map and the types in the cost table
+        """
+        cluster = self._cluster
+        types = dict([(itype, None) for itype in self.costs.instance_types])
+        if cluster.node_instance_type:
+            types[cluster.node_instance_type] = None
+        for itype in cluster.node_instance_types:
+            if itype['type']:
+                types[itype['type']] = itype['image']
+        return types
+
+    def _get_launch_options(self, instance_type, launch_types):
+        """
+        Returns the Cluster.add_nodes keyword arguments used to add nodes of
+        instance_type (None for the cluster's node_instance_type)
+        """
+        kwargs = dict(instance_type=instance_type)
+        if launch_types.get(instance_type):
+            kwargs['image_id'] = launch_types[instance_type]
+        itype = instance_type or self._cluster.node_instance_type
+        kwargs.update(self.costs.launch_options(
+            itype, spot_bid=self._cluster.spot_bid))
+        return kwargs
+
     def _eval_remove_node(self):
         """
         This function uses the sge stats to decide whether or not to
         remove a node from the cluster.
         """
-        qlen = len(self.stat.get_queued_jobs())
+        qlen = self.stat.count_queued_tasks()
         if qlen != 0:
             return
         if not self.has_cluster_stabilized():
@@ -746,24 +1450,37 @@ class SGELoadBalancer(LoadBalancer):
             log.info("Not removing nodes: already at or below minimum (%d)"
                      % self.min_nodes)
             return
-        max_remove = num_nodes - self.min_nodes
+        to_keep = self.policy.nodes_to_keep(self._get_cluster_state())
+        if to_keep > self.min_nodes:
+            log.info("Policy '%s' expects demand for %d node(s)" %
+                     (self.policy.name, to_keep))
+        max_remove = num_nodes - max(self.min_nodes, to_keep)
+        if max_remove <= 0:
+            return
         log.info("Looking for nodes to remove...")
         remove_nodes = self._find_nodes_for_removal(max_remove=max_remove)
         if not remove_nodes:
             log.info("No nodes can be removed at this time")
-        for node in remove_nodes:
-            if node.update() != "running":
+            return
+        self._cluster.invalidate_nodes()
+        running = set([n.id for n in self._cluster.running_nodes])
+        for node in remove_nodes[:]:
+            if node.id not in running:
                 log.error("Node %s is already dead - not removing" %
                           node.alias)
+                remove_nodes.remove(node)
                 continue
             log.warn("Removing %s: %s (%s)" %
                      (node.alias, node.id, node.dns_name))
-            try:
-                self._cluster.remove_node(node)
-                self.__last_cluster_mod_time = utils.get_utc_now()
-            except Exception:
-                log.error("Failed to remove node %s" % node.alias,
-                          exc_info=True)
+        if not remove_nodes:
+            return
+        try:
+            self._cluster.remove_nodes(nodes=remove_nodes)
+            self.__last_cluster_mod_time = self._get_utc_now()
+        except Exception:
+            log.error("Failed to remove node(s) %s" %
+                      ', '.join([n.alias for n in remove_nodes]),
+                      exc_info=True)
 
     def _eval_terminate_cluster(self):
         """
@@ -777,16 +1494,18 @@ class SGELoadBalancer(LoadBalancer):
             return False
         return self._should_remove(self._cluster.master_node)
 
-    def _should_remove(self, node):
+    def _should_remove(self, node, now=None):
         """
         Determines whether a node is eligible to be removed based on:
 
         1. The node must not be running any SGE job
         2. The node must have been up for self.kill_after min past the hour
+
+        now - the master's current time (fetched from the master if None)
         """
         if self.stat.is_node_working(node):
             return False
-        mins_up = self._minutes_uptime(node) % 60
+        mins_up = self._minutes_uptime(node, now=now) % 60
         idle_msg = ("Idle node %s (%s) has been up for %d minutes past "
                     "the hour" % (node.alias, node.id, mins_up))
         if mins_up >= self.kill_after:
@@ -808,16 +1527,17 @@ class SGELoadBalancer(LoadBalancer):
         removal.
         """
         remove_nodes = []
+        now = self.get_remote_time(cached=True)
         for node in self._cluster.running_nodes:
             if max_remove is not None and len(remove_nodes) >= max_remove:
                 return remove_nodes
             if node.is_master():
                 continue
-            if self._should_remove(node):
+            if self._should_remove(node, now=now):
                 remove_nodes.append(node)
         return remove_nodes
 
-    def _minutes_uptime(self, node):
+    def _minutes_uptime(self, node, now=None):
         """
         This function uses the node's launch_time to determine how many minutes
         this instance has been running. You can mod (%) the return value with
@@ -825,6 +1545,6 @@ class SGELoadBalancer(LoadBalancer):
         been running.
         """
         dt = utils.iso_to_datetime_tuple(node.launch_time)
-        now = self.get_remote_time()
+        now = now or self.get_remote_time(cached=True)
         timedelta = now - dt
         return timedelta.seconds / 60
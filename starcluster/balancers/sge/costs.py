@@ -0,0 +1,241 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Instance type cost/capacity table for the SGE load balancer
+
+The load balancer uses a CostTable to decide which instance type to launch
+for the jobs waiting in each SGE queue and whether to launch it as a spot or
+flat-rate instance. Tables are loaded from a CSV file with one row per
+instance type (blank fields are unknown):
+
+    # instance_type,slots,memory_gb,gpus,price,spot_price
+    c5.2xlarge,8,16,0,0.34,0.13
+    c5.9xlarge,36,72,0,1.53,0.58
+    p3.2xlarge,8,61,1,3.06,
+
+Instance types must be listed in static.INSTANCE_TYPES and the number of GPUs
+defaults to static.GPU_COUNTS. Slots per host that are not in the table are
+taken from the hosts of that type already in the queue.
+"""
+import csv
+import math
+
+from starcluster import static
+from starcluster import exception
+from starcluster.logger import log
+
+
+def queue_accepts(queue, instance_type):
+    """
+    Returns True if the SGE plugin adds hosts of instance_type to queue:
+    gpu.q only gets GPU instances, cpu.q only non-GPU instances and mem.q
+    only high-memory instances. All other queues accept any type.
+    """
+    is_gpu = (instance_type in static.CLUSTER_GPU_TYPES or
+              instance_type in static.GPU_COMPUTE_TYPES)
+    if queue == 'gpu.q':
+        return is_gpu
+    if queue == 'cpu.q':
+        return not is_gpu
+    if queue == 'mem.q':
+        return instance_type in static.HIMEM_COMPUTE_TYPES
+    return True
+
+
+class InstanceCost(object):
+    """
+    Capacity and hourly prices of a single instance type. None means unknown.
+    """
+    __slots__ = ('instance_type', 'slots', 'memory', 'gpus', 'price',
+                 'spot_price')
+
+    def __init__(self, instance_type, slots=None, memory=None, gpus=None,
+                 price=None, spot_price=None):
+        self.instance_type = instance_type
+        self.slots = slots
+        self.memory = memory
+        if gpus is None:
+            gpus = static.GPU_COUNTS.get(instance_type, 0)
+        self.gpus = gpus
+        self.price = price
+        self.spot_price = spot_price
+
+    def __repr__(self):
+        return "<InstanceCost: %s (slots: %s, price: %s, spot: %s)>" % (
+            self.instance_type, self.slots, self.price, self.spot_price)
+
+    @property
+    def use_spot(self):
+        """
+        True if spot instances are cheaper than flat-rate instances
+        """
+        return (self.price is not None and self.spot_price is not None and
+                self.spot_price < self.price)
+
+    @property
+    def hourly_price(self):
+        """
+        The cheapest known hourly price or None if unknown
+        """
+        prices = [p for p in (self.price, self.spot_price) if p is not None]
+        if prices:
+            return min(prices)
+
+    def can_run(self, slots=0, gpus=0, memory=0):
+        """
+        Returns False if a single task needing slots, gpus and memory (GB)
+        cannot fit on one instance of this type
+        """
+        if self.slots is not None and slots > self.slots:
+            return False
+        if gpus > self.gpus:
+            return False
+        if memory and self.memory is not None and memory > self.memory:
+            return False
+        return True
+
+
+class CostTable(object):
+    """
+    Maps instance types to InstanceCost objects and picks the cheapest
+    instance type for a queue's demand
+    """
+    def __init__(self, costs=None):
+        self.costs = {}
+        for cost in costs or []:
+            self.add(cost)
+
+    def add(self, cost):
+        if cost.instance_type not in static.INSTANCE_TYPES:
+            raise exception.BaseException(
+                "invalid instance type in cost table: %s" %
+                cost.instance_type)
+        self.costs[cost.instance_type] = cost
+
+    def get(self, instance_type):
+        """
+        Returns the InstanceCost for instance_type (all fields unknown if the
+        type is not in the table)
+        """
+        return self.costs.get(instance_type) or InstanceCost(instance_type)
+
+    @property
+    def instance_types(self):
+        return sorted(self.costs)
+
+    @classmethod
+    def from_file(cls, filename):
+        """
+        Loads a table from a CSV file (see module docstring)
+        """
+        table = cls()
+        types = [str, int, float, int, float, float]
+        try:
+            with open(filename) as f:
+                rows = list(csv.reader(f))
+        except IOError, e:
+            raise exception.BaseException("error reading cost table: %s" % e)
+        for row in rows:
+            if not row or row[0].strip().startswith('#'):
+                continue
+            row = [r.strip() for r in row]
+            try:
+                values = [t(v) if v else None for t, v in zip(types, row)]
+            except ValueError:
+                raise exception.BaseException(
+                    "invalid cost table entry in %s: %s" %
+                    (filename, ','.join(row)))
+            table.add(InstanceCost(*values))
+        return table
+
+    def _avg_price_per_slot(self):
+        prices = [c.hourly_price / c.slots for c in self.costs.values()
+                  if c.hourly_price is not None and c.slots]
+        if prices:
+            return sum(prices) / len(prices)
+
+    def choose(self, queue, instance_types):
+        """
+        Returns (instance_type, slots_per_host) for the cheapest type in
+        instance_types that queue (a policy.QueueState) accepts and that can
+        run the largest task queued in it, or (None, None) if there is no
+        such type with a known number of slots.
+
+        The cost of a type is the number of hosts needed to cover the queue's
+        deficit times its hourly price. Types without a price are assumed to
+        cost the average price per slot of the priced types (one unit per
+        slot if none are priced) so without prices the type that wastes the
+        fewest slots wins.
+        """
+        per_slot = self._avg_price_per_slot() or 1.0
+        best = None
+        for itype in instance_types:
+            if not queue_accepts(queue.name, itype):
+                continue
+            cost = self.get(itype)
+            slots = cost.slots
+            if not slots and itype in queue.host_types.values():
+                slots = queue.slots_per_host(itype)
+            if not slots:
+                continue
+            if not cost.can_run(queue.max_job_slots, queue.max_job_gpus,
+                                queue.max_job_memory):
+                continue
+            price = cost.hourly_price
+            if price is None:
+                price = per_slot * slots
+            nodes = int(math.ceil(queue.deficit / float(slots)))
+            key = (nodes * price, nodes, itype)
+            if best is None or key < best[0]:
+                best = (key, itype, slots)
+        if best is None:
+            log.info("No known instance type can run the jobs queued in %s" %
+                     queue.name)
+            return None, None
+        (total, nodes, itype), itype, slots = best
+        log.info("Cheapest instance type for %s: %d x %s (%.2f/hour)" %
+                 (queue.name, nodes, itype, total))
+        return itype, slots
+
+    def launch_options(self, instance_type, spot_bid=None):
+        """
+        Returns the Cluster.add_nodes keyword arguments that choose between
+        spot and flat-rate instances of instance_type. Spot instances are
+        used when the table's spot price is below its flat-rate price,
+        bidding spot_bid or the flat-rate price if spot_bid is None. Returns
+        an empty dict (the cluster's defaults) if the flat-rate price is
+        unknown.
+        """
+        cost = self.costs.get(instance_type)
+        if cost is None or cost.price is None:
+            return {}
+        if cost.use_spot:
+            return dict(spot_bid=spot_bid or cost.price)
+        return dict(force_flat=True)
+
+
+def get_cost_table(cost_table=None):
+    """
+    Returns a CostTable given a CSV file name, an existing CostTable which is
+    returned as is or None for an empty table
+    """
+    if isinstance(cost_table, CostTable):
+        return cost_table
+    if cost_table is None:
+        return CostTable()
+    return CostTable.from_file(cost_table)
@@ -0,0 +1,490 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Autoscaling policies for the SGE load balancer
+
+A policy is given a ClusterState snapshot on every balancer iteration and
+decides how many nodes should be added (nodes_to_add) and how many nodes must
+be kept even if they are idle (nodes_to_keep). The balancer still enforces
+min_nodes/max_nodes, add_nodes_per_iteration and the stabilization time.
+
+plan_additions() splits the nodes a policy wants to add between the cluster
+queues that have jobs waiting, sizing each queue's share using the slots per
+host of the instance type that serves the queue.
+
+replay() evaluates a policy offline against the stats recorded by the load
+balancer's --dump-stats option.
+"""
+import csv
+import math
+
+from starcluster import utils
+from starcluster import exception
+from starcluster.balancers.sge import timeseries
+from starcluster.logger import log
+
+
+class QueueState(object):
+    """
+    Slot usage of a single SGE cluster queue (e.g. all.q, cpu.q or gpu.q)
+
+    host_slots maps each host in the queue to its number of slots and
+    host_types maps hosts to their EC2 instance type (when known). The
+    max_job_* attributes are the largest slots, GPUs and memory (GB) needed
+    by a single queued task, i.e. what a new host must be able to provide.
+    """
+    __slots__ = ('name', 'total_slots', 'used_slots', 'queued_slots',
+                 'host_slots', 'host_types', 'max_job_slots', 'max_job_gpus',
+                 'max_job_memory')
+
+    def __init__(self, name, total_slots=0, used_slots=0, queued_slots=0,
+                 host_slots=None, host_types=None, max_job_slots=0,
+                 max_job_gpus=0, max_job_memory=0):
+        self.name = name
+        self.total_slots = total_slots
+        self.used_slots = used_slots
+        self.queued_slots = queued_slots
+        self.host_slots = host_slots or {}
+        self.host_types = host_types or {}
+        self.max_job_slots = max_job_slots
+        self.max_job_gpus = max_job_gpus
+        self.max_job_memory = max_job_memory
+
+    @property
+    def avail_slots(self):
+        return self.total_slots - self.used_slots
+
+    @property
+    def deficit(self):
+        """
+        Number of queued slots that cannot be started on the available slots
+        """
+        return max(self.queued_slots - max(self.avail_slots, 0), 0)
+
+    @property
+    def instance_type(self):
+        """
+        The most common instance type of the hosts in this queue or None if
+        unknown. Ties go to the type with the most slots per host.
+        """
+        counts = {}
+        for host in self.host_slots:
+            itype = self.host_types.get(host)
+            if itype:
+                counts[itype] = counts.get(itype, 0) + 1
+        if not counts:
+            return None
+        return max(counts, key=lambda t: (counts[t], self.slots_per_host(t)))
+
+    def slots_per_host(self, instance_type=None):
+        """
+        Returns the slots per host of instance_type hosts in this queue or the
+        average slots per host if instance_type is None or has no hosts in
+        the queue (0 if the queue has no hosts)
+        """
+        slots = [s for h, s in self.host_slots.items()
+                 if self.host_types.get(h) == instance_type]
+        if not slots or instance_type is None:
+            slots = self.host_slots.values()
+        if not slots:
+            return 0
+        return max(sum(slots) / len(slots), 1)
+
+
+class ClusterState(object):
+    """
+    Snapshot of the cluster and SGE queue for a single balancer iteration
+
+    time is seconds since the epoch, durations and ages are in seconds and
+    slot counts are totals across all hosts in the default queue (all.q).
+    queues maps each cluster queue name to a QueueState.
+    """
+    __slots__ = ('time', 'num_nodes', 'total_slots', 'used_slots',
+                 'queued_slots', 'running_tasks', 'queued_tasks',
+                 'slots_per_host', 'avg_duration', 'avg_wait',
+                 'oldest_queued_age', 'queues')
+
+    def __init__(self, time, num_nodes, total_slots=0, used_slots=0,
+                 queued_slots=0, running_tasks=0, queued_tasks=0,
+                 slots_per_host=0, avg_duration=0, avg_wait=0,
+                 oldest_queued_age=None, queues=None):
+        self.time = time
+        self.num_nodes = num_nodes
+        self.total_slots = total_slots
+        self.used_slots = used_slots
+        self.queued_slots = queued_slots
+        self.running_tasks = running_tasks
+        self.queued_tasks = queued_tasks
+        self.slots_per_host = slots_per_host
+        self.avg_duration = avg_duration
+        self.avg_wait = avg_wait
+        self.oldest_queued_age = oldest_queued_age
+        self.queues = queues or {}
+
+    @property
+    def avail_slots(self):
+        return self.total_slots - self.used_slots
+
+    @classmethod
+    def from_stats(cls, stat, num_nodes, now, host_types=None):
+        """
+        Create a ClusterState from an SGEStats object. now is the master's
+        current time as a datetime object and host_types optionally maps host
+        names to their EC2 instance type.
+        """
+        oldest_age = None
+        oldest = stat.oldest_queued_job_age()
+        if oldest:
+            oldest_age = (now - oldest).seconds
+        queues = {}
+        for name, q in stat.get_queue_stats().items():
+            queues[name] = QueueState(name, total_slots=q['total_slots'],
+                                      used_slots=q['used_slots'],
+                                      queued_slots=q['queued_slots'],
+                                      host_slots=q['hosts'],
+                                      host_types=host_types,
+                                      max_job_slots=q['max_job_slots'],
+                                      max_job_gpus=q['max_job_gpus'],
+                                      max_job_memory=q['max_job_memory'])
+        return cls(utils.datetime_to_unix_time(now), num_nodes,
+                   total_slots=stat.count_total_slots(),
+                   used_slots=stat.count_used_slots(),
+                   queued_slots=stat.count_queued_slots(),
+                   running_tasks=stat.count_running_tasks(),
+                   queued_tasks=stat.count_queued_tasks(),
+                   slots_per_host=stat.slots_per_host(),
+                   avg_duration=stat.avg_job_duration(),
+                   avg_wait=stat.avg_wait_time(),
+                   oldest_queued_age=oldest_age, queues=queues)
+
+
+class ScalingPolicy(object):
+    """
+    Base class for SGE load balancer autoscaling policies
+    """
+    name = None
+
+    def __init__(self, longest_allowed_queue_time=900):
+        self.longest_allowed_queue_time = longest_allowed_queue_time
+
+    def observe(self, state):
+        """
+        Called once per balancer iteration with the current ClusterState
+        before nodes_to_add/nodes_to_keep
+        """
+        pass
+
+    def record_boot_time(self, seconds):
+        """
+        Called after the balancer has added nodes with the number of seconds
+        it took for the new nodes to come up and be configured
+        """
+        pass
+
+    def nodes_to_add(self, state):
+        """
+        Returns the number of nodes that should be added to the cluster
+        """
+        raise NotImplementedError('nodes_to_add method not implemented')
+
+    def nodes_to_keep(self, state):
+        """
+        Returns the number of nodes that should not be removed even if they
+        are idle
+        """
+        return 0
+
+
+class ReactivePolicy(ScalingPolicy):
+    """
+    Adds nodes once the queued jobs need more slots than are available and
+    the oldest queued job has waited longer than longest_allowed_queue_time.
+    This is the load balancer's original algorithm.
+    """
+    name = 'reactive'
+
+    def nodes_to_add(self, state):
+        if state.total_slots == 0:
+            # no slots, add one now
+            return 1
+        if state.queued_slots <= state.avail_slots:
+            return 0
+        log.info("Queued jobs need more slots (%d) than available (%d)" %
+                 (state.queued_slots, state.avail_slots))
+        age = state.oldest_queued_age
+        if age is None or age <= self.longest_allowed_queue_time:
+            log.info("No queued jobs older than %d seconds" %
+                     self.longest_allowed_queue_time)
+            return 0
+        log.info("A job has been waiting for %d seconds longer than max: %d" %
+                 (age, self.longest_allowed_queue_time))
+        if state.slots_per_host != 0:
+            return state.queued_slots / state.slots_per_host
+        return 1
+
+
+class PredictivePolicy(ScalingPolicy):
+    """
+    Sizes the cluster ahead of demand using the rate at which slots are
+    requested, the average job duration and the time it takes new nodes to
+    boot
+
+    The arrival rate (slots/sec) is estimated each iteration from the change
+    in queued + running slots plus the slots that completed since the last
+    iteration (used_slots * elapsed / avg_duration) and smoothed using an
+    exponentially weighted moving average. The target capacity is the number
+    of slots needed to keep up with arrivals (rate * avg_duration) plus the
+    slots needed to drain the backlog expected by the time new nodes have
+    booted within longest_allowed_queue_time. Falls back to ReactivePolicy
+    until there is enough history to estimate the rate and job duration.
+    """
+    name = 'predictive'
+
+    def __init__(self, longest_allowed_queue_time=900, boot_time=300,
+                 smoothing=0.3):
+        super(PredictivePolicy, self).__init__(longest_allowed_queue_time)
+        self.boot_time = boot_time
+        self.smoothing = smoothing
+        self.arrival_rate = None
+        self._last = None
+        self._reactive = ReactivePolicy(longest_allowed_queue_time)
+
+    def _ewma(self, old, new):
+        if old is None:
+            return new
+        return self.smoothing * new + (1 - self.smoothing) * old
+
+    def observe(self, state):
+        last = self._last
+        self._last = state
+        if last is None or state.time <= last.time:
+            return
+        elapsed = state.time - last.time
+        completed = 0
+        if state.avg_duration:
+            completed = last.used_slots * elapsed / float(state.avg_duration)
+        demand = state.queued_slots + state.used_slots
+        last_demand = last.queued_slots + last.used_slots
+        arrivals = max(demand - last_demand + completed, 0)
+        self.arrival_rate = self._ewma(self.arrival_rate,
+                                       arrivals / float(elapsed))
+
+    def record_boot_time(self, seconds):
+        self.boot_time = self._ewma(self.boot_time, seconds)
+
+    def _can_predict(self, state):
+        return (self.arrival_rate is not None and state.avg_duration > 0 and
+                state.slots_per_host > 0)
+
+    def target_slots(self, state):
+        """
+        Returns the number of slots needed once nodes added now have booted
+        """
+        duration = float(state.avg_duration)
+        steady = self.arrival_rate * duration
+        capacity_rate = state.total_slots / duration
+        backlog = state.queued_slots + \
+            (self.arrival_rate - capacity_rate) * self.boot_time
+        drain_time = max(self.longest_allowed_queue_time, duration)
+        return steady + max(backlog, 0) * duration / drain_time
+
+    def nodes_to_add(self, state):
+        if state.total_slots == 0:
+            return 1
+        if not self._can_predict(state):
+            return self._reactive.nodes_to_add(state)
+        target = self.target_slots(state)
+        needed = target - state.total_slots
+        log.info("Predicted demand: %.1f slots (arrival rate: %.3f slots/s, "
+                 "boot time: %ds)" % (target, self.arrival_rate,
+                                      self.boot_time))
+        if needed <= 0:
+            return 0
+        return int(math.ceil(needed / state.slots_per_host))
+
+    def nodes_to_keep(self, state):
+        if not self._can_predict(state):
+            return 0
+        steady = self.arrival_rate * state.avg_duration
+        return int(math.ceil(steady / state.slots_per_host))
+
+
+POLICIES = dict([(p.name, p) for p in (ReactivePolicy, PredictivePolicy)])
+
+
+def get_policy(policy, **kwargs):
+    """
+    Returns a ScalingPolicy instance given a policy name (see POLICIES) or an
+    existing ScalingPolicy instance which is returned as is
+    """
+    if isinstance(policy, ScalingPolicy):
+        return policy
+    if policy not in POLICIES:
+        raise exception.BaseException(
+            "invalid load balancer policy '%s' (valid: %s)" %
+            (policy, ', '.join(sorted(POLICIES))))
+    return POLICIES[policy](**kwargs)
+
+
+def plan_additions(state, num_nodes, default_queue='all.q', costs=None,
+                   instance_types=None):
+    """
+    Splits num_nodes new nodes between the queues in state that have more
+    queued slots than available slots. Each queue needs enough hosts of the
+    instance type serving the queue (see QueueState.instance_type) to cover
+    its deficit and nodes are handed out one at a time to the queue with the
+    largest remaining need. Nodes for default_queue, for queues whose
+    instance type is unknown and any nodes left over once every deficit is
+    covered use instance type None (the cluster's node_instance_type).
+
+    If a costs.CostTable and a list of candidate instance_types are given
+    each queue instead uses the cheapest candidate that can run its largest
+    queued task (see CostTable.choose).
+
+    Returns a list of (instance_type, num_nodes) tuples.
+    """
+    needs = []
+    for queue in state.queues.values():
+        if queue.deficit <= 0:
+            continue
+        itype = slots = None
+        if costs is not None and instance_types:
+            itype, slots = costs.choose(queue, instance_types)
+        if itype is None and queue.name != default_queue:
+            itype = queue.instance_type
+        slots = slots or queue.slots_per_host(itype) or \
+            state.slots_per_host or 1
+        nodes = int(math.ceil(queue.deficit / float(slots)))
+        log.info("Queue %s needs %d more slots: %d %s node(s) with %d slots" %
+                 (queue.name, queue.deficit, nodes, itype or 'default',
+                  slots))
+        needs.append([nodes, queue.name, itype])
+    plan = {}
+    remaining = num_nodes
+    while remaining > 0 and needs:
+        need = max(needs)
+        if need[0] <= 0:
+            break
+        need[0] -= 1
+        plan[need[2]] = plan.get(need[2], 0) + 1
+        remaining -= 1
+    if remaining > 0:
+        plan[None] = plan.get(None, 0) + remaining
+    return sorted(plan.items(), key=lambda p: (p[0] is not None, p[0]))
+
+
+def _states_from_records(records):
+    queued_since = None
+    for record in records:
+        now = record[0]
+        hosts, running, queued, slots = [int(r) for r in record[1:5]]
+        avg_duration, avg_wait = [int(float(r)) for r in record[5:7]]
+        if queued and queued_since is None:
+            queued_since = now
+        elif not queued:
+            queued_since = None
+        age = now - queued_since if queued_since is not None else None
+        yield ClusterState(now, hosts, total_slots=slots,
+                           used_slots=running, queued_slots=queued,
+                           running_tasks=running, queued_tasks=queued,
+                           slots_per_host=slots / hosts if hosts else 0,
+                           avg_duration=avg_duration, avg_wait=avg_wait,
+                           oldest_queued_age=age)
+
+
+def read_stats_csv(filename):
+    """
+    Yields a ClusterState for each row of a stats CSV file written by older
+    versions of the load balancer's --dump-stats option. The CSV does not
+    record slots per job or job ages so each job is assumed to use one slot
+    and the oldest queued job age is the time the queue has been non-empty.
+    """
+    def _rows(f):
+        for row in csv.reader(f):
+            if not row:
+                continue
+            now = utils.iso_to_datetime_tuple(row[0])
+            yield [utils.datetime_to_unix_time(now)] + row[1:]
+    with open(filename) as f:
+        for state in _states_from_records(_rows(f)):
+            yield state
+
+
+def read_stats(filename):
+    """
+    Same as read_stats_csv but reads the time-series store written by the
+    load balancer's --dump-stats option (or a CSV written by older versions)
+    at the finest resolution that covers all of its stats
+    """
+    with open(filename, 'rb') as f:
+        is_store = f.read(len(timeseries.MAGIC)) == timeseries.MAGIC
+    if not is_store:
+        return read_stats_csv(filename)
+    store = timeseries.TimeSeriesStore(filename)
+    return _states_from_records(store.read())
+
+
+class ReplayResult(object):
+    """
+    Decisions made by a policy while replaying recorded cluster states
+    """
+    def __init__(self, policy):
+        self.policy = policy
+        self.decisions = []
+
+    def add(self, state, to_add, to_keep):
+        self.decisions.append((state, to_add, to_keep))
+
+    def summary(self):
+        starved = 0
+        scale_ups = 0
+        nodes_added = 0
+        first_add = None
+        for state, to_add, to_keep in self.decisions:
+            if to_add:
+                scale_ups += 1
+                nodes_added += to_add
+                if first_add is None:
+                    first_add = state.time
+            elif state.queued_slots > state.avail_slots:
+                starved += 1
+        start = self.decisions[0][0].time if self.decisions else None
+        return dict(policy=self.policy.name, iterations=len(self.decisions),
+                    scale_ups=scale_ups, nodes_added=nodes_added,
+                    starved_iterations=starved,
+                    first_add_after=(first_add - start
+                                     if first_add is not None else None))
+
+
+def replay(states, policy, add_nodes_per_iteration=None, max_nodes=None):
+    """
+    Feeds each ClusterState in states to policy and records the number of
+    nodes it would have added/kept. Nodes are not actually added so each
+    decision is made against the recorded cluster size. Returns a
+    ReplayResult.
+    """
+    result = ReplayResult(policy)
+    for state in states:
+        policy.observe(state)
+        to_add = policy.nodes_to_add(state)
+        if add_nodes_per_iteration is not None:
+            to_add = min(to_add, add_nodes_per_iteration)
+        if max_nodes is not None:
+            to_add = max(min(to_add, max_nodes - state.num_nodes), 0)
+        result.add(state, to_add, policy.nodes_to_keep(state))
+    return result
@@ -0,0 +1,562 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Offline discrete-event simulator for the SGE load balancer
+
+The simulator runs a real SGELoadBalancer against a simulated cluster and SGE
+queue without touching EC2. Each polling interval the balancer's stats are
+fed from qhost/qstat XML and accounting records rendered from the simulated
+queue and _eval_add_node/_eval_remove_node are called exactly as in
+SGELoadBalancer.run. Adding nodes blocks for boot_time simulated seconds
+while jobs keep arriving and completing, just like the real balancer blocks
+on Cluster.add_nodes.
+
+Workloads are lists of SimJob objects created with synthetic_workload(),
+workload_from_accounting() (a recorded SGE accounting file) or
+workload_from_qstat() (a recorded qstat -xml snapshot). The resulting
+SimulationReport summarizes queue wait times, node-hours and the scaling
+actions taken which makes it possible to tune the polling interval,
+stabilization time, growth rate and policy offline.
+"""
+import math
+import heapq
+import random
+import datetime
+import collections
+
+from starcluster import utils
+from starcluster.balancers.sge import SGEStats, SGELoadBalancer
+
+SIMULATION_EPOCH = datetime.datetime(2014, 1, 1,
+                                     tzinfo=utils.get_utc_now().tzinfo)
+
+
+class SimJob(object):
+    """
+    A job in the simulated SGE queue. submit, start and end are seconds since
+    the start of the simulation.
+    """
+    __slots__ = ('job_id', 'submit', 'duration', 'slots', 'start', 'end',
+                 'host')
+
+    def __init__(self, job_id, submit, duration, slots=1):
+        self.job_id = job_id
+        self.submit = submit
+        self.duration = duration
+        self.slots = slots
+        self.start = None
+        self.end = None
+        self.host = None
+
+    def __repr__(self):
+        return "<SimJob: %d (submit: %d, duration: %d)>" % (
+            self.job_id, self.submit, self.duration)
+
+    @property
+    def wait(self):
+        if self.start is not None:
+            return self.start - self.submit
+
+
+class SimNode(object):
+    """
+    A simulated cluster node with the attributes used by the load balancer
+    """
+    def __init__(self, alias, launched, launch_time, slots,
+                 instance_type=None):
+        self.alias = alias
+        self.instance_type = instance_type
+        self.id = 'i-sim%s' % alias
+        self.dns_name = '%s.simulated' % alias
+        self.launched = launched
+        self.terminated = None
+        self.launch_time = utils.datetime_tuple_to_iso(launch_time)
+        self.slots = slots
+        self.used_slots = 0
+        self.jobs = set()
+        self.state = 'running'
+
+    def __repr__(self):
+        return "<SimNode: %s (%d/%d slots used)>" % (
+            self.alias, self.used_slots, self.slots)
+
+    @property
+    def free_slots(self):
+        return self.slots - self.used_slots
+
+    def is_master(self):
+        return self.alias == 'master'
+
+    def update(self):
+        return self.state
+
+
+class SimCluster(object):
+    """
+    Cluster stand-in handed to the load balancer. Node changes are delegated
+    to the Simulator so that they take simulated time.
+    """
+    def __init__(self, simulator, cluster_size, node_instance_type=None):
+        self._sim = simulator
+        self.cluster_tag = 'simulator'
+        self.cluster_size = cluster_size
+        self.node_instance_type = node_instance_type
+        self.node_instance_types = []
+        self.spot_bid = None
+        self.nodes = []
+
+    @property
+    def running_nodes(self):
+        return [n for n in self.nodes if n.state == 'running']
+
+    @property
+    def master_node(self):
+        for node in self.nodes:
+            if node.is_master():
+                return node
+
+    def is_cluster_up(self):
+        return True
+
+    def add_nodes(self, num_nodes, instance_type=None, image_id=None,
+                  spot_bid=None, force_flat=False):
+        self._sim.add_nodes(num_nodes,
+                            instance_type=instance_type or
+                            self.node_instance_type)
+
+    def invalidate_nodes(self):
+        pass
+
+    def remove_node(self, node):
+        self._sim.remove_node(node)
+
+    def remove_nodes(self, nodes=None, num_nodes=None):
+        for node in nodes:
+            self._sim.remove_node(node)
+
+    def terminate_cluster(self):
+        for node in self.nodes[:]:
+            self._sim.remove_node(node)
+
+
+class SimulatedLoadBalancer(SGELoadBalancer):
+    """
+    SGELoadBalancer that reads the time and SGE stats from a Simulator
+    """
+    def __init__(self, simulator, **kwargs):
+        self._sim = simulator
+        super(SimulatedLoadBalancer, self).__init__(**kwargs)
+
+    def _get_utc_now(self):
+        return self._sim.get_time()
+
+    def get_remote_time(self, cached=False):
+        return self._sim.get_time()
+
+    def _get_stats(self):
+        now = self._sim.get_time()
+        self.stat.parse_qhost(self._sim.qhost_xml())
+        self.stat.parse_qstat(self._sim.qstat_xml())
+        self.stat.parse_accounting(self._sim.read_accounting())
+        self.stat.jobstats.expire(now)
+        return self.stat
+
+
+class SimulationReport(object):
+    """
+    Queue wait times, node usage and scaling actions of a simulation run
+    """
+    def __init__(self, simulator):
+        self.policy = simulator.balancer.policy.name
+        self.duration = simulator.now
+        self.iterations = simulator.iterations
+        self.actions = list(simulator.actions)
+        self.killed_jobs = simulator.killed_jobs
+        self.peak_nodes = simulator.peak_nodes
+        jobs = simulator.submitted
+        self.jobs_submitted = len(jobs)
+        self.jobs_completed = len([j for j in jobs if j.end is not None and
+                                   j.end <= simulator.now])
+        self.jobs_pending = len([j for j in jobs if j.start is None])
+        # jobs still queued at the end are counted with the time they have
+        # waited so far so that starvation isn't hidden
+        self.waits = sorted([j.wait if j.start is not None
+                             else simulator.now - j.submit for j in jobs])
+        self.node_seconds = []
+        for node in simulator.all_nodes:
+            end = node.terminated
+            if end is None:
+                end = simulator.now
+            self.node_seconds.append(end - node.launched)
+
+    def wait_percentile(self, pct):
+        if not self.waits:
+            return 0
+        index = int(math.ceil(pct / 100.0 * len(self.waits))) - 1
+        return self.waits[max(index, 0)]
+
+    @property
+    def avg_wait(self):
+        if not self.waits:
+            return 0
+        return sum(self.waits) / float(len(self.waits))
+
+    @property
+    def node_hours(self):
+        return sum(self.node_seconds) / 3600.0
+
+    @property
+    def billed_hours(self):
+        """
+        Node-hours rounded up to whole hours per node (EC2 hourly billing)
+        """
+        return sum([int(math.ceil(s / 3600.0)) or 1
+                    for s in self.node_seconds])
+
+    def summary(self):
+        adds = [count for t, action, count in self.actions if action == 'add']
+        removes = [a for a in self.actions if a[1] == 'remove']
+        return dict(policy=self.policy, iterations=self.iterations,
+                    jobs_submitted=self.jobs_submitted,
+                    jobs_completed=self.jobs_completed,
+                    jobs_pending=self.jobs_pending,
+                    avg_wait=self.avg_wait,
+                    p95_wait=self.wait_percentile(95),
+                    max_wait=self.waits[-1] if self.waits else 0,
+                    node_hours=self.node_hours,
+                    billed_hours=self.billed_hours,
+                    peak_nodes=self.peak_nodes, scale_ups=len(adds),
+                    nodes_added=sum(adds), nodes_removed=len(removes),
+                    killed_jobs=self.killed_jobs)
+
+
+class Simulator(object):
+    """
+    Discrete-event simulation of an SGE cluster driven by the load balancer
+
+    jobs - list of SimJob objects to submit (see synthetic_workload)
+    slots_per_node - number of SGE slots on every node
+    instance_slots - maps instance types to their number of slots for nodes
+    added with a specific instance type (defaults to slots_per_node)
+    node_instance_type - instance type of the initial nodes and of nodes
+    added without a specific instance type
+    num_nodes - number of nodes (including the master) at the start
+    boot_time - simulated seconds Cluster.add_nodes blocks for
+    cluster_size - default for the balancer's max_nodes
+    start - datetime corresponding to the start of the simulation
+
+    All other keyword arguments are passed to SGELoadBalancer (interval,
+    max_nodes, min_nodes, wait_time, add_pi, stab, kill_after, policy, etc).
+    """
+    def __init__(self, jobs, slots_per_node=8, instance_slots=None,
+                 node_instance_type=None, num_nodes=1, boot_time=300,
+                 cluster_size=None, start=None, **kwargs):
+        self.start = start or SIMULATION_EPOCH
+        self.now = 0
+        self.slots_per_node = slots_per_node
+        self.instance_slots = instance_slots or {}
+        self.boot_time = boot_time
+        self.iterations = 0
+        self.killed_jobs = 0
+        self.peak_nodes = 0
+        self.actions = []
+        self.all_nodes = []
+        self.submitted = []
+        self.queue = collections.deque()
+        # copy the jobs so that a workload can be reused across simulations
+        jobs = [SimJob(j.job_id, j.submit, j.duration, slots=j.slots)
+                for j in jobs]
+        self._arrivals = sorted(jobs, key=lambda j: (j.submit, j.job_id))
+        self._next_arrival = 0
+        self._completions = []
+        self._accounting = []
+        self._node_counter = 0
+        self.cluster = SimCluster(self, cluster_size or num_nodes,
+                                  node_instance_type=node_instance_type)
+        self.balancer = SimulatedLoadBalancer(self, **kwargs)
+        self.balancer._init_cluster(self.cluster)
+        self._launch_nodes(num_nodes, self.now,
+                           instance_type=node_instance_type)
+
+    def get_time(self):
+        """
+        Returns the current simulated time as a datetime object
+        """
+        return self.start + datetime.timedelta(seconds=self.now)
+
+    def _to_datetime(self, secs):
+        return self.start + datetime.timedelta(seconds=secs)
+
+    def _to_unix_time(self, secs):
+        return utils.datetime_to_unix_time(self._to_datetime(secs))
+
+    def _launch_nodes(self, num_nodes, launched, instance_type=None):
+        slots = self.instance_slots.get(instance_type, self.slots_per_node)
+        for i in range(num_nodes):
+            if self.cluster.master_node is None:
+                alias = 'master'
+            else:
+                self._node_counter += 1
+                alias = 'node%.3d' % self._node_counter
+            node = SimNode(alias, launched, self._to_datetime(launched),
+                           slots, instance_type=instance_type)
+            self.cluster.nodes.append(node)
+            self.all_nodes.append(node)
+        self.peak_nodes = max(self.peak_nodes, len(self.cluster.nodes))
+        self._schedule()
+
+    def add_nodes(self, num_nodes, instance_type=None):
+        """
+        Blocks for boot_time simulated seconds and then adds num_nodes nodes
+        """
+        launched = self.now
+        self.actions.append((launched, 'add', num_nodes))
+        self.advance(self.now + self.boot_time)
+        self._launch_nodes(num_nodes, launched, instance_type=instance_type)
+
+    def remove_node(self, node):
+        """
+        Terminates node. Jobs still running on the node are requeued.
+        """
+        self.actions.append((self.now, 'remove', node.alias))
+        for job in sorted(node.jobs, key=lambda j: j.submit, reverse=True):
+            self.killed_jobs += 1
+            job.start = job.end = job.host = None
+            self.queue.appendleft(job)
+        node.jobs.clear()
+        node.used_slots = 0
+        node.state = 'terminated'
+        node.terminated = self.now
+        self.cluster.nodes.remove(node)
+        self._schedule()
+
+    def _start_job(self, job, node):
+        job.start = self.now
+        job.end = self.now + job.duration
+        job.host = node
+        node.jobs.add(job)
+        node.used_slots += job.slots
+        heapq.heappush(self._completions, (job.end, job.job_id, job))
+
+    def _finish_job(self, job):
+        node = job.host
+        node.jobs.discard(job)
+        node.used_slots -= job.slots
+        self._accounting.append(self._accounting_record(job))
+
+    def _schedule(self):
+        """
+        Starts queued jobs on the first node with enough free slots
+        """
+        nodes = self.cluster.running_nodes
+        free = sum([n.free_slots for n in nodes])
+        if not free or not self.queue:
+            return
+        waiting = collections.deque()
+        while self.queue and free:
+            job = self.queue.popleft()
+            for node in nodes:
+                if node.free_slots >= job.slots:
+                    self._start_job(job, node)
+                    free -= job.slots
+                    break
+            else:
+                waiting.append(job)
+        waiting.extend(self.queue)
+        self.queue = waiting
+
+    def advance(self, until):
+        """
+        Processes job arrivals and completions up to simulated time until
+        """
+        arrivals = self._arrivals
+        while True:
+            next_arrival = None
+            if self._next_arrival < len(arrivals):
+                next_arrival = arrivals[self._next_arrival].submit
+            next_end = None
+            if self._completions:
+                next_end = self._completions[0][0]
+            times = [t for t in (next_arrival, next_end) if t is not None]
+            if not times or min(times) > until:
+                break
+            self.now = max(self.now, min(times))
+            while self._completions and self._completions[0][0] <= self.now:
+                end, job_id, job = heapq.heappop(self._completions)
+                # skip entries for jobs killed by remove_node
+                if job.end == end and job in job.host.jobs:
+                    self._finish_job(job)
+            while (self._next_arrival < len(arrivals) and
+                   arrivals[self._next_arrival].submit <= self.now):
+                job = arrivals[self._next_arrival]
+                self._next_arrival += 1
+                self.submitted.append(job)
+                self.queue.append(job)
+            self._schedule()
+        self.now = max(self.now, until)
+
+    def run(self, duration):
+        """
+        Runs the load balancer every polling interval for duration simulated
+        seconds and returns a SimulationReport
+        """
+        lb = self.balancer
+        while self.now < duration:
+            self.iterations += 1
+            lb._update_stats()
+            lb._eval_add_node()
+            lb._eval_remove_node()
+            if lb.kill_cluster and lb._eval_terminate_cluster():
+                self.cluster.terminate_cluster()
+                break
+            self.advance(self.now + lb.polling_interval)
+        return SimulationReport(self)
+
+    def qhost_xml(self):
+        """
+        Returns qhost -xml output for the running nodes
+        """
+        lines = ["<?xml version='1.0'?>", "<qhost>"]
+        for node in self.cluster.running_nodes:
+            lines.append(" <host name='%s'>" % node.alias)
+            lines.append("   <hostvalue name='num_proc'>%d</hostvalue>" %
+                         node.slots)
+            lines.append("   <hostvalue name='load_avg'>%.2f</hostvalue>" %
+                         node.used_slots)
+            lines.append(" </host>")
+        lines.append("</qhost>")
+        return '\n'.join(lines)
+
+    def _job_xml(self, job, state, queue=None):
+        lines = ["  <job_list state='%s'>" % state,
+                 "   <JB_job_number>%d</JB_job_number>" % job.job_id,
+                 "   <JB_name>sim%d</JB_name>" % job.job_id,
+                 "   <JB_owner>sgeadmin</JB_owner>"]
+        fmt = '%Y-%m-%dT%H:%M:%S'
+        if state == 'running':
+            lines.append("   <state>r</state>")
+            lines.append("   <queue_name>%s</queue_name>" % queue)
+            lines.append("   <JAT_start_time>%s</JAT_start_time>" %
+                         self._to_datetime(job.start).strftime(fmt))
+        else:
+            lines.append("   <state>qw</state>")
+            lines.append("   <JB_submission_time>%s</JB_submission_time>" %
+                         self._to_datetime(job.submit).strftime(fmt))
+        lines.append("   <slots>%d</slots>" % job.slots)
+        lines.append("  </job_list>")
+        return lines
+
+    def qstat_xml(self):
+        """
+        Returns qstat -xml -f output for the running nodes and queued jobs
+        """
+        lines = ["<?xml version='1.0'?>", "<job_info>", " <queue_info>"]
+        for node in self.cluster.running_nodes:
+            queue = 'all.q@%s' % node.alias
+            lines.append("  <Queue-List>")
+            lines.append("   <name>%s</name>" % queue)
+            lines.append("   <slots_used>%d</slots_used>" % node.used_slots)
+            lines.append("   <slots_total>%d</slots_total>" % node.slots)
+            for job in sorted(node.jobs, key=lambda j: j.job_id):
+                lines.extend(self._job_xml(job, 'running', queue=queue))
+            lines.append("  </Queue-List>")
+        lines.append(" </queue_info>")
+        lines.append(" <job_info>")
+        for job in self.queue:
+            lines.extend(self._job_xml(job, 'pending'))
+        lines.append(" </job_info>")
+        lines.append("</job_info>")
+        return '\n'.join(lines)
+
+    def _accounting_record(self, job):
+        fields = ['all.q', job.host.alias, 'sgeadmin', 'sgeadmin',
+                  'sim%d' % job.job_id, str(job.job_id), 'sge', '0',
+                  str(self._to_unix_time(job.submit)),
+                  str(self._to_unix_time(job.start)),
+                  str(self._to_unix_time(job.end))]
+        return ':'.join(fields)
+
+    def read_accounting(self):
+        """
+        Returns the accounting records of the jobs that completed since the
+        last call
+        """
+        records = '\n'.join(self._accounting)
+        self._accounting = []
+        return records
+
+
+def synthetic_workload(num_jobs, arrival_rate, avg_duration, slots=1,
+                       start=0, first_job_id=1, seed=None):
+    """
+    Returns num_jobs SimJobs with exponentially distributed inter-arrival
+    times (arrival_rate jobs/sec) and durations (avg_duration secs) starting
+    at simulated time start. Use seed for reproducible workloads.
+    """
+    rand = random.Random(seed)
+    jobs = []
+    now = start
+    for i in range(num_jobs):
+        now += rand.expovariate(arrival_rate)
+        duration = max(int(rand.expovariate(1.0 / avg_duration)), 1)
+        jobs.append(SimJob(first_job_id + i, int(now), duration, slots=slots))
+    return jobs
+
+
+def workload_from_accounting(records):
+    """
+    Returns SimJobs for the completed jobs in SGE accounting file records
+    (see accounting(5)). Submission times are relative to the first job
+    submitted.
+    """
+    jobs = []
+    for line in records.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split(':')
+        if len(fields) < 11:
+            continue
+        try:
+            job_id = int(fields[5])
+            submit, start, end = [int(f) for f in fields[8:11]]
+            slots = int(fields[34]) if len(fields) > 34 else 1
+        except ValueError:
+            continue
+        if not start or not end:
+            continue
+        jobs.append(SimJob(job_id, submit, end - start, slots=slots))
+    if jobs:
+        first = min([j.submit for j in jobs])
+        for job in jobs:
+            job.submit -= first
+    return jobs
+
+
+def workload_from_qstat(qstat_xml, duration):
+    """
+    Returns SimJobs for every task of every job in a recorded qstat -xml
+    snapshot. All jobs are submitted at the start of the simulation and run
+    for duration seconds.
+    """
+    stats = SGEStats()
+    stats.parse_qstat(qstat_xml)
+    jobs = []
+    for job in stats.jobs:
+        for i in range(job.num_tasks):
+            jobs.append(SimJob(len(jobs) + 1, 0, duration, slots=job.slots))
+    return jobs
@@ -0,0 +1,341 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Append-only time-series store for the SGE load balancer's stats
+
+Each sample is written as a fixed-width little-endian binary record (see
+FIELDS and RECORD_FORMAT) after a small header, so the files can be appended
+to without reading them, searched by time with a binary search and mapped
+directly into NumPy arrays by the visualizer.
+
+Samples are kept at full resolution for a limited time and are also
+averaged into coarser tiers that are kept for longer. With the default
+tiers a store at sge-stats.dat consists of:
+
+    sge-stats.dat          every sample (kept for 1 day)
+    sge-stats.dat.300s     5 minute averages (kept for 30 days)
+    sge-stats.dat.3600s    hourly averages (kept for 1 year)
+"""
+import os
+import struct
+
+from starcluster import utils
+from starcluster import exception
+
+FIELDS = ('time', 'hosts', 'running_jobs', 'queued_jobs', 'slots',
+          'avg_duration', 'avg_wait', 'avg_load')
+RECORD_FORMAT = '<d4I3d'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+NUMPY_DTYPE = [('time', '<f8'), ('hosts', '<u4'), ('running_jobs', '<u4'),
+               ('queued_jobs', '<u4'), ('slots', '<u4'),
+               ('avg_duration', '<f8'), ('avg_wait', '<f8'),
+               ('avg_load', '<f8')]
+MAGIC = 'SCTS'
+VERSION = 1
+HEADER_FORMAT = '<4sHHI4x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+DAY = 24 * 60 * 60
+# (resolution, retention) in seconds for each tier - resolution 0 is raw
+DEFAULT_TIERS = [(0, DAY), (300, 30 * DAY), (3600, 365 * DAY)]
+# compact a tier once it holds this much more than its retention period
+COMPACT_SLACK = 0.25
+
+
+def to_record(stats):
+    """
+    Converts a list of stats (see SGEStats.get_all_stats) whose first item is
+    either a datetime or seconds since the epoch to a record tuple
+    """
+    stats = list(stats)
+    t = stats[0]
+    if hasattr(t, 'utctimetuple'):
+        t = utils.datetime_to_unix_time(t) + t.microsecond / 1e6
+    return tuple([float(t)] + [int(round(v)) for v in stats[1:5]] +
+                 [float(v) for v in stats[5:8]])
+
+
+class TimeSeriesFile(object):
+    """
+    A single file of fixed-width stats records sorted by time
+    """
+    def __init__(self, path, resolution=0, retention=None):
+        self.path = path
+        self.resolution = resolution
+        self.retention = retention
+        self._checked = False
+        self._repaired = False
+
+    def __repr__(self):
+        return "<TimeSeriesFile: %s (%d records)>" % (self.path, len(self))
+
+    def __len__(self):
+        # a partially written record at the end of the file is ignored
+        if not os.path.exists(self.path):
+            return 0
+        self._check()
+        return (os.path.getsize(self.path) - HEADER_SIZE) // RECORD_SIZE
+
+    def _check(self):
+        """
+        Validates the header
+        """
+        if self._checked:
+            return
+        with open(self.path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                raise exception.BaseException(
+                    "stats file %s is corrupt" % self.path)
+            magic, version, size, resolution = struct.unpack(HEADER_FORMAT,
+                                                             header)
+        if magic != MAGIC or version != VERSION or size != RECORD_SIZE:
+            raise exception.BaseException(
+                "%s is not a StarCluster stats file (version %d)" %
+                (self.path, VERSION))
+        self._checked = True
+
+    def _repair(self):
+        """
+        Drops a partially written record left at the end of the file (e.g. if
+        the balancer was killed mid-write). Only the writer may do this:
+        readers could otherwise cut off a record that is being appended.
+        """
+        if self._repaired:
+            return
+        extra = (os.path.getsize(self.path) - HEADER_SIZE) % RECORD_SIZE
+        if extra:
+            with open(self.path, 'r+b') as f:
+                f.truncate(os.path.getsize(self.path) - extra)
+        self._repaired = True
+
+    def _header(self):
+        return struct.pack(HEADER_FORMAT, MAGIC, VERSION, RECORD_SIZE,
+                           self.resolution)
+
+    def append(self, record):
+        if not os.path.exists(self.path):
+            with open(self.path, 'wb') as f:
+                f.write(self._header())
+        self._check()
+        self._repair()
+        with open(self.path, 'ab') as f:
+            f.write(struct.pack(RECORD_FORMAT, *record))
+
+    def _read_records(self, f, start, count):
+        f.seek(HEADER_SIZE + start * RECORD_SIZE)
+        data = f.read(count * RECORD_SIZE)
+        return [struct.unpack_from(RECORD_FORMAT, data, i * RECORD_SIZE)
+                for i in range(len(data) // RECORD_SIZE)]
+
+    def _read_time(self, f, index):
+        f.seek(HEADER_SIZE + index * RECORD_SIZE)
+        return struct.unpack('<d', f.read(8))[0]
+
+    def _search(self, f, t, count):
+        """
+        Returns the index of the first record at or after time t
+        """
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._read_time(f, mid) < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _get_range(self, f, start, end, count):
+        first = 0 if start is None else self._search(f, start, count)
+        last = count if end is None else self._search(f, end, count)
+        return first, max(first, last)
+
+    def first_time(self):
+        """
+        Returns the time of the oldest record or None if there are none
+        """
+        if len(self):
+            with open(self.path, 'rb') as f:
+                return self._read_time(f, 0)
+
+    def last(self):
+        """
+        Returns the newest record or None if there are none
+        """
+        count = len(self)
+        if count:
+            with open(self.path, 'rb') as f:
+                return self._read_records(f, count - 1, 1)[0]
+
+    def read(self, start=None, end=None):
+        """
+        Returns a list of record tuples with start <= time < end
+        """
+        count = len(self)
+        if not count:
+            return []
+        with open(self.path, 'rb') as f:
+            first, last = self._get_range(f, start, end, count)
+            return self._read_records(f, first, last - first)
+
+    def read_arrays(self, start=None, end=None):
+        """
+        Returns a NumPy record array (fields: FIELDS) of the records with
+        start <= time < end mapped directly from the file
+        """
+        import numpy as np
+        count = len(self)
+        if not count:
+            return np.zeros(0, dtype=NUMPY_DTYPE).view(np.recarray)
+        records = np.memmap(self.path, dtype=NUMPY_DTYPE, mode='r',
+                            offset=HEADER_SIZE, shape=(count,))
+        first = 0
+        last = count
+        if start is not None:
+            first = records['time'].searchsorted(start)
+        if end is not None:
+            last = records['time'].searchsorted(end)
+        return records[first:max(first, last)].view(np.recarray)
+
+    def compact(self, now):
+        """
+        Drops records older than the retention period. The file is only
+        rewritten once it holds COMPACT_SLACK more than the retention period.
+        """
+        first = self.first_time()
+        if not self.retention or first is None:
+            return
+        cutoff = now - self.retention
+        if first >= now - self.retention * (1 + COMPACT_SLACK):
+            return
+        tmp = self.path + '.tmp'
+        with open(self.path, 'rb') as f:
+            index = self._search(f, cutoff, len(self))
+            f.seek(HEADER_SIZE + index * RECORD_SIZE)
+            with open(tmp, 'wb') as out:
+                out.write(self._header())
+                out.write(f.read())
+        os.rename(tmp, self.path)
+        self._checked = False
+
+
+class TimeSeriesStore(object):
+    """
+    Stores stats records at full resolution and downsampled into each of
+    tiers, a list of (resolution, retention) tuples in seconds. The first
+    tier must have resolution 0 (raw samples).
+    """
+    def __init__(self, path, tiers=DEFAULT_TIERS):
+        self.path = path
+        self.tiers = []
+        for resolution, retention in tiers:
+            tier_path = path
+            if resolution:
+                tier_path = '%s.%ds' % (path, resolution)
+            self.tiers.append(TimeSeriesFile(tier_path, resolution,
+                                             retention))
+        if not self.tiers or self.tiers[0].resolution:
+            raise exception.BaseException(
+                "the first stats tier must store raw samples")
+        self._pending = None
+
+    @property
+    def raw(self):
+        return self.tiers[0]
+
+    def _init_pending(self):
+        """
+        Rebuilds the partially filled bucket of each downsampled tier from
+        the raw samples written since the tier's last bucket
+        """
+        self._pending = {}
+        for tier in self.tiers[1:]:
+            last = tier.last()
+            start = None
+            if last is not None:
+                start = last[0] + tier.resolution
+            for record in self.raw.read(start=start):
+                self._accumulate(tier, record)
+
+    def _bucket(self, tier, t):
+        return int(t // tier.resolution) * tier.resolution
+
+    def _accumulate(self, tier, record):
+        bucket = self._bucket(tier, record[0])
+        pending = self._pending.get(tier.path)
+        if pending and pending[0] != bucket:
+            self._flush(tier)
+            pending = None
+        if not pending:
+            pending = self._pending[tier.path] = [bucket, 0,
+                                                  [0.0] * (len(FIELDS) - 1)]
+        pending[1] += 1
+        sums = pending[2]
+        for i, value in enumerate(record[1:]):
+            sums[i] += value
+
+    def _flush(self, tier):
+        bucket, count, sums = self._pending.pop(tier.path)
+        tier.append(to_record([bucket] + [s / count for s in sums]))
+
+    def append(self, stats):
+        """
+        Appends a sample (see to_record) to the store
+        """
+        record = to_record(stats)
+        if self._pending is None:
+            self._init_pending()
+        self.raw.append(record)
+        for tier in self.tiers[1:]:
+            self._accumulate(tier, record)
+        for tier in self.tiers:
+            tier.compact(record[0])
+
+    def select_tier(self, start=None):
+        """
+        Returns the finest tier that holds data going back to start (or as
+        far back as any tier goes if start is None)
+        """
+        firsts = [(tier, tier.first_time()) for tier in self.tiers]
+        known = [f + t.resolution for t, f in firsts if f is not None]
+        if not known:
+            return self.raw
+        if start is None:
+            # downsampled records are stamped with the start of their bucket
+            start = min(known)
+        for tier, first in firsts:
+            if first is not None and first <= start + tier.resolution:
+                return tier
+        oldest = min([(first, i) for i, (tier, first) in enumerate(firsts)
+                      if first is not None])
+        return self.tiers[oldest[1]]
+
+    def read(self, start=None, end=None, tier=None):
+        """
+        Returns a list of record tuples from tier (the finest tier covering
+        start if None) with start <= time < end
+        """
+        tier = tier or self.select_tier(start)
+        return tier.read(start=start, end=end)
+
+    def read_arrays(self, start=None, end=None, tier=None):
+        """
+        Same as read() but returns a NumPy record array
+        """
+        tier = tier or self.select_tier(start)
+        return tier.read_arrays(start=start, end=end)
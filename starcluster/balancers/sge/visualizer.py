@@ -19,63 +19,153 @@
 StarCluster SunGrinEngine stats visualizer module
 """
 import os
-import numpy as np
-from datetime import datetime
+import threading
+
 import matplotlib
 matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 from starcluster.logger import log
+from starcluster.balancers.sge import timeseries
 
 
 class SGEVisualizer(object):
     """
     Stats Visualizer for SGE Load Balancer
-    stats_file - file containing SGE load balancer stats
-    pngpath - directory to dump the stat plots to
+    stats_file - time-series store containing SGE load balancer stats
+    pngpath - directory to dump the stats figure to
+    window - only plot the last window seconds (default: all stats)
+
+    The stats are plotted in a single multi-panel figure (FIGURE_NAME) that
+    is only redrawn when new stats have been written. Call start() to render
+    in a background thread and notify() after writing new stats instead of
+    calling graph_all() directly.
     """
-    def __init__(self, stats_file, pngpath):
+    FIGURE_NAME = 'sge-stats.png'
+    PANELS = [('queued_jobs', 'Queued jobs'),
+              ('running_jobs', 'Running jobs'),
+              ('hosts', 'Hosts'),
+              ('avg_duration', 'Avg job duration (secs)'),
+              ('avg_wait', 'Avg job wait time (secs)'),
+              ('avg_load', 'Avg load')]
+
+    def __init__(self, stats_file, pngpath, window=None):
         self.pngpath = pngpath
         self.stats_file = stats_file
+        self.window = window
         self.records = None
+        self.dates = None
+        self._figure = None
+        self._lines = {}
+        self._rendered = None
+        self._thread = None
+        self._running = False
+        self._wakeup = threading.Event()
 
     def read(self):
-        list = []
-        file = open(self.stats_file, 'r')
-        for line in file:
-            parts = line.rstrip().split(',')
-            naive_dt = datetime.strptime(parts[0][:26], '%Y-%m-%d %H:%M:%S.%f')  # Hack, ignore timezone part.
-            a = [naive_dt, int(parts[1]), int(parts[2]), int(parts[3]), int(parts[4]),
-                 int(parts[5]), int(parts[6]), float(parts[7])]
-            list.append(a)
-        file.close()
-        names = ['dt', 'hosts', 'running_jobs', 'queued_jobs',
-                 'slots', 'avg_duration', 'avg_wait', 'avg_load']
-        self.records = np.rec.fromrecords(list, names=','.join(names))
-
-    def graph(self, yaxis, title):
-        if self.records is None:
-            log.error("ERROR: File hasn't been read() yet.")
-            return -1
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        ax.plot(self.records.dt, yaxis)
-        ax.grid(True)
+        """
+        Maps the stats from the finest tier of the store that covers the
+        plotted window into self.records (a NumPy record array)
+        """
+        store = timeseries.TimeSeriesStore(self.stats_file)
+        start = None
+        if self.window:
+            last = store.raw.last()
+            if last:
+                start = last[0] - self.window
+        self.records = store.read_arrays(start=start)
+        self.dates = mdates.epoch2num(self.records.time)
+
+    def _get_version(self):
+        try:
+            st = os.stat(self.stats_file)
+        except OSError:
+            return None
+        return (self.stats_file, self.pngpath, st.st_size, st.st_mtime)
+
+    def has_new_data(self):
+        """
+        Returns True if stats have been written since the last render
+        """
+        version = self._get_version()
+        return version is not None and version != self._rendered
+
+    def _create_figure(self):
+        fig = Figure(figsize=(10, 2.5 * len(self.PANELS)))
+        FigureCanvasAgg(fig)
+        first = None
+        for i, (field, title) in enumerate(self.PANELS):
+            ax = fig.add_subplot(len(self.PANELS), 1, i + 1, sharex=first)
+            first = first or ax
+            self._lines[field] = ax.plot([], [])[0]
+            ax.set_title(title)
+            ax.grid(True)
+            ax.xaxis_date()
         fig.autofmt_xdate()
-        filename = os.path.join(self.pngpath, title + '.png')
-        plt.savefig(filename, dpi=100)
-        log.debug("saved graph %s." % title)
-        plt.close(fig)  # close it when its done
+        self._figure = fig
 
     def graph_all(self):
+        """
+        Redraws the stats figure if new stats have been written since the
+        last render. Returns True if the figure was redrawn.
+        """
+        version = self._get_version()
+        if version is None or version == self._rendered:
+            return False
         self.read()
-        vals = {'queued': self.records.queued_jobs,
-                'running': self.records.running_jobs,
-                'num_hosts': self.records.hosts,
-                # 'slots': self.records.slots,
-                'avg_duration': self.records.avg_duration,
-                'avg_wait': self.records.avg_wait,
-                'avg_load': self.records.avg_load}
-        for sub in vals:
-            self.graph(vals[sub], sub)
-        log.info("Done making graphs.")
+        if not len(self.records):
+            return False
+        if self._figure is None:
+            self._create_figure()
+        for field, line in self._lines.items():
+            line.set_data(self.dates, self.records[field])
+            line.axes.relim()
+            line.axes.autoscale_view()
+        filename = os.path.join(self.pngpath, self.FIGURE_NAME)
+        self._figure.savefig(filename, dpi=100)
+        self._rendered = version
+        log.debug("saved stats figure %s" % filename)
+        return True
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._running:
+                break
+            try:
+                self.graph_all()
+            except Exception:
+                log.error("Failed to plot load balancer stats",
+                          exc_info=True)
+
+    def start(self):
+        """
+        Starts rendering the figure in a background thread whenever notify()
+        is called
+        """
+        if self._thread and self._thread.isAlive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name='sge-visualizer')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def notify(self):
+        """
+        Tells the background thread that new stats have been written
+        """
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        """
+        Stops the background thread after it finishes the current render
+        """
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
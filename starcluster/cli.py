@@ -22,7 +22,9 @@ starcluster [global-opts] action [action-opts] [<action-args> ...]
 """
 import os
 import sys
+import json
 import shlex
+import atexit
 import socket
 import optparse
 import platform
@@ -32,6 +34,7 @@ from boto.exception import BotoServerError, EC2ResponseError, S3ResponseError
 from starcluster import config
 from starcluster import static
 from starcluster import logger
+from starcluster import awsutils
 from starcluster import commands
 from starcluster import exception
 from starcluster import completion
@@ -84,6 +87,9 @@ class StarClusterCLI(object):
         if gopts.DEBUG:
             console.setLevel(logger.DEBUG)
             config.DEBUG_CONFIG = True
+        if gopts.PROFILE_API:
+            awsutils.enable_api_profiling()
+            atexit.register(self.report_api_profile)
         # load StarClusterConfig into global options
         try:
             cfg = config.StarClusterConfig(gopts.CONFIG)
@@ -143,6 +149,11 @@ class StarClusterCLI(object):
                            static.STARCLUSTER_CFG_FILE)
         gparser.add_option("-r", "--region", dest="REGION", action="store",
                            help="specify a region to use (default: us-east-1)")
+        gparser.add_option("--profile-api", dest="PROFILE_API",
+                           action="store_true", default=False,
+                           help="count EC2 API calls, bytes and latency per "
+                           "action and caller, print a summary on exit and "
+                           "write it to %s" % static.API_PROFILE_FILE)
         gparser.disable_interspersed_args()
         return gparser
 
@@ -187,6 +198,19 @@ class StarClusterCLI(object):
         log.error("and submit it to starcluster@mit.edu")
         sys.exit(1)
 
+    def report_api_profile(self):
+        """
+        Logs a summary of the EC2 API calls made by this process and writes
+        them to static.API_PROFILE_FILE as JSON
+        """
+        profile = awsutils.get_api_profile()
+        if profile is None:
+            return
+        log.info("EC2 API calls:\n%s" % profile.summary())
+        with open(static.API_PROFILE_FILE, 'w') as f:
+            json.dump(profile.to_dict(), f, indent=2, sort_keys=True)
+        log.info("EC2 API profile written to: %s" % static.API_PROFILE_FILE)
+
     def get_global_opts(self):
         """
         Parse and return global options. This method will silently return None
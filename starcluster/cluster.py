@@ -17,6 +17,7 @@
 
 import os
 import re
+import copy
 import time
 import string
 import pprint
@@ -31,6 +32,7 @@ from starcluster import sshutils
 from starcluster import managers
 from starcluster import userdata
 from starcluster import deathrow
+from starcluster import ratelimit
 from starcluster import exception
 from starcluster import threadpool
 from starcluster import validators
@@ -413,6 +415,7 @@ class Cluster(object):
                  disable_cloudinit=False,
                  subnet_id=None,
                  public_ips=None,
+                 node_cache_ttl=5,
                  **kwargs):
         # update class vars with given vars
         _vars = locals().copy()
@@ -439,8 +442,10 @@ class Cluster(object):
         self._zone = None
         self._master = None
         self._nodes = []
+        self._nodes_updated = None
         self._pool = None
         self._progress_bar = None
+        self._userdata_bundle = None
         self.__default_plugin = None
         self.__sge_plugin = None
 
@@ -700,6 +705,7 @@ class Cluster(object):
                              master_instance_type=self.master_instance_type,
                              node_image_id=self.node_image_id,
                              node_instance_type=self.node_instance_type,
+                             node_instance_types=self.node_instance_types,
                              availability_zone=self.availability_zone,
                              dns_prefix=self.dns_prefix,
                              subnet_id=self.subnet_id,
@@ -749,8 +755,30 @@ class Cluster(object):
         self._master.key_location = self.key_location
         return self._master
 
+    def invalidate_nodes(self):
+        """
+        Force the next access to Cluster.nodes to query EC2 rather than
+        returning the cached node list. Called whenever nodes are created,
+        terminated, stopped, or rebooted.
+        """
+        self._nodes_updated = None
+
+    def _is_node_cache_fresh(self):
+        if self._nodes_updated is None or not self.node_cache_ttl:
+            return False
+        age = time.time() - self._nodes_updated
+        return 0 <= age < self.node_cache_ttl
+
     @property
     def nodes(self):
+        """
+        List of all pending, running, stopping, and stopped nodes in this
+        cluster sorted by alias. The list is cached for node_cache_ttl
+        seconds (0 disables caching) and can be refreshed early by calling
+        invalidate_nodes().
+        """
+        if self._is_node_cache_fresh():
+            return self._nodes
         states = ['pending', 'running', 'stopping', 'stopped']
         filters = {'instance-state-name': states,
                    'instance.group-name': self._security_group}
@@ -763,6 +791,7 @@ class Cluster(object):
         # update node cache with latest instance data from EC2
         existing_nodes = dict([(n.id, n) for n in self._nodes])
         log.debug('existing nodes: %s' % existing_nodes)
+        new_nodes = []
         for node in nodes:
             if node.id in existing_nodes:
                 log.debug('updating existing node %s in self._nodes' % node.id)
@@ -771,13 +800,19 @@ class Cluster(object):
                 enode.instance = node
             else:
                 log.debug('adding node %s to self._nodes list' % node.id)
-                n = Node(node, self.key_location)
-                if n.is_master():
-                    self._master = n
-                    self._nodes.insert(0, n)
-                else:
-                    self._nodes.append(n)
+                new_nodes.append(Node(node, self.key_location))
+        untagged = [n for n in new_nodes
+                    if n.spot_id and not n.tags.get('alias')]
+        if untagged:
+            self._assign_spot_aliases(untagged)
+        for n in new_nodes:
+            if n.is_master():
+                self._master = n
+                self._nodes.insert(0, n)
+            else:
+                self._nodes.append(n)
         self._nodes.sort(key=lambda n: n.alias)
+        self._nodes_updated = time.time()
         log.debug('returning self._nodes = %s' % self._nodes)
         return self._nodes
 
@@ -796,7 +831,7 @@ class Cluster(object):
         public ip, etc.)
         """
         nodes = nodes or self.nodes
-        for node in self.nodes:
+        for node in nodes:
             if node.alias == identifier:
                 return node
             if node.id == identifier:
@@ -899,22 +934,42 @@ class Cluster(object):
                                  placement_group=placement_group,
                                  spot_bid=spot_bid, force_flat=force_flat, root_volume_size=root_volume_size)[0]
 
-    def _get_cluster_userdata(self, aliases):
-        alias_file = utils.string_to_file('\n'.join(['#ignored'] + aliases),
-                                          static.UD_ALIASES_FNAME)
+    def _get_userdata_bundle(self):
+        """
+        Returns a userdata.UserDataBundle of the plugins, volumes and userdata
+        scripts shared by all nodes. The bundle is only rebuilt when the
+        plugin objects, the volumes or the scripts' paths, sizes and mtimes
+        change.
+        """
+        user_scripts = self.userdata_scripts or []
+        use_cloudinit = not self.disable_cloudinit
+        stats = [(f, os.path.getsize(f), os.path.getmtime(f))
+                 for f in user_scripts]
+        key = (self.plugins, self.volumes, stats, use_cloudinit)
+        if self._userdata_bundle and self._userdata_bundle[0] == key:
+            return self._userdata_bundle[1]
         plugins = utils.dump_compress_encode(self._plugins)
         plugins_file = utils.string_to_file('\n'.join(['#ignored', plugins]),
                                             static.UD_PLUGINS_FNAME)
         volumes = utils.dump_compress_encode(self.volumes)
         volumes_file = utils.string_to_file('\n'.join(['#ignored', volumes]),
                                             static.UD_VOLUMES_FNAME)
-        udfiles = [alias_file, plugins_file, volumes_file]
-        user_scripts = self.userdata_scripts or []
+        udfiles = [plugins_file, volumes_file]
         udfiles += [open(f) for f in user_scripts]
-        use_cloudinit = not self.disable_cloudinit
-        udata = userdata.bundle_userdata_files(udfiles,
-                                               use_cloudinit=use_cloudinit)
-        log.debug('Userdata size in KB: %.2f' % utils.size_in_kb(udata))
+        bundle = userdata.UserDataBundle(udfiles, use_cloudinit=use_cloudinit)
+        # plugins compare by identity - copy the volumes so that changes made
+        # in place are noticed too
+        key = (list(self.plugins), copy.deepcopy(self.volumes), stats,
+               use_cloudinit)
+        self._userdata_bundle = (key, bundle)
+        return bundle
+
+    def _get_cluster_userdata(self, aliases):
+        alias_file = utils.string_to_file('\n'.join(['#ignored'] + aliases),
+                                          static.UD_ALIASES_FNAME)
+        bundle = self._get_userdata_bundle()
+        udata = bundle.bundle([alias_file])
+        log.debug('Userdata size:\n%s' % bundle.size_report(udata))
         return udata
 
     def create_nodes(self, aliases, image_id=None, instance_type=None,
@@ -942,8 +997,13 @@ class Cluster(object):
             elif not placement_group:
                 placement_group = self.placement_group.name
         image_id = image_id or self.node_image_id
-        count = len(aliases) if not spot_bid else 1
-        user_data = self._get_cluster_userdata(aliases)
+        count = len(aliases)
+        if spot_bid and count > 1:
+            # spot instances always have an ami_launch_index of 0 so their
+            # aliases are stored in tags on their spot requests instead
+            user_data = self._get_cluster_userdata([])
+        else:
+            user_data = self._get_cluster_userdata(aliases)
         kwargs = dict(price=spot_bid, instance_type=instance_type,
                       min_count=count, max_count=count, count=count,
                       key_name=self.keyname,
@@ -967,18 +1027,50 @@ class Cluster(object):
             kwargs.update(security_groups=[cluster_sg])
         resvs = []
         if spot_bid:
-            security_group_id = self.cluster_group.id
-            for alias in aliases:
-                if not subnet_id:
-                    kwargs['security_group_ids'] = [security_group_id]
-                kwargs['user_data'] = self._get_cluster_userdata([alias])
-                resvs.extend(self.ec2.request_instances(image_id, **kwargs))
+            if not subnet_id:
+                kwargs['security_group_ids'] = [self.cluster_group.id]
+            resvs.extend(self.ec2.request_instances(image_id, **kwargs))
         else:
             resvs.append(self.ec2.request_instances(image_id, **kwargs))
         for resv in resvs:
             log.info(str(resv), extra=dict(__raw__=True))
+        if spot_bid:
+            self._tag_spot_requests(resvs, aliases)
+        self.invalidate_nodes()
         return resvs
 
+    def _tag_spot_requests(self, spot_requests, aliases):
+        """
+        Assigns each alias in aliases to one of spot_requests by tagging the
+        spot request. The tag is copied to the spot instance once the request
+        has been fulfilled (see _assign_spot_aliases).
+        """
+        self.ec2.wait_for_propagation(spot_requests=spot_requests)
+        futures = []
+        for spot, alias in zip(spot_requests, aliases):
+            futures.append(self.pool.submit(self.ec2.create_tags,
+                                            ([spot.id], dict(alias=alias)),
+                                            jobid=alias))
+        self.pool.wait_for_futures(futures)
+
+    def _assign_spot_aliases(self, nodes):
+        """
+        Tags each spot instance in nodes with the alias stored on its spot
+        request looking up all of the spot requests in a single request
+
+        The instances are tagged serially: this is called from Cluster.nodes
+        which is also read from jobs running on the thread pool, where
+        waiting on other jobs in the same pool could deadlock.
+        """
+        spot_ids = [n.spot_id for n in nodes]
+        filters = {'spot-instance-request-id': spot_ids}
+        spots = self.ec2.get_all_spot_requests(filters=filters)
+        aliases = dict([(s.id, s.tags.get('alias')) for s in spots])
+        for node in nodes:
+            alias = aliases.get(node.spot_id)
+            if alias:
+                node.add_tags(dict(alias=alias, Name=alias))
+
     def _get_next_node_num(self):
         nodes = self._nodes_in_states(['pending', 'running'])
         nodes = filter(lambda x: not x.is_master(), nodes)
@@ -1011,12 +1103,15 @@ class Cluster(object):
 
     def add_nodes(self, num_nodes, aliases=None, image_id=None,
                   instance_type=None, zone=None, placement_group=None,
-                  spot_bid=None, subnet=None, no_create=False, root_volume_size=None):
+                  spot_bid=None, subnet=None, no_create=False, root_volume_size=None,
+                  force_flat=False):
         """
         Add new nodes to this cluster
 
         aliases - list of aliases to assign to new nodes (len must equal
         num_nodes)
+        force_flat - launch flat-rate instances even if the cluster has a
+        spot_bid
         """
         running_pending = self._nodes_in_states(['pending', 'running'])
         aliases = aliases or []
@@ -1045,16 +1140,15 @@ class Cluster(object):
                                      instance_type=instance_type, zone=zone,
                                      placement_group=placement_group,
                                      subnet=subnet, spot_bid=spot_bid,
-                                     root_volume_size=root_volume_size)
-            if spot_bid or self.spot_bid:
-                self.ec2.wait_for_propagation(spot_requests=resp)
-            else:
+                                     root_volume_size=root_volume_size,
+                                     force_flat=force_flat)
+            # spot requests are propagated by create_nodes before tagging
+            if force_flat or not (spot_bid or self.spot_bid):
                 self.ec2.wait_for_propagation(instances=resp[0].instances)
         self.wait_for_cluster(msg="Waiting for node(s) to come up...")
         log.debug("Adding node(s): %s" % aliases)
-        for alias in aliases:
-            node = self.get_node(alias)
-            self.run_plugins(method_name="on_add_node", node=node)
+        new_nodes = self.get_nodes(aliases)
+        self.run_plugins(method_name="on_add_nodes", new_nodes=new_nodes)
 
     def remove_node(self, node=None, terminate=True, force=False):
         """
@@ -1085,16 +1179,32 @@ class Cluster(object):
                 if node.is_master():
                     raise exception.InvalidOperation(
                         "cannot remove master node")
-        for node in nodes:
-            try:
-                self.run_plugins(method_name="on_remove_node", node=node,
-                                 reverse=True)
-            except:
-                if not force:
-                    raise
-            if not terminate:
-                continue
-            node.terminate()
+        log.info("Removing %d node(s): %s" %
+                 (len(nodes), ', '.join([n.alias for n in nodes])))
+        try:
+            self.run_plugins(method_name="on_remove_nodes",
+                             removed_nodes=nodes, reverse=True)
+        except:
+            if not force:
+                raise
+        if terminate:
+            self.terminate_nodes(nodes)
+
+    def terminate_nodes(self, nodes):
+        """
+        Terminate nodes with a single TerminateInstances request after
+        canceling their spot requests (if any) in a single request
+        """
+        if not nodes:
+            return
+        spot_ids = [n.spot_id for n in nodes if n.spot_id]
+        if spot_ids:
+            log.info("Canceling spot request(s): %s" % ', '.join(spot_ids))
+            self.ec2.cancel_spot_requests(spot_ids)
+        log.info("Terminating node(s): %s" %
+                 ', '.join(['%s (%s)' % (n.alias, n.id) for n in nodes]))
+        self.ec2.terminate_instances([n.id for n in nodes])
+        self.invalidate_nodes()
 
     def _get_launch_map(self, reverse=False):
         """
@@ -1185,10 +1295,13 @@ class Cluster(object):
         request. This is especially important for Cluster Compute instances
         given that Amazon *highly* recommends requesting all CCI in a single
         launch request.
+
+        The master's group is launched first to pick the zone. The remaining
+        groups are then launched concurrently, each waiting for its own
+        instances to propagate as soon as its request returns.
         """
         lmap = self._get_launch_map()
         zone = None
-        insts = []
         master_alias = self._make_alias(master=True)
         itype, image = [i for i in lmap if master_alias in lmap[i]][0]
         aliases = lmap.get((itype, image))
@@ -1199,27 +1312,43 @@ class Cluster(object):
                                             instance_type=itype,
                                             force_flat=True)[0]
         zone = master_response.instances[0].placement
-        insts.extend(master_response.instances)
         lmap.pop((itype, image))
-        for (itype, image) in lmap:
-            aliases = lmap.get((itype, image))
-            if not aliases:
-                continue
-            for alias in aliases:
-                log.debug("Launching %s (ami: %s, type: %s)" %
-                          (alias, image, itype))
-            resv = self.create_nodes(aliases, image_id=image,
-                                     instance_type=itype, zone=zone,
-                                     force_flat=True)
-            insts.extend(resv[0].instances)
-        self.ec2.wait_for_propagation(instances=insts)
+        groups = [(key, lmap[key]) for key in sorted(lmap) if lmap[key]]
+        region = self.ec2.region.name
+        if region in static.PLACEMENT_GROUP_REGIONS:
+            for (itype, image), aliases in groups:
+                if itype in static.PLACEMENT_GROUP_TYPES:
+                    # create the placement group once before launching
+                    self.placement_group
+                    break
+        futures = []
+        for (itype, image), aliases in groups:
+            futures.append(self.pool.submit(
+                self._launch_flat_rate_group, (aliases, image, itype, zone),
+                jobid=itype))
+        self.ec2.wait_for_propagation(instances=master_response.instances)
+        if futures:
+            log.info("Waiting for %d node group(s) to launch..." %
+                     len(futures))
+            self.pool.wait_for_futures(futures)
+
+    def _launch_flat_rate_group(self, aliases, image, itype, zone):
+        for alias in aliases:
+            log.debug("Launching %s (ami: %s, type: %s)" %
+                      (alias, image, itype))
+        resv = self.create_nodes(aliases, image_id=image, instance_type=itype,
+                                 zone=zone, force_flat=True)[0]
+        self.ec2.wait_for_propagation(instances=resv.instances,
+                                      progress=False)
+        return resv.instances
 
     def _create_spot_cluster(self):
         """
         Launches cluster using spot instances for all worker nodes. This method
-        makes a single spot request for each node in the cluster since spot
-        instances *always* have an ami_launch_index of 0. This is needed in
-        order to correctly assign aliases to nodes.
+        makes a single spot request for each group of worker nodes with the
+        same type/ami. Spot instances *always* have an ami_launch_index of 0
+        so aliases are assigned to the nodes using tags on their spot requests
+        rather than the aliases in the user data.
         """
         master_alias = self._make_alias(master=True)
         (mtype, mimage) = self._get_type_and_image_id(master_alias)
@@ -1241,14 +1370,16 @@ class Cluster(object):
             # Make sure nodes are in same zone as master
             zone = master_response.instances[0].placement
             insts.extend(master_response.instances)
-        for id in range(1, self.cluster_size):
-            alias = self._make_alias(id)
-            (ntype, nimage) = self._get_type_and_image_id(alias)
+        lmap = self._get_launch_map()
+        for (ntype, nimage) in sorted(lmap):
+            aliases = [a for a in lmap[(ntype, nimage)] if a != master_alias]
+            if not aliases:
+                continue
             log.info("Launching %s (ami: %s, type: %s)" %
-                     (alias, nimage, ntype))
-            spot_req = self.create_node(alias, image_id=nimage,
-                                        instance_type=ntype, zone=zone)
-            spot_reqs.append(spot_req)
+                     (', '.join(aliases), nimage, ntype))
+            spot_reqs.extend(self.create_nodes(aliases, image_id=nimage,
+                                               instance_type=ntype,
+                                               zone=zone))
         self.ec2.wait_for_propagation(instances=insts, spot_requests=spot_reqs)
 
     def is_spot_cluster(self):
@@ -1382,6 +1513,17 @@ class Cluster(object):
     def validate(self):
         return self.validator.validate()
 
+    def execute_on_nodes(self, command, nodes=None, **kwargs):
+        """
+        Run a command (or list of commands) concurrently on nodes (defaults to
+        all running nodes) and return a dictionary mapping each node's alias to
+        its sshutils.CommandResult. See clustersetup.execute_on_nodes for the
+        supported kwargs.
+        """
+        nodes = nodes or self.running_nodes
+        kwargs.setdefault('pool', self.pool)
+        return clustersetup.execute_on_nodes(nodes, command, **kwargs)
+
     def wait_for_active_spots(self, spots=None):
         """
         Wait for all open spot requests for this cluster to transition to
@@ -1431,17 +1573,52 @@ class Cluster(object):
                         node.terminate()
                 else:
                     time.sleep(self.refresh_interval)
+                self.invalidate_nodes()
                 nodes = self.get_nodes_or_raise()
         pbar.reset()
 
+    def update_nodes(self, nodes):
+        """
+        Refresh the instance state of all nodes in a single DescribeInstances
+        call and publish the fresh instance objects to each node. Returns the
+        list of nodes whose instances were found.
+        """
+        if not nodes:
+            return []
+        instance_ids = [n.id for n in nodes]
+        instances = self.ec2.get_all_instances(
+            filters={'instance-id': instance_ids})
+        imap = dict((i.id, i) for i in instances)
+        updated = []
+        for node in nodes:
+            instance = imap.get(node.id)
+            if instance:
+                node.instance = instance
+                updated.append(node)
+        return updated
+
     def wait_for_ssh(self, nodes=None):
         """
-        Wait until all cluster nodes are in a 'running' state
+        Wait until SSH is up on all cluster nodes
+
+        Instance states for all waiting nodes are refreshed with one
+        DescribeInstances call per interval (see update_nodes) rather than
+        having every node poll EC2 on its own. Only the SSH checks are fanned
+        out to the thread pool.
         """
         log.info("Waiting for SSH to come up on all nodes...")
         nodes = nodes or self.get_nodes_or_raise()
-        self.pool.map(lambda n: n.wait(interval=self.refresh_interval), nodes,
-                      jobid_fn=lambda n: n.alias)
+        pending = list(nodes)
+        while pending:
+            running = [n for n in self.update_nodes(pending)
+                       if n.state == 'running']
+            up_ids = self.pool.map(
+                lambda n: n.is_up(update=False) and n.id, running,
+                jobid_fn=lambda n: n.alias)
+            pending = [n for n in pending if n.id not in up_ids]
+            if pending:
+                log.debug("Waiting for SSH on %d nodes" % len(pending))
+                time.sleep(self.refresh_interval)
 
     @print_timing("Waiting for cluster to come up")
     def wait_for_cluster(self, msg="Waiting for cluster to come up..."):
@@ -1529,6 +1706,7 @@ class Cluster(object):
         log.info("Rebooting cluster...")
         for node in nodes:
             node.reboot()
+        self.invalidate_nodes()
         if reboot_only:
             return
         sleep = 20
@@ -1570,6 +1748,7 @@ class Cluster(object):
         self.detach_volumes()
         for node in nodes:
             node.shutdown()
+        self.invalidate_nodes()
 
     def terminate_cluster(self, force=False):
         """
@@ -1585,17 +1764,16 @@ class Cluster(object):
             else:
                 raise
         self.detach_volumes()
-        nodes = self.nodes
-        for node in nodes:
-            node.terminate()
+        self.terminate_nodes(self.nodes)
         for spot in self.spot_requests:
             if spot.state not in ['cancelled', 'closed']:
                 log.info("Canceling spot instance request: %s" % spot.id)
                 spot.cancel()
         s = utils.get_spinner("Waiting for cluster to terminate...")
+        delays = ratelimit.backoff_delays(1, 10)
         try:
             while not self.is_cluster_terminated():
-                time.sleep(5)
+                time.sleep(delays.next())
         finally:
             s.stop()
         region = self.ec2.region.name
@@ -1660,6 +1838,7 @@ class Cluster(object):
             for node in self.stopped_nodes:
                 log.info("Starting stopped node: %s" % node.alias)
                 node.start()
+            self.invalidate_nodes()
         if create_only:
             return
         self.setup_cluster()
@@ -1686,7 +1865,7 @@ class Cluster(object):
         self.run_plugins()
 
     def run_plugins(self, plugins=None, method_name="run", node=None,
-                    reverse=False):
+                    reverse=False, new_nodes=None, removed_nodes=None):
         """
         Run all plugins specified in this Cluster object's self.plugins list
         Uses plugins list instead of self.plugins if specified.
@@ -1701,9 +1880,11 @@ class Cluster(object):
         if reverse:
             plugs.reverse()
         for plug in plugs:
-            self.run_plugin(plug, method_name=method_name, node=node)
+            self.run_plugin(plug, method_name=method_name, node=node,
+                            new_nodes=new_nodes, removed_nodes=removed_nodes)
 
-    def run_plugin(self, plugin, name='', method_name='run', node=None):
+    def run_plugin(self, plugin, name='', method_name='run', node=None,
+                   new_nodes=None, removed_nodes=None):
         """
         Run a StarCluster plugin.
 
@@ -1712,9 +1893,28 @@ class Cluster(object):
         method_name - the method to run within the plugin (default: "run")
         node - optional node to pass as first argument to plugin method (used
         for on_add_node/on_remove_node)
+        new_nodes - list of nodes added to the cluster to pass as first
+        argument to plugin method (used for on_add_nodes). Plugins that only
+        implement on_add_node are run once per node in new_nodes instead.
+        removed_nodes - list of nodes about to be removed from the cluster to
+        pass as first argument to plugin method (used for on_remove_nodes).
+        Plugins that only implement on_remove_node are run once per node in
+        removed_nodes instead.
         """
         plugin_name = name or getattr(plugin, '__name__',
                                       utils.get_fq_class_name(plugin))
+        single = batch = None
+        if method_name == 'on_add_nodes' and \
+           not clustersetup.supports_batched_add(plugin):
+            single, batch = 'on_add_node', new_nodes
+        elif method_name == 'on_remove_nodes' and \
+                not clustersetup.supports_batched_remove(plugin):
+            single, batch = 'on_remove_node', removed_nodes
+        if single:
+            for batch_node in batch:
+                self.run_plugin(plugin, name=name, method_name=single,
+                                node=batch_node)
+            return
         try:
             func = getattr(plugin, method_name, None)
             if not func:
@@ -1725,6 +1925,10 @@ class Cluster(object):
                     self.cluster_shell, self.volumes]
             if node:
                 args.insert(0, node)
+            elif new_nodes is not None:
+                args.insert(0, new_nodes)
+            elif removed_nodes is not None:
+                args.insert(0, removed_nodes)
             log.info("Running plugin %s" % plugin_name)
             func(*args)
         except NotImplementedError:
@@ -2227,12 +2431,14 @@ class ClusterValidator(validators.Validator):
             ud = self.cluster._get_cluster_userdata(
                 [self.cluster._make_alias(id=1)])
         ud_size_kb = utils.size_in_kb(ud)
-        if ud_size_kb > 16:
+        if ud_size_kb > static.MAX_USERDATA_KB:
+            report = self.cluster._get_userdata_bundle().size_report(ud)
             raise exception.ClusterValidationError(
                 "User data is too big! (%.2fKB)\n"
-                "User data scripts combined and compressed must be <= 16KB\n"
+                "User data scripts combined and compressed must be <= %dKB\n"
                 "NOTE: StarCluster uses anywhere from 0.5-2KB "
-                "to store internal metadata" % ud_size_kb)
+                "to store internal metadata\n\n%s" %
+                (ud_size_kb, static.MAX_USERDATA_KB, report))
 
     def validate_vpc(self):
         if self.cluster.subnet_id:
@@ -18,15 +18,127 @@
 """
 clustersetup.py
 """
+import inspect
 import posixpath
+import threading
 
 from starcluster import utils
+from starcluster import sshutils
 from starcluster import threadpool
 from starcluster.utils import print_timing
 from starcluster.logger import log
 from starcluster import exception
 
 
+def execute_on_nodes(nodes, command, pool=None, max_concurrency=None,
+                     timeout=None, callback=None, silent=True,
+                     source_profile=True, raise_on_failure=True):
+    """
+    Run a command, or a list of commands, on all nodes concurrently and return
+    a dictionary mapping each node's alias to its sshutils.CommandResult. If a
+    list of commands is given they are run in order on each node (stopping at
+    the first failure) and each node's value is the list of results.
+
+    pool - thread pool to run on (defaults to a new 20-thread pool)
+    max_concurrency - max number of nodes to run on at once (defaults to the
+                      size of the pool)
+    timeout - per-node timeout in seconds for each command
+    callback - called as callback(node, result) as soon as each node finishes
+    silent - if False log each node's output as soon as it finishes (it is
+             always logged to the debug file)
+    raise_on_failure - raise exception.RemoteCommandsFailed after all nodes
+                       finish if the command failed on any node
+    """
+    multi = isinstance(command, (list, tuple))
+    commands = command if multi else [command]
+    pool = pool or threadpool.get_thread_pool(20)
+    sem = threading.Semaphore(max_concurrency) if max_concurrency else None
+    results = {}
+    failed = set()
+
+    def _run(node):
+        node_results = []
+        if sem:
+            sem.acquire()
+        try:
+            for cmd in commands:
+                try:
+                    result = node.ssh.run_command(
+                        cmd, timeout=timeout, source_profile=source_profile)
+                except Exception as e:
+                    result = sshutils.CommandResult(cmd, error=e)
+                node_results.append(result)
+                if result.failed:
+                    break
+        finally:
+            if sem:
+                sem.release()
+        if node_results[-1].failed:
+            failed.add(node.alias)
+        results[node.alias] = node_results if multi else node_results[0]
+        for result in node_results:
+            _log_result(node, result, silent=silent)
+            if callback:
+                callback(node, result)
+
+    pool.wait_for_futures([pool.submit(_run, (node,), jobid=node.alias)
+                           for node in nodes])
+    if raise_on_failure and failed:
+        failed = [n.alias for n in nodes if n.alias in failed]
+        raise exception.RemoteCommandsFailed('; '.join(commands), results,
+                                             failed)
+    return results
+
+
+def _log_result(node, result, silent=False):
+    log_func = log.info
+    err_func = log.error
+    if silent:
+        log_func = err_func = log.debug
+    if result.timed_out:
+        err_func("%s: '%s' timed out" % (node.alias, result.command))
+    elif result.error:
+        err_func("%s: '%s' failed: %s" %
+                 (node.alias, result.command, result.error))
+    else:
+        log_func("%s: '%s' exited with status %d" %
+                 (node.alias, result.command, result.exit_status))
+    for line in result.output:
+        log_func("%s: %s" % (node.alias, line))
+
+
+def _get_defining_class(cls, name):
+    for klass in inspect.getmro(cls):
+        if name in vars(klass):
+            return klass
+
+
+def _supports_batched(plugin, single_name, batched_name):
+    batched = _get_defining_class(type(plugin), batched_name)
+    if batched is None:
+        return False
+    single = _get_defining_class(type(plugin), single_name)
+    return single is None or issubclass(batched, single)
+
+
+def supports_batched_add(plugin):
+    """
+    Returns True if plugin's on_add_nodes method can be used to add a batch of
+    nodes at once. This is only the case if on_add_nodes is defined by the
+    same class that defines on_add_node (or a subclass of it) - otherwise the
+    plugin overrides on_add_node without overriding on_add_nodes and the
+    per-node hook must be called for each node instead.
+    """
+    return _supports_batched(plugin, 'on_add_node', 'on_add_nodes')
+
+
+def supports_batched_remove(plugin):
+    """
+    Same as supports_batched_add but for on_remove_nodes/on_remove_node
+    """
+    return _supports_batched(plugin, 'on_remove_node', 'on_remove_nodes')
+
+
 class ClusterSetup(object):
     """
     ClusterSetup Interface
@@ -43,6 +155,17 @@ class ClusterSetup(object):
         """
         raise NotImplementedError('on_add_node method not implemented')
 
+    def on_add_nodes(self, new_nodes, nodes, master, user, user_shell,
+                     volumes):
+        """
+        This method gets executed once after a batch of nodes has been added
+        to the cluster. The default implementation calls on_add_node for each
+        node in new_nodes. Plugins should override this method when adding K
+        nodes can be done in a single reconfiguration round.
+        """
+        for node in new_nodes:
+            self.on_add_node(node, nodes, master, user, user_shell, volumes)
+
     def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
         """
         This method gets executed before a node is about to be removed from the
@@ -50,6 +173,19 @@ class ClusterSetup(object):
         """
         raise NotImplementedError('on_remove_node method not implemented')
 
+    def on_remove_nodes(self, remove_nodes, nodes, master, user, user_shell,
+                        volumes):
+        """
+        This method gets executed once before a batch of nodes is about to be
+        removed from the cluster. The default implementation calls
+        on_remove_node for each node in remove_nodes. Plugins should override
+        this method when removing K nodes can be done in a single
+        reconfiguration round.
+        """
+        for node in remove_nodes:
+            self.on_remove_node(node, nodes, master, user, user_shell,
+                                volumes)
+
     def on_restart(self, nodes, master, user, user_shell, volumes):
         """
         This method gets executed before restart the cluster
@@ -71,6 +207,14 @@ class ClusterSetup(object):
         """
         raise NotImplementedError('run method not implemented')
 
+    def execute_on_nodes(self, nodes, command, **kwargs):
+        """
+        Run a command (or list of commands) on nodes concurrently using this
+        plugin's thread pool (if any). See clustersetup.execute_on_nodes.
+        """
+        kwargs.setdefault('pool', getattr(self, 'pool', None))
+        return execute_on_nodes(nodes, command, **kwargs)
+
     def __new__(typ, *args, **kwargs):
         """
         DO NOT OVERRIDE!
@@ -97,6 +241,7 @@ class DefaultClusterSetup(ClusterSetup):
         self._disable_threads = disable_threads
         self._num_threads = num_threads
         self._pool = None
+        self._user_ids = None
 
     @property
     def pool(self):
@@ -169,9 +314,9 @@ class DefaultClusterSetup(ClusterSetup):
             uid, gid = self._get_max_unused_user_id()
         return uid, gid
 
-    def _setup_cluster_user(self, user=None):
+    def _get_cluster_user_id(self, user=None):
         """
-        Create cluster user on all StarCluster nodes
+        Returns the uid/gid to use when creating the cluster user
 
         This command takes care to examine existing folders in /home
         and set the new cluster_user's uid/gid accordingly. This is necessary
@@ -190,7 +335,7 @@ class DefaultClusterSetup(ClusterSetup):
                 "instance is still up.".format(user, uid, gid))
         log.info("Creating cluster user: %s (uid: %d, gid: %d)" %
                  (user, uid, gid))
-        self._add_user_to_nodes(uid, gid, self._nodes)
+        return uid, gid
 
     def _add_user_to_node(self, uid, gid, node):
         existing_user = node.getpwuid(uid)
@@ -242,15 +387,6 @@ class DefaultClusterSetup(ClusterSetup):
                                  jobid=node.alias)
         self.pool.wait(numtasks=len(nodes))
 
-    def _setup_etc_hosts(self, nodes=None):
-        """ Configure /etc/hosts on all StarCluster nodes"""
-        log.info("Configuring /etc/hosts on each node")
-        nodes = nodes or self._nodes
-        for node in nodes:
-            self.pool.simple_job(node.add_to_etc_hosts, (nodes, ),
-                                 jobid=node.alias)
-        self.pool.wait(numtasks=len(nodes))
-
     def _setup_passwordless_ssh(self, nodes=None):
         """
         Properly configure passwordless ssh for root and CLUSTER_USER on all
@@ -367,6 +503,58 @@ class DefaultClusterSetup(ClusterSetup):
             master.export_fs_to_nodes(nodes, export_paths)
             self._mount_nfs_shares(nodes, export_paths=export_paths)
 
+    def _start_nfs_server(self, nodes, export_paths):
+        self._master.start_nfs_server()
+        if nodes:
+            self._master.export_fs_to_nodes(nodes, export_paths)
+
+    def _get_setup_graph(self):
+        """
+        Returns a TaskGraph containing the default setup routines for each
+        node. Each node runs its own chain of hostname -> cluster user ->
+        scratch -> /etc/hosts -> NFS mounts independently of the other nodes.
+        The only cross-node dependencies are on the master: EBS volumes must be
+        mounted before choosing the cluster user's uid/gid, and the NFS server
+        must be exporting to the workers before they mount.
+        """
+        graph = threadpool.TaskGraph(self.pool)
+        master = self._master
+        workers = self.nodes
+        export_paths = self._get_nfs_export_paths()
+        graph.add_task('ebs', self._setup_ebs_volumes)
+        graph.add_task('uid', self._init_cluster_user_ids, deps=['ebs'])
+        scratch_msg = "Configuring scratch space for user(s): %s" % self._user
+        nfs_msg = ("Mounting all NFS export path(s) on %d worker node(s)" %
+                   len(workers))
+        for node in self._nodes:
+            alias = node.alias
+            graph.add_task('hostname:' + alias, node.set_hostname,
+                           stage="Configuring hostnames...")
+            graph.add_task('user:' + alias, self._add_cluster_user_to_node,
+                           (node,), deps=['uid', 'hostname:' + alias])
+            graph.add_task('scratch:' + alias, self._setup_scratch_on_node,
+                           (node,), deps=['user:' + alias], stage=scratch_msg)
+            graph.add_task('etc_hosts:' + alias, node.add_to_etc_hosts,
+                           (self._nodes,), deps=['scratch:' + alias],
+                           stage="Configuring /etc/hosts on each node")
+        graph.add_task('nfs_server', self._start_nfs_server,
+                       (workers, export_paths),
+                       deps=['ebs', 'etc_hosts:' + master.alias],
+                       stage="Starting NFS server on %s" % master.alias)
+        for node in workers:
+            graph.add_task('nfs:' + node.alias, node.mount_nfs_shares,
+                           (master, export_paths),
+                           deps=['nfs_server', 'etc_hosts:' + node.alias],
+                           stage=nfs_msg)
+        return graph
+
+    def _init_cluster_user_ids(self):
+        self._user_ids = self._get_cluster_user_id()
+
+    def _add_cluster_user_to_node(self, node):
+        uid, gid = self._user_ids
+        self._add_user_to_node(uid, gid, node)
+
     def run(self, nodes, master, user, user_shell, volumes):
         """Start cluster configuration"""
         self._nodes = nodes
@@ -374,56 +562,91 @@ class DefaultClusterSetup(ClusterSetup):
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
-        self._setup_hostnames()
-        self._setup_ebs_volumes()
-        self._setup_cluster_user()
-        self._setup_scratch()
-        self._setup_etc_hosts()
-        self._setup_nfs()
+        self._get_setup_graph().run()
         self._setup_passwordless_ssh()
 
-    def _remove_from_etc_hosts(self, node):
-        nodes = filter(lambda x: x.id != node.id, self.running_nodes)
+    def _get_remaining_nodes(self, remove_nodes):
+        remove_ids = set([n.id for n in remove_nodes])
+        return [n for n in self.running_nodes if n.id not in remove_ids]
+
+    def _remove_from_etc_hosts(self, remove_nodes):
+        nodes = self._get_remaining_nodes(remove_nodes)
         for n in nodes:
-            n.remove_from_etc_hosts([node])
+            self.pool.simple_job(n.remove_from_etc_hosts, (remove_nodes,),
+                                 jobid=n.alias)
+        self.pool.wait(numtasks=len(nodes))
+
+    def _remove_nfs_exports(self, remove_nodes):
+        self._master.stop_exporting_fs_to_nodes(remove_nodes)
 
-    def _remove_nfs_exports(self, node):
-        self._master.stop_exporting_fs_to_nodes([node])
+    def _remove_from_known_hosts_on_node(self, node, remove_nodes):
+        node.remove_from_known_hosts('root', remove_nodes)
+        node.remove_from_known_hosts(self._user, remove_nodes)
 
-    def _remove_from_known_hosts(self, node):
-        nodes = filter(lambda x: x.id != node.id, self.running_nodes)
+    def _remove_from_known_hosts(self, remove_nodes):
+        nodes = self._get_remaining_nodes(remove_nodes)
         for n in nodes:
-            n.remove_from_known_hosts('root', [node])
-            n.remove_from_known_hosts(self._user, [node])
+            self.pool.simple_job(self._remove_from_known_hosts_on_node,
+                                 (n, remove_nodes), jobid=n.alias)
+        self.pool.wait(numtasks=len(nodes))
 
     def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
+        self.on_remove_nodes([node], nodes, master, user, user_shell,
+                             volumes)
+
+    def on_remove_nodes(self, remove_nodes, nodes, master, user, user_shell,
+                        volumes):
         self._nodes = nodes
         self._master = master
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
-        log.info("Removing node %s (%s)..." % (node.alias, node.id))
-        log.info("Removing %s from known_hosts files" % node.alias)
-        self._remove_from_known_hosts(node)
-        log.info("Removing %s from /etc/hosts" % node.alias)
-        self._remove_from_etc_hosts(node)
-        log.info("Removing %s from NFS" % node.alias)
-        self._remove_nfs_exports(node)
-
-    def _create_user(self, node):
+        aliases = ', '.join([n.alias for n in remove_nodes])
+        log.info("Removing node(s): %s" % aliases)
+        log.info("Removing %s from known_hosts files" % aliases)
+        self._remove_from_known_hosts(remove_nodes)
+        log.info("Removing %s from /etc/hosts" % aliases)
+        self._remove_from_etc_hosts(remove_nodes)
+        log.info("Removing %s from NFS" % aliases)
+        self._remove_nfs_exports(remove_nodes)
+
+    def _create_users(self, nodes):
         user = self._master.getpwnam(self._user)
         uid, gid = user.pw_uid, user.pw_gid
-        self._add_user_to_nodes(uid, gid, nodes=[node])
+        self._add_user_to_nodes(uid, gid, nodes=nodes)
+
+    def _create_user(self, node):
+        self._create_users([node])
+
+    def _add_to_etc_hosts(self, new_nodes):
+        """
+        Add new_nodes to /etc/hosts on the existing nodes and add all nodes to
+        /etc/hosts on each of the new nodes
+        """
+        log.info("Configuring /etc/hosts on each node")
+        new_ids = set([n.id for n in new_nodes])
+        for node in self._nodes:
+            if node.id in new_ids:
+                entries = self._nodes
+            else:
+                entries = new_nodes
+            self.pool.simple_job(node.add_to_etc_hosts, (entries, ),
+                                 jobid=node.alias)
+        self.pool.wait(numtasks=len(self._nodes))
 
     def on_add_node(self, node, nodes, master, user, user_shell, volumes):
+        self.on_add_nodes([node], nodes, master, user, user_shell, volumes)
+
+    def on_add_nodes(self, new_nodes, nodes, master, user, user_shell,
+                     volumes):
         self._nodes = nodes
         self._master = master
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
-        self._setup_hostnames(nodes=[node])
-        self._setup_etc_hosts(nodes)
-        self._setup_nfs(nodes=[node], start_server=False)
-        self._create_user(node)
-        self._setup_scratch(nodes=[node])
-        self._setup_passwordless_ssh(nodes=[node])
+        self._setup_hostnames(nodes=new_nodes)
+        self._add_to_etc_hosts(new_nodes)
+        self._setup_nfs(nodes=new_nodes, start_server=False)
+        self._create_users(new_nodes)
+        self._setup_scratch(nodes=new_nodes)
+        self._setup_passwordless_ssh(nodes=new_nodes)
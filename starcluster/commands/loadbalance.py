@@ -17,6 +17,7 @@
 
 from starcluster import exception
 from starcluster.balancers import sge
+from starcluster.balancers.sge import policy as sge_policy
 
 from completers import ClusterCompleter
 
@@ -52,7 +53,7 @@ class CmdLoadBalance(ClusterCompleter):
     def addopts(self, parser):
         parser.add_option("-d", "--dump-stats", dest="dump_stats",
                           action="store_true", default=False,
-                          help="Output stats to a csv file at each iteration")
+                          help="Output stats to a file at each iteration")
         parser.add_option("-D", "--dump-stats-file", dest="stats_file",
                           action="store", default=None,
                           help="File to dump stats to (default: %s)" %
@@ -103,6 +104,16 @@ class CmdLoadBalance(ClusterCompleter):
         parser.add_option("-K", "--kill-cluster", dest="kill_cluster",
                           action="store_true", default=False,
                           help="Terminate the cluster when the queue is empty")
+        parser.add_option("-A", "--policy", dest="policy", action="store",
+                          type="choice", default=None,
+                          choices=sorted(sge_policy.POLICIES),
+                          help="Autoscaling policy used to decide when to "
+                          "add nodes (default: reactive)")
+        parser.add_option("-C", "--cost-table", dest="cost_table",
+                          action="store", default=None,
+                          help="CSV file with the slots, memory, GPUs and "
+                          "flat-rate/spot prices of the instance types nodes "
+                          "may be added with")
 
     def execute(self, args):
         if not self.cfg.globals.enable_experimental:
@@ -80,6 +80,34 @@ class RemoteCommandFailed(SSHError):
         self.output = output
 
 
+class RemoteCommandsFailed(SSHError):
+    """
+    Raised when a command run on multiple nodes fails on any node. The message
+    includes each failed node's exit status and the last tail lines of its
+    output.
+    """
+    def __init__(self, command, results, failed, tail=10):
+        self.command = command
+        self.results = results
+        self.failed = failed
+        lines = ["remote command '%s' failed on %d node(s): %s" % (
+            command, len(failed), ', '.join(failed))]
+        for alias in failed:
+            result = results[alias]
+            if isinstance(result, list):
+                result = result[-1]
+            if result.timed_out:
+                status = "timed out"
+            elif result.error:
+                status = "failed: %s" % result.error
+            else:
+                status = "failed with status %d" % result.exit_status
+            lines.append("%s: '%s' %s" % (alias, result.command, status))
+            lines += ["%s: %s" % (alias, line)
+                      for line in result.output[-tail:]]
+        self.msg = '\n'.join(lines)
+
+
 class SSHAccessDeniedViaAuthKeys(BaseException):
     """
     Raised when SSH access for a given user has been restricted via
@@ -532,6 +560,12 @@ class ThreadPoolException(BaseException):
         return '\n'.join(excs)
 
 
+class ThreadPoolTimeout(BaseException):
+    def __init__(self, jobids):
+        self.jobids = jobids
+        self.msg = "timed out waiting for job(s): %s" % jobids
+
+
 class IncompatibleCluster(BaseException):
     default_msg = """\
 INCOMPATIBLE CLUSTER: %(tag)s
@@ -137,6 +137,11 @@ class Node(object):
         """
         if not self._alias:
             alias = self.tags.get('alias')
+            if not alias and self.spot_id:
+                spot = self.get_spot_request()
+                alias = spot.tags.get('alias') if spot else None
+                if alias:
+                    self.add_tag('alias', alias)
             if not alias:
                 aliasestxt = self.user_data.get(static.UD_ALIASES_FNAME, '')
                 aliases = aliasestxt.splitlines()[2:]
@@ -200,6 +205,13 @@ class Node(object):
     def add_tag(self, key, value=None):
         return self.instance.add_tag(key, value)
 
+    def add_tags(self, tags):
+        """
+        Adds all of the tags in the tags dict with a single request
+        """
+        self.ec2.create_tags([self.id], tags)
+        self.instance.tags.update(tags)
+
     def remove_tag(self, key, value=None):
         return self.instance.remove_tag(key, value)
 
@@ -1034,8 +1046,14 @@ class Node(object):
         while not self.is_up():
             time.sleep(interval)
 
-    def is_up(self):
-        if self.update() != 'running':
+    def is_up(self, update=True):
+        """
+        Returns True if the node is 'running' and ssh is up. Pass update=False
+        to skip refreshing the instance from EC2 when the caller has already
+        published a fresh instance to this node (see Cluster.update_nodes)
+        """
+        state = self.update() if update else self.state
+        if state != 'running':
             return False
         if not self.is_ssh_up():
             return False
@@ -1080,9 +1098,9 @@ class Node(object):
     @property
     def ssh(self):
         if not self._ssh:
-            self._ssh = sshutils.SSHClient(self.addr,
-                                           username=self.user,
-                                           private_key=self.key_location)
+            self._ssh = sshutils.SSHClient(
+                self.addr, username=self.user, private_key=self.key_location,
+                pool=sshutils.get_connection_pool())
         return self._ssh
 
     def shell(self, user=None, forward_x11=False, forward_agent=False,
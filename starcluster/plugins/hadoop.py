@@ -281,29 +281,19 @@ class Hadoop(clustersetup.ClusterSetup):
         node.ssh.execute("chown -R %s:hadoop %s" % (user, path))
         node.ssh.execute("chmod -R %s %s" % (permission, path))
 
-    def _start_datanode(self, node):
-        node.ssh.execute('/etc/init.d/hadoop-0.20-datanode restart')
-
-    def _start_tasktracker(self, node):
-        node.ssh.execute('/etc/init.d/hadoop-0.20-tasktracker restart')
-
     def _start_hadoop(self, master, nodes):
         log.info("Starting namenode...")
         master.ssh.execute('/etc/init.d/hadoop-0.20-namenode restart')
         log.info("Starting secondary namenode...")
         master.ssh.execute('/etc/init.d/hadoop-0.20-secondarynamenode restart')
         log.info("Starting datanode on all nodes...")
-        for node in nodes:
-            self.pool.simple_job(self._start_datanode, (node,),
-                                 jobid=node.alias)
-        self.pool.wait()
+        self.execute_on_nodes(nodes,
+                              '/etc/init.d/hadoop-0.20-datanode restart')
         log.info("Starting jobtracker...")
         master.ssh.execute('/etc/init.d/hadoop-0.20-jobtracker restart')
         log.info("Starting tasktracker on all nodes...")
-        for node in nodes:
-            self.pool.simple_job(self._start_tasktracker, (node,),
-                                 jobid=node.alias)
-        self.pool.wait()
+        self.execute_on_nodes(nodes,
+                              '/etc/init.d/hadoop-0.20-tasktracker restart')
 
     def _open_ports(self, master):
         ports = [50070, 50030]
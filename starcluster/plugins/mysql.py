@@ -282,19 +282,11 @@ class MysqlCluster(DefaultClusterSetup):
         mconn.execute('/etc/init.d/mysql-ndb-mgm restart')
         # Start mysqld-ndb on data nodes
         log.info('Restarting mysql-ndb on all data nodes...')
-        for node in self.data_nodes:
-            self.pool.simple_job(node.ssh.execute,
-                                 ('/etc/init.d/mysql-ndb restart'),
-                                 jobid=node.alias)
-        self.pool.wait(len(self.data_nodes))
+        self.execute_on_nodes(self.data_nodes, '/etc/init.d/mysql-ndb restart')
         # Start mysql on query nodes
         log.info('Starting mysql on all query nodes')
-        for node in self.query_nodes:
-            self.pool.simple_job(node.ssh.execute,
-                                 ('/etc/init.d/mysql restart'),
-                                 dict(ignore_exit_status=True),
-                                 jobid=node.alias)
-        self.pool.wait(len(self.query_nodes))
+        self.execute_on_nodes(self.query_nodes, '/etc/init.d/mysql restart',
+                              raise_on_failure=False)
         # Import sql dump
         dump_file = self._dump_file
         dump_dir = '/mnt/mysql-cluster-backup'
@@ -42,7 +42,7 @@ class PackageInstaller(clustersetup.DefaultClusterSetup):
         log.info(', '.join(self.packages), extra=dict(__raw__=True))
         pkgs = ' '.join(self.packages)
         for node in nodes:
-            self.pool.simple_job(node.apt_install, (pkgs), jobid=node.alias)
+            self.pool.simple_job(node.apt_install, (pkgs,), jobid=node.alias)
         self.pool.wait(len(nodes))
 
     def on_add_node(self, new_node, nodes, master, user, user_shell, volumes):
@@ -50,5 +50,15 @@ class PackageInstaller(clustersetup.DefaultClusterSetup):
         pkgs = ' '.join(self.packages)
         new_node.apt_install(pkgs)
 
+    def on_add_nodes(self, new_nodes, nodes, master, user, user_shell,
+                     volumes):
+        log.info('Installing the following packages on %s:' %
+                 ', '.join([n.alias for n in new_nodes]))
+        log.info(', '.join(self.packages), extra=dict(__raw__=True))
+        pkgs = ' '.join(self.packages)
+        for node in new_nodes:
+            self.pool.simple_job(node.apt_install, (pkgs,), jobid=node.alias)
+        self.pool.wait(len(new_nodes))
+
     def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
         raise NotImplementedError("on_remove_node method not implemented")
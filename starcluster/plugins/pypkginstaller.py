@@ -58,9 +58,7 @@ class PyPkgInstaller(DefaultClusterSetup):
         for command in commands:
             log.info("$ " + command)
         cmd = "\n".join(commands)
-        for node in nodes:
-            self.pool.simple_job(node.ssh.execute, (cmd,), jobid=node.alias)
-        self.pool.wait(len(nodes))
+        self.execute_on_nodes(nodes, cmd)
 
     def run(self, nodes, master, user, user_shell, volumes):
         self.install_packages(nodes)
@@ -68,5 +66,10 @@ class PyPkgInstaller(DefaultClusterSetup):
     def on_add_node(self, node, nodes, master, user, user_shell, volumes):
         self.install_packages([node], dest=node.alias)
 
+    def on_add_nodes(self, new_nodes, nodes, master, user, user_shell,
+                     volumes):
+        self.install_packages(new_nodes,
+                              dest=', '.join([n.alias for n in new_nodes]))
+
     def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
         raise NotImplementedError("on_remove_node method not implemented")
@@ -54,13 +54,19 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
         self.disable_default_queue = disable_default_queue
         super(SGEPlugin, self).__init__(**kwargs)
 
-    def _add_sge_submit_host(self, node):
+    def _add_sge_submit_hosts(self, nodes):
         mssh = self._master.ssh
-        mssh.execute('qconf -as %s' % node.alias)
+        mssh.execute('qconf -as %s' % ','.join([n.alias for n in nodes]))
 
-    def _add_sge_admin_host(self, node):
+    def _add_sge_admin_hosts(self, nodes):
         mssh = self._master.ssh
-        mssh.execute('qconf -ah %s' % node.alias)
+        mssh.execute('qconf -ah %s' % ','.join([n.alias for n in nodes]))
+
+    def _add_sge_submit_host(self, node):
+        self._add_sge_submit_hosts([node])
+
+    def _add_sge_admin_host(self, node):
+        self._add_sge_admin_hosts([node])
 
     def _setup_sge_profile(self, node):
         sge_profile = node.ssh.remote_file(self.SGE_PROFILE, "w")
@@ -260,25 +266,48 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
                 node.ssh.execute('qconf -aattr hostgroup hostlist %s @gpuhosts' % master.alias)
                 node.ssh.execute('qmod -d gpu.q@%s' % master.alias)
 
-    def _remove_from_sge(self, node):
-        master = self._master
-        master.ssh.execute('qconf -dattr hostgroup hostlist %s @allhosts' % node.alias)
-        master.ssh.execute('qconf -purge queue slots all.q@%s' % node.alias)
+    def _get_sge_removal_cmds(self, node):
+        cmds = ['qconf -dattr hostgroup hostlist %s @allhosts' % node.alias,
+                'qconf -purge queue slots all.q@%s' % node.alias]
+        queues = []
         if self.create_cpu_queue and not node.is_gpu_compute():
-            master.ssh.execute('qconf -dattr hostgroup hostlist %s @cpuhosts' % node.alias)
-            master.ssh.execute('qconf -purge queue slots cpu.q@%s' % node.alias)
+            queues.append('cpu')
         if self.create_mem_queue and node.is_himem_compute():
-            master.ssh.execute('qconf -dattr hostgroup hostlist %s @memhosts' % node.alias)
-            master.ssh.execute('qconf -purge queue slots mem.q@%s' % node.alias)
+            queues.append('mem')
         if self.create_gpu_queue and node.is_gpu_compute():
-            master.ssh.execute('qconf -dattr hostgroup hostlist %s @gpuhosts' % node.alias)
-            master.ssh.execute('qconf -purge queue slots gpu.q@%s' % node.alias)
-        master.ssh.execute('qconf -dconf %s' % node.alias)
-        master.ssh.execute('qconf -de %s' % node.alias)
-        node.ssh.execute('pkill -9 sge_execd')
-        nodes = filter(lambda n: n.alias != node.alias, self._nodes)
+            queues.append('gpu')
+        for q in queues:
+            cmds.append('qconf -dattr hostgroup hostlist %s @%shosts' %
+                        (node.alias, q))
+            cmds.append('qconf -purge queue slots %s.q@%s' % (q, node.alias))
+        return cmds
+
+    def _remove_nodes_from_sge(self, remove_nodes):
+        """
+        Removes remove_nodes from SGE by running all of the qconf commands
+        needed in a single session on the master, stopping sge_execd on each
+        node concurrently and then updating the parallel environment once
+        """
+        aliases = ','.join([n.alias for n in remove_nodes])
+        cmds = []
+        for node in remove_nodes:
+            cmds += self._get_sge_removal_cmds(node)
+        cmds.append('qconf -dconf %s' % aliases)
+        cmds.append('qconf -de %s' % aliases)
+        self._master.ssh.execute(' && '.join(cmds))
+        futures = []
+        for node in remove_nodes:
+            futures.append(self.pool.submit(node.ssh.execute,
+                                            ('pkill -9 sge_execd',),
+                                            jobid=node.alias))
+        self.pool.wait_for_futures(futures)
+        remove_ids = set([n.id for n in remove_nodes])
+        nodes = filter(lambda n: n.id not in remove_ids, self._nodes)
         self._create_sge_pe(nodes=nodes)
 
+    def _remove_from_sge(self, node):
+        self._remove_nodes_from_sge([node])
+
     def run(self, nodes, master, user, user_shell, volumes):
         if not master.ssh.isdir(self.SGE_FRESH):
             log.error('SGE is not installed on this AMI, skipping...')
@@ -292,25 +321,37 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
         self._setup_sge()
 
     def on_add_node(self, node, nodes, master, user, user_shell, volumes):
+        self.on_add_nodes([node], nodes, master, user, user_shell, volumes)
+
+    def on_add_nodes(self, new_nodes, nodes, master, user, user_shell,
+                     volumes):
         self._nodes = nodes
         self._master = master
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
-        log.info('Adding %s to SGE' % node.alias)
-        self._setup_nfs(nodes=[node], export_paths=[self.SGE_ROOT],
+        log.info('Adding %s to SGE' % ', '.join([n.alias for n in new_nodes]))
+        self._setup_nfs(nodes=new_nodes, export_paths=[self.SGE_ROOT],
                         start_server=False)
-        self._add_sge_admin_host(node)
-        self._add_sge_submit_host(node)
-        self._add_to_sge(node)
+        self._add_sge_admin_hosts(new_nodes)
+        self._add_sge_submit_hosts(new_nodes)
+        for node in new_nodes:
+            self.pool.simple_job(self._add_to_sge, (node,), jobid=node.alias)
+        self.pool.wait(numtasks=len(new_nodes))
         self._create_sge_pe()
 
     def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
+        self.on_remove_nodes([node], nodes, master, user, user_shell,
+                             volumes)
+
+    def on_remove_nodes(self, remove_nodes, nodes, master, user, user_shell,
+                        volumes):
         self._nodes = nodes
         self._master = master
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
-        log.info('Removing %s from SGE' % node.alias)
-        self._remove_from_sge(node)
-        self._remove_nfs_exports(node)
+        log.info('Removing %s from SGE' %
+                 ', '.join([n.alias for n in remove_nodes]))
+        self._remove_nodes_from_sge(remove_nodes)
+        self._remove_nfs_exports(remove_nodes)
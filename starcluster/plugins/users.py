@@ -68,11 +68,7 @@ class CreateUsers(clustersetup.DefaultClusterSetup):
         log.info("Creating %d cluster users" % self._num_users)
         newusers = self._get_newusers_batch_file(master, self._usernames,
                                                  user_shell)
-        for node in nodes:
-            self.pool.simple_job(node.ssh.execute,
-                                 ("echo -n '%s' | newusers" % newusers),
-                                 jobid=node.alias)
-        self.pool.wait(numtasks=len(nodes))
+        self.execute_on_nodes(nodes, "echo -n '%s' | newusers" % newusers)
         log.info("Configuring passwordless ssh for %d cluster users" %
                  self._num_users)
         pbar = self.pool.progress_bar.reset()
@@ -147,24 +143,29 @@ class CreateUsers(clustersetup.DefaultClusterSetup):
         return bfilecontents
 
     def on_add_node(self, node, nodes, master, user, user_shell, volumes):
+        self.on_add_nodes([node], nodes, master, user, user_shell, volumes)
+
+    def on_add_nodes(self, new_nodes, nodes, master, user, user_shell,
+                     volumes):
         self._nodes = nodes
         self._master = master
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
-        log.info("Creating %d users on %s" % (self._num_users, node.alias))
+        aliases = ', '.join([n.alias for n in new_nodes])
+        log.info("Creating %d users on %s" % (self._num_users, aliases))
         newusers = self._get_newusers_batch_file(master, self._usernames,
                                                  user_shell)
-        node.ssh.execute("echo -n '%s' | newusers" % newusers)
+        self.execute_on_nodes(new_nodes, "echo -n '%s' | newusers" % newusers)
         log.info("Adding %s to known_hosts for %d users" %
-                 (node.alias, self._num_users))
+                 (aliases, self._num_users))
         pbar = self.pool.progress_bar.reset()
         pbar.maxval = self._num_users
         for i, user in enumerate(self._usernames):
-            master.add_to_known_hosts(user, [node])
+            master.add_to_known_hosts(user, new_nodes)
             pbar.update(i + 1)
         pbar.finish()
-        self._setup_scratch(nodes=[node], users=self._usernames)
+        self._setup_scratch(nodes=new_nodes, users=self._usernames)
 
     def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
         raise NotImplementedError('on_remove_node method not implemented')
@@ -0,0 +1,186 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Client-side rate limiting, backoff and call accounting helpers
+"""
+import time
+import random
+import threading
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket that allows bursts of up to burst calls and
+    refills at rate tokens per second
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = max(0, now - self._last)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._last = now
+
+    def acquire(self, tokens=1):
+        """
+        Takes tokens from the bucket, sleeping until they're available.
+        Returns the number of seconds spent waiting.
+        """
+        waited = 0
+        while True:
+            self._lock.acquire()
+            try:
+                self._refill(time.time())
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            finally:
+                self._lock.release()
+            time.sleep(delay)
+            waited += delay
+
+
+def backoff_delays(base, cap, factor=2):
+    """
+    Yields exponentially increasing delays starting at base and capped at
+    cap. Each delay is jittered between half and all of its value so that
+    clients that back off at the same time don't retry in lockstep.
+    """
+    delay = float(base)
+    while True:
+        delay = min(cap, delay)
+        yield delay / 2 + random.uniform(0, delay / 2)
+        delay *= factor
+
+
+class OpStats(object):
+    """
+    Call, retry, byte and latency counters of a single operation
+    """
+    __slots__ = ('calls', 'retries', 'throttled', 'errors', 'total_time',
+                 'max_time', 'bytes_sent', 'bytes_received')
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def add(self, latency, retries=0, throttled=0, error=False,
+            bytes_sent=0, bytes_received=0):
+        self.calls += 1
+        self.retries += retries
+        self.throttled += throttled
+        self.errors += int(bool(error))
+        self.total_time += latency
+        self.max_time = max(self.max_time, latency)
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+
+    def to_dict(self):
+        d = dict([(attr, getattr(self, attr)) for attr in self.__slots__])
+        d['avg_time'] = self.avg_time
+        return d
+
+    @property
+    def avg_time(self):
+        if self.calls:
+            return self.total_time / self.calls
+        return 0.0
+
+
+class CallStats(object):
+    """
+    Thread-safe OpStats per operation and, for calls recorded with a caller,
+    per (caller, operation)
+    """
+    def __init__(self):
+        self.ops = {}
+        self.callers = {}
+        self._lock = threading.Lock()
+
+    def record(self, op, latency, caller=None, **kwargs):
+        """
+        Adds a call of op that took latency seconds. kwargs are passed to
+        OpStats.add.
+        """
+        self._lock.acquire()
+        try:
+            stats = self.ops.get(op)
+            if stats is None:
+                stats = self.ops[op] = OpStats()
+            stats.add(latency, **kwargs)
+            if caller:
+                key = (caller, op)
+                stats = self.callers.get(key)
+                if stats is None:
+                    stats = self.callers[key] = OpStats()
+                stats.add(latency, **kwargs)
+        finally:
+            self._lock.release()
+
+    def get(self, op, caller=None):
+        if caller:
+            return self.callers.get((caller, op)) or OpStats()
+        return self.ops.get(op) or OpStats()
+
+    def _table(self, rows, header):
+        fmt = '%-44s %6s %7s %9s %6s %8s %8s %9s %9s'
+        lines = [fmt % (header, 'calls', 'retries', 'throttled', 'errors',
+                        'avg(s)', 'max(s)', 'sent(KB)', 'recv(KB)')]
+        fmt = '%-44s %6d %7d %9d %6d %8.3f %8.3f %9.1f %9.1f'
+        rows = sorted(rows, key=lambda r: -r[1].total_time)
+        for name, s in rows:
+            lines.append(fmt % (name, s.calls, s.retries, s.throttled,
+                                s.errors, s.avg_time, s.max_time,
+                                s.bytes_sent / 1024.,
+                                s.bytes_received / 1024.))
+        return lines
+
+    def summary(self):
+        """
+        Returns a printable table of the counters per operation followed by
+        a table per caller if any, both sorted by total time
+        """
+        lines = self._table(self.ops.items(), 'operation')
+        if self.callers:
+            rows = [('%s: %s' % key, s) for key, s in self.callers.items()]
+            lines += [''] + self._table(rows, 'caller: operation')
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        """
+        Returns the counters as a dictionary that can be dumped to JSON:
+
+        {'operations': {op: counters},
+         'callers': {caller: {op: counters}}}
+        """
+        callers = {}
+        for (caller, op), stats in self.callers.items():
+            callers.setdefault(caller, {})[op] = stats.to_dict()
+        ops = dict([(op, s.to_dict()) for op, s in self.ops.items()])
+        return dict(operations=ops, callers=callers)
@@ -20,13 +20,16 @@ import re
 import sys
 import stat
 import glob
+import time
 import atexit
 import string
 import socket
 import fnmatch
 import hashlib
 import warnings
+import select
 import posixpath
+import threading
 
 import scp
 import paramiko
@@ -52,6 +55,10 @@ class SSHClient(object):
     private key authentication. Once established, this object allows executing
     commands, copying files to/from the remote host, various file querying
     similar to os.path.*, and much more.
+
+    Passing an SSHConnectionPool via the pool kwarg allows the authenticated
+    transport to be shared with any other SSHClient connecting to the same
+    host, port, and user with the same credentials (see get_connection_pool).
     """
 
     def __init__(self,
@@ -62,7 +69,8 @@ class SSHClient(object):
                  private_key_pass=None,
                  compress=False,
                  port=22,
-                 timeout=30):
+                 timeout=30,
+                 pool=None):
         self._host = host
         self._port = port
         self._pkey = None
@@ -72,6 +80,8 @@ class SSHClient(object):
         self._sftp = None
         self._scp = None
         self._transport = None
+        self._pool = pool
+        self._pool_key = None
         self._progress_bar = None
         self._compress = compress
         if private_key:
@@ -108,6 +118,16 @@ class SSHClient(object):
         pkey = self._pkey
         if private_key:
             pkey = self.load_private_key(private_key, private_key_pass)
+        pool_key = self._get_pool_key(host, port, username, pkey, password)
+        if self._pool:
+            transport = self._pool.acquire(pool_key)
+            if transport:
+                log.debug("reusing pooled connection to host %s on port %d "
+                          "as user %s" % (host, port, username))
+                self.close()
+                self._transport = transport
+                self._pool_key = pool_key
+                return self
         log.debug("connecting to host %s on port %d as user %s" % (host, port,
                                                                    username))
         try:
@@ -141,8 +161,22 @@ class SSHClient(object):
                 log.debug("Garbage packet received", exc_info=True)
                 raise exception.SSHAccessDeniedViaAuthKeys(username)
             raise
+        if self._pool and self._pool.add(pool_key, transport):
+            self._pool_key = pool_key
         return self
 
+    def _get_pool_key(self, host, port, username, pkey=None, password=None):
+        """
+        Returns the key for the transport in the connection pool. The key
+        identifies the credentials used so that a client never reuses a
+        transport that was authenticated with a different key or password.
+        """
+        if pkey:
+            creds = pkey.get_fingerprint().encode('hex')
+        else:
+            creds = hashlib.sha1(password or '').hexdigest()
+        return (host, port, username, creds)
+
     @property
     def transport(self):
         """
@@ -208,7 +242,8 @@ class SSHClient(object):
     @property
     def scp(self):
         """Initialize the SCP client."""
-        if not self._scp or not self._scp.transport.is_active():
+        if not self._scp or self._scp.transport is not self._transport or \
+                not self._scp.transport.is_active():
             log.debug("creating scp connection")
             self._scp = scp.SCPClient(self.transport,
                                       progress=self._file_transfer_progress,
@@ -588,6 +623,61 @@ class SSHClient(object):
                 log.debug("output of '%s' has been hidden" % command)
         return output
 
+    def run_command(self, command, timeout=None, source_profile=True,
+                    log_output=True):
+        """
+        Execute a remote command and return a CommandResult containing the
+        exit status and separate stdout/stderr output of the command. Unlike
+        execute() this method never raises on a non-zero exit status.
+
+        timeout - number of seconds to wait for the command to finish before
+                  closing its channel and marking the result as timed out
+        source_profile - if True prefix the command with "source /etc/profile"
+        log_output - log all remote output to the debug file
+        """
+        result = CommandResult(command)
+        if source_profile:
+            command = "source /etc/profile && %s" % command
+        log.debug("executing remote command: %s" % command)
+        start = time.time()
+        channel = self.transport.open_session()
+        channel.exec_command(command)
+        stdout, stderr = [], []
+        while True:
+            while channel.recv_ready():
+                stdout.append(channel.recv(32768))
+            while channel.recv_stderr_ready():
+                stderr.append(channel.recv_stderr(32768))
+            if channel.exit_status_ready() and not channel.recv_ready() and \
+                    not channel.recv_stderr_ready():
+                break
+            wait = 0.1
+            if timeout is not None:
+                remaining = start + timeout - time.time()
+                if remaining <= 0:
+                    channel.close()
+                    result.timed_out = True
+                    break
+                wait = min(wait, remaining)
+            # stderr does not wake up select so poll at a short interval
+            select.select([channel], [], [], wait)
+        if not result.timed_out:
+            result.exit_status = channel.recv_exit_status()
+        self.__last_status = result.exit_status
+        result.stdout = ''.join(stdout)
+        result.stderr = ''.join(stderr)
+        result.elapsed = time.time() - start
+        status = result.exit_status
+        if result.timed_out:
+            status = 'timed out'
+        if log_output:
+            log.debug("output of '%s' on %s (status: %s):\n%s" %
+                      (command, self._host, status, '\n'.join(result.output)))
+        else:
+            log.debug("output of '%s' on %s (status: %s) has been hidden" %
+                      (command, self._host, status))
+        return result
+
     def has_required(self, progs):
         """
         Same as check_required but returns False if not all commands exist
@@ -624,11 +714,20 @@ class SSHClient(object):
         return env
 
     def close(self):
-        """Closes the connection and cleans up."""
+        """
+        Closes the connection and cleans up. Pooled transports are released
+        back to the pool rather than closed.
+        """
         if self._sftp:
             self._sftp.close()
-        if self._transport:
+            self._sftp = None
+        self._scp = None
+        if self._pool_key:
+            self._pool.release(self._pool_key, self._transport)
+            self._pool_key = None
+        elif self._transport:
             self._transport.close()
+        self._transport = None
 
     def _invoke_shell(self, term='screen', cols=80, lines=24):
         chan = self.transport.open_session()
@@ -739,6 +838,175 @@ class SSHClient(object):
 Connection = SSHClient
 
 
+class CommandResult(object):
+    """
+    Exit status and output of a remote command (see SSHClient.run_command)
+
+    exit_status is None if the command timed out or could not be run in which
+    case timed_out or error (the exception raised) is set.
+    """
+
+    def __init__(self, command, exit_status=None, stdout='', stderr='',
+                 timed_out=False, error=None, elapsed=0):
+        self.command = command
+        self.exit_status = exit_status
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+        self.error = error
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return '<CommandResult: %r (exit_status=%s)>' % (self.command,
+                                                         self.exit_status)
+
+    @property
+    def failed(self):
+        return self.exit_status != 0
+
+    @property
+    def output(self):
+        """
+        Returns combined stdout/stderr as a list of stripped lines similar to
+        the return value of SSHClient.execute
+        """
+        lines = self.stdout.splitlines() + self.stderr.splitlines()
+        return [line.strip() for line in lines]
+
+
+class SSHConnectionPool(object):
+    """
+    Bounded pool of authenticated paramiko transports keyed by
+    (host, port, username, credentials) - see SSHClient._get_pool_key
+
+    Each SSHClient holding a pooled transport counts as a lease on it. Channels
+    for execute, sftp, and scp are multiplexed over the shared transport so
+    that only the first client for a given key pays for the TCP+SSH handshake.
+    Transports are health-checked before being handed out. Transports with no
+    leases are closed after idle_timeout seconds, or in least-recently-used
+    order when the pool holds more than max_size transports.
+    """
+
+    def __init__(self, max_size=256, idle_timeout=300):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        # key -> [transport, leases, last_used]
+        self._conns = {}
+
+    def __len__(self):
+        return len(self._conns)
+
+    def _is_healthy(self, transport):
+        if not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def _evict(self, key):
+        transport = self._conns.pop(key)[0]
+        self.evictions += 1
+        log.debug("evicting pooled ssh connection: %s@%s:%d" %
+                  (key[2], key[0], key[1]))
+        transport.close()
+
+    def _evict_idle(self, now=None):
+        now = now or time.time()
+        for key, (transport, leases, last_used) in self._conns.items():
+            if leases == 0 and now - last_used >= self.idle_timeout:
+                self._evict(key)
+
+    def _make_room(self):
+        idle = [(c[2], k) for k, c in self._conns.items() if c[1] == 0]
+        idle.sort()
+        while len(self._conns) >= self.max_size and idle:
+            self._evict(idle.pop(0)[1])
+        return len(self._conns) < self.max_size
+
+    def acquire(self, key):
+        """
+        Returns a healthy pooled transport for key and records a lease on it.
+        Returns None if no usable transport is pooled for key.
+        """
+        with self._lock:
+            self._evict_idle()
+            conn = self._conns.get(key)
+            if conn and not self._is_healthy(conn[0]):
+                self._evict(key)
+                conn = None
+            if not conn:
+                self.misses += 1
+                return
+            self.hits += 1
+            conn[1] += 1
+            conn[2] = time.time()
+            return conn[0]
+
+    def add(self, key, transport):
+        """
+        Adds a freshly connected transport to the pool with a single lease.
+        Returns False if another leased transport is already pooled for key or
+        if the pool is full of leased transports. In that case the caller keeps
+        sole ownership of the transport.
+        """
+        with self._lock:
+            if key in self._conns:
+                if self._conns[key][1] > 0:
+                    return False
+                self._evict(key)
+            if not self._make_room():
+                log.debug("ssh connection pool is full (%d)" % self.max_size)
+                return False
+            self._conns[key] = [transport, 1, time.time()]
+            return True
+
+    def release(self, key, transport):
+        """
+        Drops a lease on a pooled transport. Transports that were replaced or
+        evicted while leased are closed.
+        """
+        with self._lock:
+            conn = self._conns.get(key)
+            if not conn or conn[0] is not transport:
+                transport.close()
+                return
+            conn[1] = max(conn[1] - 1, 0)
+            conn[2] = time.time()
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        evictions=self.evictions, size=len(self._conns))
+
+    def close_all(self):
+        with self._lock:
+            log.debug("closing all pooled ssh connections: %s" % self.stats())
+            for key in self._conns.keys():
+                self._evict(key)
+
+
+_pool_lock = threading.Lock()
+_connection_pool = None
+
+
+def get_connection_pool():
+    """
+    Returns the process-wide SSHConnectionPool shared by all cluster nodes
+    """
+    global _connection_pool
+    with _pool_lock:
+        if _connection_pool is None:
+            _connection_pool = SSHConnectionPool()
+            atexit.register(_connection_pool.close_all)
+        return _connection_pool
+
+
 class SSHGlob(object):
 
     def __init__(self, ssh_client):
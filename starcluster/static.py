@@ -79,6 +79,8 @@ DEBUG_FILE = os.path.join(STARCLUSTER_LOG_DIR, 'debug.log')
 SSH_DEBUG_FILE = os.path.join(STARCLUSTER_LOG_DIR, 'ssh-debug.log')
 AWS_DEBUG_FILE = os.path.join(STARCLUSTER_LOG_DIR, 'aws-debug.log')
 CRASH_FILE = os.path.join(STARCLUSTER_LOG_DIR, 'crash-report-%d.txt' % PID)
+API_PROFILE_FILE = os.path.join(STARCLUSTER_LOG_DIR,
+                                'api-profile-%d.json' % PID)
 
 # StarCluster BASE AMIs (us-east-1)
 BASE_AMI_32 = "ami-9bf9c9f2"
@@ -100,6 +102,11 @@ MAX_TAG_LEN = 255
 UD_PLUGINS_FNAME = "_sc_plugins.txt"
 UD_VOLUMES_FNAME = "_sc_volumes.txt"
 UD_ALIASES_FNAME = "_sc_aliases.txt"
+# EC2 limit on the size of the (compressed) userdata
+MAX_USERDATA_KB = 16
+# Default client-side EC2 API rate limit (requests/sec and burst size)
+AWS_REQUEST_RATE = 10.0
+AWS_REQUEST_BURST = 20
 
 INSTANCE_METADATA_URI = "http://169.254.169.254/latest"
 INSTANCE_STATES = ['pending', 'running', 'shutting-down',
@@ -313,6 +320,8 @@ AWS_SETTINGS = {
     'aws_proxy_user': (str, False, None, None, None),
     'aws_proxy_pass': (str, False, None, None, None),
     'aws_validate_certs': (bool, False, True, None, None),
+    'aws_request_rate': (float, False, AWS_REQUEST_RATE, None, None),
+    'aws_request_burst': (int, False, AWS_REQUEST_BURST, None, None),
 }
 
 KEY_SETTINGS = {
@@ -368,4 +377,5 @@ CLUSTER_SETTINGS = {
     'force_spot_master': (bool, False, False, None, None),
     'disable_cloudinit': (bool, False, False, None, None),
     'dns_prefix': (bool, False, False, None, None),
+    'node_cache_ttl': (int, False, 5, None, None),
 }
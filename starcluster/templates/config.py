@@ -59,6 +59,9 @@ AWS_USER_ID= #your userid
 #AWS_PROXY_PORT = 8080
 #AWS_PROXY_USER = yourproxyuser
 #AWS_PROXY_PASS = yourproxypass
+# Uncomment to change the EC2 API request rate limit (OPTIONAL)
+#AWS_REQUEST_RATE = 10
+#AWS_REQUEST_BURST = 20
 
 ###########################
 ## Defining EC2 Keypairs ##
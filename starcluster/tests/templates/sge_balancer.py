@@ -3231,3 +3231,149 @@ all.q@domU-12-31-39-0B-C4-C1.compute-1.internal</queue_name>
     </job_list>
   </job_info>
 </job_info>"""
+
+array_qstat_xml = """<?xml version='1.0'?>
+<job_info  xmlns:xsd="http://gridengine.sunsource.net/source/browse/*checkout\
+*/gridengine/source/dist/util/resources/schemas/qstat/qstat.xsd?revision=1.11">
+  <queue_info>
+    <Queue-List>
+      <name>all.q@node001</name>
+      <qtype>BIP</qtype>
+      <slots_used>2</slots_used>
+      <slots_resv>0</slots_resv>
+      <slots_total>8</slots_total>
+      <load_avg>0.01000</load_avg>
+      <arch>linux-x64</arch>
+      <job_list state="running">
+        <JB_job_number>7</JB_job_number>
+        <JAT_prio>0.55500</JAT_prio>
+        <JB_name>array</JB_name>
+        <JB_owner>root</JB_owner>
+        <state>r</state>
+        <JAT_start_time>2010-07-08T04:40:46</JAT_start_time>
+        <queue_name>all.q@node001</queue_name>
+        <slots>2</slots>
+        <tasks>1</tasks>
+      </job_list>
+    </Queue-List>
+  </queue_info>
+  <job_info>
+    <job_list state="pending">
+      <JB_job_number>7</JB_job_number>
+      <JAT_prio>0.55500</JAT_prio>
+      <JB_name>array</JB_name>
+      <JB_owner>root</JB_owner>
+      <state>qw</state>
+      <JB_submission_time>2010-07-08T04:40:32</JB_submission_time>
+      <queue_name></queue_name>
+      <slots>2</slots>
+      <tasks>2-100001:1</tasks>
+    </job_list>
+    <job_list state="pending">
+      <JB_job_number>8</JB_job_number>
+      <JAT_prio>0.55500</JAT_prio>
+      <JB_name>strided</JB_name>
+      <JB_owner>root</JB_owner>
+      <state>qw</state>
+      <JB_submission_time>2010-07-08T04:40:33</JB_submission_time>
+      <queue_name></queue_name>
+      <slots>1</slots>
+      <tasks>1-9:2,20</tasks>
+    </job_list>
+  </job_info>
+</job_info>"""
+
+hetero_qstat_xml = """<?xml version='1.0'?>
+<job_info  xmlns:xsd="http://gridengine.sunsource.net/source/browse/*checkout\
+*/gridengine/source/dist/util/resources/schemas/qstat/qstat.xsd?revision=1.11">
+  <queue_info>
+    <Queue-List>
+      <name>all.q@master</name>
+      <qtype>BIP</qtype>
+      <slots_used>0</slots_used>
+      <slots_resv>0</slots_resv>
+      <slots_total>8</slots_total>
+      <arch>linux-x64</arch>
+    </Queue-List>
+    <Queue-List>
+      <name>cpu.q@master</name>
+      <qtype>BIP</qtype>
+      <slots_used>8</slots_used>
+      <slots_resv>0</slots_resv>
+      <slots_total>8</slots_total>
+      <arch>linux-x64</arch>
+      <job_list state="running">
+        <JB_job_number>1</JB_job_number>
+        <JAT_prio>0.55500</JAT_prio>
+        <JB_name>cpu</JB_name>
+        <JB_owner>root</JB_owner>
+        <state>r</state>
+        <JAT_start_time>2010-07-08T04:40:46</JAT_start_time>
+        <queue_name>cpu.q@master</queue_name>
+        <slots>8</slots>
+      </job_list>
+    </Queue-List>
+    <Queue-List>
+      <name>all.q@node001</name>
+      <qtype>BIP</qtype>
+      <slots_used>0</slots_used>
+      <slots_resv>0</slots_resv>
+      <slots_total>32</slots_total>
+      <arch>linux-x64</arch>
+    </Queue-List>
+    <Queue-List>
+      <name>gpu.q@node001</name>
+      <qtype>BIP</qtype>
+      <slots_used>32</slots_used>
+      <slots_resv>0</slots_resv>
+      <slots_total>32</slots_total>
+      <arch>linux-x64</arch>
+      <job_list state="running">
+        <JB_job_number>2</JB_job_number>
+        <JAT_prio>0.55500</JAT_prio>
+        <JB_name>gpu</JB_name>
+        <JB_owner>root</JB_owner>
+        <state>r</state>
+        <JAT_start_time>2010-07-08T04:40:46</JAT_start_time>
+        <queue_name>gpu.q@node001</queue_name>
+        <slots>32</slots>
+      </job_list>
+    </Queue-List>
+  </queue_info>
+  <job_info>
+    <job_list state="pending">
+      <JB_job_number>3</JB_job_number>
+      <JAT_prio>0.55500</JAT_prio>
+      <JB_name>gpu</JB_name>
+      <JB_owner>root</JB_owner>
+      <state>qw</state>
+      <JB_submission_time>2010-07-08T04:40:32</JB_submission_time>
+      <hard_req_queue>gpu.q</hard_req_queue>
+      <slots>16</slots>
+      <tasks>1-4:1</tasks>
+    </job_list>
+    <job_list state="pending">
+      <JB_job_number>4</JB_job_number>
+      <JAT_prio>0.55500</JAT_prio>
+      <JB_name>cpu</JB_name>
+      <JB_owner>root</JB_owner>
+      <state>qw</state>
+      <JB_submission_time>2010-07-08T04:40:33</JB_submission_time>
+      <hard_request name="h_vmem" \
+resource_contribution="0.000000">4G</hard_request>
+      <hard_req_queue>cpu.q</hard_req_queue>
+      <slots>1</slots>
+      <tasks>1-24:1</tasks>
+    </job_list>
+    <job_list state="pending">
+      <JB_job_number>5</JB_job_number>
+      <JAT_prio>0.55500</JAT_prio>
+      <JB_name>any</JB_name>
+      <JB_owner>root</JB_owner>
+      <state>qw</state>
+      <JB_submission_time>2010-07-08T04:40:34</JB_submission_time>
+      <slots>1</slots>
+      <tasks>1-48:1</tasks>
+    </job_list>
+  </job_info>
+</job_info>"""
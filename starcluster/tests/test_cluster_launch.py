@@ -0,0 +1,244 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+logging.disable(logging.WARN)
+
+from starcluster import utils
+from starcluster import static
+from starcluster import userdata
+from starcluster.cluster import Cluster
+from starcluster.tests import StarClusterTest
+
+
+class Bunch(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeEC2(object):
+    """
+    Records launch requests and tags instead of calling EC2
+    """
+    def __init__(self):
+        self.region = Bunch(name='us-east-1')
+        self.requests = []
+        self.spots = []
+        self.tags = {}
+        self.propagated = []
+        self.describes = 0
+        self.terminated = []
+
+    def request_instances(self, image_id, price=None, count=1, **kwargs):
+        kwargs.update(image_id=image_id, price=price, count=count)
+        self.requests.append(kwargs)
+        if not price:
+            instances = [Bunch(id='i-%d' % i, placement='us-east-1a')
+                         for i in range(count)]
+            return Bunch(instances=instances)
+        spots = []
+        for i in range(count):
+            spot = Bunch(id='sir-%d' % len(self.spots), tags={},
+                         launch_specification=Bunch(placement='us-east-1a'))
+            self.spots.append(spot)
+            spots.append(spot)
+        return spots
+
+    def wait_for_propagation(self, instances=None, spot_requests=None,
+                             progress=True):
+        self.propagated.append((len(instances or spot_requests), progress))
+
+    def create_tags(self, resource_ids, tags):
+        for rid in resource_ids:
+            self.tags.setdefault(rid, {}).update(tags)
+            for spot in self.spots:
+                if spot.id == rid:
+                    spot.tags.update(tags)
+
+    def get_all_spot_requests(self, spot_ids=[], filters=None):
+        ids = filters['spot-instance-request-id']
+        return [s for s in self.spots if s.id in ids]
+
+    def get_all_instances(self, instance_ids=None, filters=None):
+        self.describes += 1
+        return []
+
+    def terminate_instances(self, instance_ids=None):
+        self.terminated.extend(instance_ids)
+
+    def cancel_spot_requests(self, request_ids):
+        pass
+
+
+class FakeNode(object):
+    def __init__(self, spot_id):
+        self.spot_id = spot_id
+        self.tags = {}
+
+    def add_tags(self, tags):
+        self.tags.update(tags)
+
+
+def get_cluster(cluster_size=5, spot_bid=0.5, **kwargs):
+    """
+    Returns a Cluster using FakeEC2 with its security group and zone set
+    """
+    cl = Cluster(ec2_conn=FakeEC2(), cluster_tag='test',
+                 cluster_size=cluster_size, spot_bid=spot_bid,
+                 node_image_id='ami-1234', node_instance_type='m1.small',
+                 keyname='mykey', disable_threads=True, **kwargs)
+    cl._cluster_group = Bunch(name='@sc-test', id='sg-1234')
+    cl._zone = Bunch(name='us-east-1a')
+    return cl
+
+
+class TestClusterLaunch(StarClusterTest):
+
+    def test_bulk_spot_request(self):
+        cl = get_cluster()
+        aliases = ['node001', 'node002', 'node003']
+        spots = cl.create_nodes(aliases)
+        ec2 = cl.ec2
+        assert len(ec2.requests) == 1
+        assert ec2.requests[0]['count'] == 3
+        assert [s.tags['alias'] for s in spots] == aliases
+        # aliases are not stored in the (shared) user data
+        ud = userdata.unbundle_userdata(ec2.requests[0]['user_data'])
+        assert ud[static.UD_ALIASES_FNAME].splitlines()[2:] == []
+        nodes = [FakeNode(s.id) for s in reversed(spots)]
+        nodes.append(FakeNode('sir-unknown'))
+        # Cluster.nodes may be read from pool jobs so the tagging must not
+        # wait on the pool
+        cl._pool = None
+        cl._assign_spot_aliases(nodes)
+        assert cl._pool is None
+        assert [n.tags.get('alias') for n in nodes] == \
+            ['node003', 'node002', 'node001', None]
+        assert nodes[0].tags['Name'] == 'node003'
+
+    def test_add_spot_nodes_propagates_once(self):
+        cl = get_cluster()
+        cl._nodes_in_states = lambda states: []
+        cl.wait_for_cluster = lambda msg=None: None
+        cl.get_nodes = lambda aliases: aliases
+        cl.run_plugins = lambda **kwargs: None
+        cl.add_nodes(2, aliases=['node001', 'node002'])
+        # create_nodes already waited for the requests before tagging them
+        assert cl.ec2.propagated == [(2, True)]
+        aliases = [s.tags['alias'] for s in cl.ec2.spots]
+        assert aliases == ['node001', 'node002']
+
+    def test_spot_cluster_requests_per_group(self):
+        itypes = [dict(size=2, type='c1.xlarge', image=None)]
+        cl = get_cluster(node_instance_types=itypes)
+        cl.create_cluster()
+        requests = cl.ec2.requests
+        # flat-rate master, then one spot request per type/ami group
+        assert len(requests) == 3
+        assert requests[0]['price'] is None
+        counts = sorted([(r['instance_type'], r['count'])
+                         for r in requests[1:]])
+        assert counts == [('c1.xlarge', 2), ('m1.small', 2)]
+        aliases = sorted([s.tags['alias'] for s in cl.ec2.spots])
+        assert aliases == ['node001', 'node002', 'node003', 'node004']
+
+    def test_flat_rate_cluster_groups(self):
+        itypes = [dict(size=2, type='c1.xlarge', image=None),
+                  dict(size=1, type='m1.large', image=None)]
+        cl = get_cluster(spot_bid=None, node_instance_types=itypes)
+        cl.create_cluster()
+        requests = cl.ec2.requests
+        # master group first, then one request per remaining type/ami group
+        # launched in the master's zone
+        assert len(requests) == 3
+        assert requests[0]['instance_type'] == 'm1.small'
+        assert requests[0]['count'] == 2
+        counts = sorted([(r['instance_type'], r['count'], r['placement'])
+                         for r in requests[1:]])
+        assert counts == [('c1.xlarge', 2, 'us-east-1a'),
+                          ('m1.large', 1, 'us-east-1a')]
+        # each group waits for its own instances without a progress bar
+        assert sorted(cl.ec2.propagated) == [(1, False), (2, False),
+                                             (2, True)]
+
+    def test_userdata_bundle_cache(self):
+        cl = get_cluster()
+        bundle = cl._get_userdata_bundle()
+        ud = userdata.unbundle_userdata(cl._get_cluster_userdata(['node001']))
+        assert ud[static.UD_ALIASES_FNAME].splitlines()[2:] == ['node001']
+        assert cl._get_userdata_bundle() is bundle
+        # changing the volumes rebuilds the shared parts
+        cl.volumes = dict(data=dict(volume_id='vol-1234', mount_path='/d'))
+        assert cl._get_userdata_bundle() is not bundle
+        ud = userdata.unbundle_userdata(cl._get_cluster_userdata([]))
+        volumes = ud[static.UD_VOLUMES_FNAME].splitlines()[2:]
+        assert utils.decode_uncompress_load(volumes) == cl.volumes
+        # so does changing them in place
+        bundle = cl._get_userdata_bundle()
+        cl.volumes['data']['mount_path'] = '/data'
+        assert cl._get_userdata_bundle() is not bundle
+
+
+class TestNodeCache(StarClusterTest):
+
+    def test_cache_hit(self):
+        cl = get_cluster(cluster_size=2, spot_bid=None, node_cache_ttl=60)
+        cl.nodes
+        cl.nodes
+        assert cl.ec2.describes == 1
+        assert cl._is_node_cache_fresh()
+
+    def test_cache_expires(self):
+        cl = get_cluster(cluster_size=2, spot_bid=None, node_cache_ttl=5)
+        cl.nodes
+        # pretend the node list was fetched longer than the ttl ago
+        cl._nodes_updated -= 5
+        assert not cl._is_node_cache_fresh()
+        cl.nodes
+        assert cl.ec2.describes == 2
+
+    def test_cache_disabled(self):
+        cl = get_cluster(cluster_size=2, spot_bid=None, node_cache_ttl=0)
+        cl.nodes
+        cl.nodes
+        assert cl.ec2.describes == 2
+        assert not cl._is_node_cache_fresh()
+
+    def test_invalidate(self):
+        cl = get_cluster(cluster_size=2, spot_bid=None, node_cache_ttl=60)
+        cl.nodes
+        cl.invalidate_nodes()
+        cl.nodes
+        assert cl.ec2.describes == 2
+
+    def test_create_nodes_invalidates(self):
+        cl = get_cluster(cluster_size=2, spot_bid=None, node_cache_ttl=60)
+        cl.nodes
+        cl.create_nodes(['node001'])
+        assert not cl._is_node_cache_fresh()
+        cl.nodes
+        assert cl.ec2.describes == 2
+
+    def test_terminate_nodes_invalidates(self):
+        cl = get_cluster(cluster_size=2, spot_bid=None, node_cache_ttl=60)
+        cl.nodes
+        node = Bunch(id='i-1', alias='node001', spot_id=None)
+        cl.terminate_nodes([node])
+        assert cl.ec2.terminated == ['i-1']
+        assert not cl._is_node_cache_fresh()
+        cl.nodes
+        assert cl.ec2.describes == 2
@@ -0,0 +1,249 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import tempfile
+logging.disable(logging.WARN)
+
+from starcluster import tests
+from starcluster import sshutils
+from starcluster import exception
+from starcluster import threadpool
+from starcluster import clustersetup
+
+
+class FakeSSH(object):
+    def __init__(self, alias):
+        self.alias = alias
+        self.commands = []
+
+    def run_command(self, command, timeout=None, source_profile=True):
+        self.commands.append(command)
+        if command == 'fail':
+            return sshutils.CommandResult(command, exit_status=1,
+                                          stderr='%s failed' % self.alias)
+        if command == 'error':
+            raise exception.SSHError('connection lost')
+        return sshutils.CommandResult(command, exit_status=0,
+                                      stdout='%s\n' % self.alias)
+
+
+class FakeNode(object):
+    def __init__(self, alias):
+        self.alias = alias
+        self.ssh = FakeSSH(alias)
+
+
+class TestExecuteOnNodes(tests.StarClusterTest):
+
+    _pool = None
+
+    @property
+    def pool(self):
+        if not self._pool:
+            self._pool = threadpool.get_thread_pool(5, disable_threads=False)
+            self._pool.progress_bar.fd = tempfile.TemporaryFile()
+        return self._pool
+
+    def test_results_per_node(self):
+        nodes = [FakeNode('node%.3d' % i) for i in range(10)]
+        completed = []
+        results = clustersetup.execute_on_nodes(
+            nodes, 'hostname', pool=self.pool, max_concurrency=2,
+            callback=lambda n, r: completed.append(n.alias))
+        assert sorted(results.keys()) == [n.alias for n in nodes]
+        assert sorted(completed) == [n.alias for n in nodes]
+        for node in nodes:
+            assert results[node.alias].exit_status == 0
+            assert results[node.alias].output == [node.alias]
+
+    def test_command_list_stops_on_failure(self):
+        nodes = [FakeNode('node001')]
+        results = clustersetup.execute_on_nodes(
+            nodes, ['true', 'fail', 'never'], pool=self.pool,
+            raise_on_failure=False)
+        assert [r.exit_status for r in results['node001']] == [0, 1]
+        assert nodes[0].ssh.commands == ['true', 'fail']
+
+    def test_failures_raise(self):
+        nodes = [FakeNode('node001'), FakeNode('node002')]
+        nodes[1].ssh.run_command = lambda cmd, **kw: \
+            FakeSSH.run_command(nodes[1].ssh, 'error')
+        try:
+            clustersetup.execute_on_nodes(nodes, 'hostname', pool=self.pool)
+        except exception.RemoteCommandsFailed, e:
+            assert e.failed == ['node002']
+            assert not e.results['node001'].failed
+            assert isinstance(e.results['node002'].error, exception.SSHError)
+            assert "node002: 'hostname' failed: connection lost" in e.msg
+        else:
+            raise Exception("RemoteCommandsFailed not raised")
+
+    def test_failure_output_in_message(self):
+        nodes = [FakeNode('node001'), FakeNode('node002')]
+        try:
+            clustersetup.execute_on_nodes(nodes, ['true', 'fail'],
+                                          pool=self.pool)
+        except exception.RemoteCommandsFailed, e:
+            assert e.failed == ['node001', 'node002']
+            lines = e.msg.splitlines()
+            assert "node001: 'fail' failed with status 1" in lines
+            assert "node002: node002 failed" in lines
+        else:
+            raise Exception("RemoteCommandsFailed not raised")
+
+
+class PerNodePlugin(clustersetup.DefaultClusterSetup):
+    def on_add_node(self, node, nodes, master, user, user_shell, volumes):
+        pass
+
+
+class BatchedPlugin(PerNodePlugin):
+    def on_add_nodes(self, new_nodes, nodes, master, user, user_shell,
+                     volumes):
+        pass
+
+
+class TestBatchedAdd(tests.StarClusterTest):
+
+    def test_builtin_plugins_batched(self):
+        from starcluster.plugins import sge, users
+        assert clustersetup.supports_batched_add(
+            clustersetup.DefaultClusterSetup())
+        assert clustersetup.supports_batched_add(sge.SGEPlugin())
+        assert clustersetup.supports_batched_add(
+            users.CreateUsers(num_users=2))
+
+    def test_per_node_fallback(self):
+        assert not clustersetup.supports_batched_add(PerNodePlugin())
+        assert clustersetup.supports_batched_add(BatchedPlugin())
+        assert not clustersetup.supports_batched_add(object())
+
+    def test_default_on_add_nodes_calls_on_add_node(self):
+        added = []
+
+        class Plugin(clustersetup.ClusterSetup):
+            def on_add_node(self, node, *args):
+                added.append(node)
+        nodes = ['node001', 'node002']
+        Plugin().on_add_nodes(nodes, nodes, None, 'sgeadmin', 'bash', {})
+        assert added == nodes
+
+
+class PerNodeRemovePlugin(clustersetup.DefaultClusterSetup):
+    def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
+        pass
+
+
+class FakeRemoteFile(object):
+    def __init__(self, name):
+        self.name = name
+        self.lines = []
+
+    def write(self, data):
+        self.lines += data.splitlines()
+
+    def close(self):
+        pass
+
+
+class FakeSGENode(FakeNode):
+    def __init__(self, alias, gpu=False):
+        FakeNode.__init__(self, alias)
+        self.id = 'i-' + alias
+        self.gpu = gpu
+        self.files = {}
+        self.ssh.execute = lambda cmd, **kw: self.ssh.commands.append(cmd)
+        self.ssh.remote_file = self._remote_file
+
+    def _remote_file(self, name, mode='r'):
+        self.files[name] = FakeRemoteFile(name)
+        return self.files[name]
+
+    def is_gpu_compute(self):
+        return self.gpu
+
+    def is_himem_compute(self):
+        return False
+
+
+class TestBatchedRemove(tests.StarClusterTest):
+
+    def test_per_node_fallback(self):
+        from starcluster.plugins import sge
+        assert clustersetup.supports_batched_remove(
+            clustersetup.DefaultClusterSetup())
+        assert clustersetup.supports_batched_remove(sge.SGEPlugin())
+        assert not clustersetup.supports_batched_remove(
+            PerNodeRemovePlugin())
+        removed = []
+
+        class Plugin(clustersetup.ClusterSetup):
+            def on_remove_node(self, node, *args):
+                removed.append(node)
+        nodes = ['node001', 'node002']
+        Plugin().on_remove_nodes(nodes, nodes, None, 'sgeadmin', 'bash', {})
+        assert removed == nodes
+
+    def test_run_plugin_removed_nodes(self):
+        from starcluster import cluster
+
+        class PluginCluster(cluster.Cluster):
+            nodes = master_node = None
+        calls = []
+
+        class Plugin(clustersetup.ClusterSetup):
+            def on_remove_node(self, node, *args):
+                calls.append(('on_remove_node', node))
+
+        class Batched(clustersetup.ClusterSetup):
+            def on_remove_nodes(self, remove_nodes, *args):
+                calls.append(('on_remove_nodes', remove_nodes))
+        cl = PluginCluster(cluster_tag='test')
+        nodes = ['node001', 'node002']
+        cl.run_plugin(Plugin(), method_name='on_remove_nodes',
+                      removed_nodes=nodes)
+        cl.run_plugin(Batched(), method_name='on_remove_nodes',
+                      removed_nodes=nodes)
+        assert calls == [('on_remove_node', 'node001'),
+                         ('on_remove_node', 'node002'),
+                         ('on_remove_nodes', nodes)]
+
+    def test_sge_removes_batch_in_one_session(self):
+        from starcluster.plugins import sge
+        plugin = sge.SGEPlugin(create_gpu_queue=True, disable_threads=True)
+        master = FakeSGENode('master')
+        nodes = [master, FakeSGENode('node001'),
+                 FakeSGENode('node002', gpu=True), FakeSGENode('node003')]
+        pe_nodes = []
+        plugin._create_sge_pe = lambda nodes: pe_nodes.extend(nodes)
+        plugin._master = master
+        plugin._nodes = nodes
+        plugin._remove_nodes_from_sge(nodes[1:3])
+        # all of the qconf commands run in one session, stopping at the
+        # first failure, without leaving a script behind on the master
+        assert master.files == {}
+        assert len(master.ssh.commands) == 1
+        cmds = master.ssh.commands[0].split(' && ')
+        assert 'qconf -purge queue slots all.q@node001' in cmds
+        assert 'qconf -purge queue slots gpu.q@node002' in cmds
+        assert 'qconf -purge queue slots gpu.q@node001' not in cmds
+        assert cmds[-2:] == ['qconf -dconf node001,node002',
+                             'qconf -de node001,node002']
+        for node in nodes[1:3]:
+            assert node.ssh.commands == ['pkill -9 sge_execd']
+        assert pe_nodes == [master, nodes[3]]
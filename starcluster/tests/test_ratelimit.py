@@ -0,0 +1,124 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import itertools
+
+from starcluster import awsutils
+from starcluster import ratelimit
+from starcluster.tests import StarClusterTest
+
+ERROR_XML = ('<Response><Errors><Error><Code>%s</Code><Message>error'
+             '</Message></Error></Errors></Response>')
+
+
+class FakeResponse(object):
+    def __init__(self, status, body=''):
+        self.status = status
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+class FakeRequests(object):
+    """
+    Returns an error response for each code in codes, then success
+    """
+    def __init__(self, codes):
+        self.codes = list(codes)
+        self.actions = []
+
+    def __call__(self, action, params=None, path='/', verb='GET'):
+        self.actions.append(action)
+        if self.codes:
+            return FakeResponse(400, ERROR_XML % self.codes.pop(0))
+        return FakeResponse(200, '<Response/>')
+
+
+class TestRateLimit(StarClusterTest):
+
+    def _get_throttle(self, **kwargs):
+        kwargs.setdefault('base_delay', 0.001)
+        kwargs.setdefault('max_delay', 0.002)
+        return awsutils.RequestThrottle(rate=1000, burst=10, **kwargs)
+
+    def test_token_bucket(self):
+        bucket = ratelimit.TokenBucket(100, burst=5)
+        start = time.time()
+        assert sum([bucket.acquire() for i in range(5)]) == 0
+        # the sixth call has to wait for a token
+        assert bucket.acquire() > 0
+        assert time.time() - start >= 0.005
+
+    def test_backoff_delays(self):
+        delays = list(itertools.islice(ratelimit.backoff_delays(1, 8), 6))
+        caps = [1, 2, 4, 8, 8, 8]
+        for delay, cap in zip(delays, caps):
+            assert cap / 2. <= delay <= cap
+
+    def test_retry_throttled(self):
+        throttle = self._get_throttle()
+        make_request = FakeRequests(['RequestLimitExceeded'] * 2)
+        resp = throttle.request(make_request, 'DescribeInstances', {})
+        assert resp.status == 200
+        assert len(make_request.actions) == 3
+        stats = throttle.stats.get('DescribeInstances')
+        assert (stats.calls, stats.retries, stats.throttled) == (1, 2, 2)
+        assert stats.errors == 0
+        # throttling slows down the bucket until requests succeed again
+        assert throttle.bucket.rate < throttle.rate
+        assert 'DescribeInstances' in throttle.stats.summary()
+
+    def test_eventual_consistency(self):
+        throttle = self._get_throttle()
+        make_request = FakeRequests(['InvalidInstanceID.NotFound'])
+        assert throttle.request(make_request, 'CreateTags').status == 200
+        assert throttle.stats.get('CreateTags').retries == 1
+        # lookups of missing resources are not retried
+        make_request = FakeRequests(['InvalidInstanceID.NotFound'])
+        resp = throttle.request(make_request, 'DescribeInstances')
+        assert resp.status == 400
+        stats = throttle.stats.get('DescribeInstances')
+        assert (stats.retries, stats.errors) == (0, 1)
+
+    def test_max_retries(self):
+        throttle = self._get_throttle(max_retries=2)
+        make_request = FakeRequests(['Throttling'] * 5)
+        assert throttle.request(make_request, 'RunInstances').status == 400
+        assert len(make_request.actions) == 3
+
+    def tearDown(self):
+        awsutils._api_profile = None
+
+    def test_api_profile(self):
+        profile = awsutils.enable_api_profiling()
+        assert awsutils.get_api_profile() is profile
+        throttle = self._get_throttle()
+        make_request = FakeRequests(['RequestLimitExceeded'])
+        throttle.request(make_request, 'DescribeTags', {'Filter.1': 'a'})
+        stats = profile.get('DescribeTags',
+                            caller='TestRateLimit.test_api_profile')
+        assert (stats.calls, stats.retries) == (1, 1)
+        assert stats.bytes_sent == len('Filter.1a') + 2
+        assert stats.bytes_received == len('<Response/>')
+        dump = profile.to_dict()
+        assert 'DescribeTags' in dump['operations']
+        callers = dump['callers']['TestRateLimit.test_api_profile']
+        assert callers['DescribeTags']['calls'] == 1
+        assert 'TestRateLimit.test_api_profile: DescribeTags' in \
+            profile.summary()
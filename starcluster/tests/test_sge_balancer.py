@@ -15,15 +15,106 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import time
+import shutil
 import iso8601
 import datetime
+import StringIO
+import tempfile
+import subprocess
 
 from starcluster import utils
+from starcluster import sshutils
 from starcluster.balancers import sge
+from starcluster.balancers.sge import policy as sge_policy
 from starcluster.tests import StarClusterTest
 from starcluster.tests.templates import sge_balancer
 
 
+class FakeNode(object):
+    def __init__(self, alias):
+        self.alias = alias
+        self.id = 'i-' + alias
+
+
+class FakeStat(object):
+    def __init__(self, st_size):
+        self.st_size = st_size
+
+
+class FakeAccountingFile(StringIO.StringIO):
+    def stat(self):
+        return FakeStat(len(self.getvalue()))
+
+
+class FakeSSH(object):
+    def __init__(self):
+        self.accounting = ''
+
+    def remote_file(self, path, mode):
+        if self.accounting is None:
+            raise IOError("No such file")
+        return FakeAccountingFile(self.accounting)
+
+
+class LocalSSH(FakeSSH):
+    """
+    Runs commands locally using bash with qhost/qstat replaced by functions
+    that print the loaded qhost/qstat fixtures
+    """
+    def __init__(self, tmpdir):
+        self.functions = ''
+        for cmd in ['qhost', 'qstat']:
+            path = os.path.join(tmpdir, cmd)
+            with open(path, 'w') as f:
+                f.write(getattr(sge_balancer, 'loaded_%s_xml' % cmd))
+            self.functions += '%s() { cat %s; }; ' % (cmd, path)
+
+    def run_command(self, command, timeout=None, source_profile=True,
+                    log_output=True):
+        proc = subprocess.Popen(['bash', '-c', self.functions + command],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate()
+        return sshutils.CommandResult(command, exit_status=proc.returncode,
+                                      stdout=stdout, stderr=stderr)
+
+    def remote_file(self, path, mode):
+        with open(path, mode) as f:
+            return FakeAccountingFile(f.read())
+
+
+class FakeMaster(object):
+    def __init__(self, ssh):
+        self.ssh = ssh
+
+
+class FakeCluster(object):
+    def __init__(self, master_node, nodes=[]):
+        self.master_node = master_node
+        self.nodes = self.running_nodes = nodes
+        self.node_instance_type = 'm1.small'
+        self.node_instance_types = []
+        self.spot_bid = None
+        self.added = []
+
+    def add_nodes(self, num_nodes, **kwargs):
+        self.added.append(num_nodes)
+
+
+class FakeQueue(object):
+    def __init__(self, queued_slots=0):
+        self.queued_slots = queued_slots
+
+    def count_queued_slots(self):
+        return self.queued_slots
+
+
+def accounting_record(job_id, queued, start, end):
+    return ('all.q:node001:sgeadmin:sgeadmin:job%d:%d:sge:0:%d:%d:%d:0:0:%d:'
+            '0.1:0.1:0\n' % (job_id, job_id, queued, start, end, end - start))
+
+
 class TestSGELoadBalancer(StarClusterTest):
 
     def test_qhost_parser(self):
@@ -52,6 +143,28 @@ class TestSGELoadBalancer(StarClusterTest):
         assert stat.oldest_queued_job_age() == oldest
         assert len(stat.queues) == 3
 
+    def test_qstat_parser_file_input(self):
+        stat = sge.SGEStats()
+        qstat = StringIO.StringIO(sge_balancer.loaded_qstat_xml)
+        jobs = stat.parse_qstat(qstat)
+        expected = sge.SGEStats().parse_qstat(sge_balancer.loaded_qstat_xml)
+        assert [j.job_number for j in jobs] == \
+            [j.job_number for j in expected]
+        assert len(stat.queues) == 10
+
+    def test_array_job_parser(self):
+        stat = sge.SGEStats()
+        jobs = stat.parse_qstat(sge_balancer.array_qstat_xml)
+        assert len(jobs) == 3
+        assert len(stat.get_queued_jobs()) == 2
+        assert stat.count_queued_tasks() == 100000 + 6
+        assert stat.count_queued_slots() == 100000 * 2 + 6
+        assert stat.count_running_tasks() == 1
+        assert stat.count_used_slots() == 2
+        assert stat.num_slots_for_job(7) == 2
+        assert jobs[0]['JB_job_number'] == 7
+        assert 'JAT_start_time' not in jobs[1]
+
     def test_qacct_parser(self):
         stat = sge.SGEStats()
         now = utils.get_utc_now()
@@ -59,6 +172,142 @@ class TestSGELoadBalancer(StarClusterTest):
         assert stat.avg_job_duration() == 90
         assert stat.avg_wait_time() == 263
 
+    def test_accounting_parser(self):
+        stat = sge.SGEStats()
+        records = ''.join([accounting_record(i, 1000, 1000 + i, 1000 + 11 * i)
+                           for i in range(1, 11)])
+        records = '# Version: 6.2u5\n' + records
+        # job deleted while queued - never started
+        records += accounting_record(11, 1000, 0, 0)
+        assert stat.parse_accounting(records) == 10
+        assert stat.max_job_id == 10
+        assert stat.avg_wait_time() == 5
+        assert stat.avg_job_duration() == 55
+        assert stat.job_duration_percentile(50) == 50
+        assert stat.job_duration_percentile(95) == 100
+        assert stat.wait_time_percentile(100) == 10
+        # jobs that ended before the window are skipped while parsing
+        stat = sge.SGEStats()
+        assert stat.parse_accounting(records, since=1050) == 6
+        assert len(stat.jobstats) == 6
+
+    def test_jobstats_window(self):
+        window = sge.JobStatsWindow(window=100)
+        window.add(1000, 10, 1)
+        window.add(1200, 20, 2)
+        window.add(1100, 30, 3)
+        assert window.expire(1150) == 1
+        assert window.count == 2
+        assert window.avg_duration() == 25
+        assert window.expire(1250) == 1
+        assert window.avg_wait() == 2
+
+    def test_accounting_cursor(self):
+        ssh = FakeSSH()
+        ssh.accounting = None
+        cursor = sge.AccountingCursor()
+        assert cursor.read(ssh) == ''
+        first = accounting_record(1, 1000, 1010, 1020)
+        second = accounting_record(2, 1000, 1010, 1030)
+        ssh.accounting = first + second[:10]
+        assert cursor.read(ssh) == first
+        assert cursor.offset == len(first)
+        ssh.accounting = first + second
+        assert cursor.read(ssh) == second
+        assert cursor.read(ssh) == ''
+        # accounting file rotated
+        ssh.accounting = second
+        assert cursor.read(ssh) == second
+        assert cursor.offset == len(second)
+
+    def test_accounting_seek_to_time(self):
+        records = []
+        for i in range(1, 301):
+            records.append(accounting_record(i, 1000, 1000, 1000 + 10 * i))
+            if i % 7 == 0:
+                # deleted jobs have no end time
+                records.append(accounting_record(i, 1000, 0, 0))
+        data = ''.join(records)
+        f = StringIO.StringIO(data)
+        cursor = sge.AccountingCursor()
+        for t in [0, 1010, 1555, 2000, 3000, 3001]:
+            offset = cursor.seek_to_time(f, len(data), t, chunk=256)
+            expected = [i for i, r in enumerate(records)
+                        if sge.get_accounting_end_time(r) >= t]
+            assert offset == len(''.join(records[:expected[0]])) if \
+                expected else offset == len(data)
+
+    def test_accounting_state(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            acct_file = os.path.join(tmpdir, 'accounting')
+            state_file = os.path.join(tmpdir, 'accounting.json')
+            ssh = LocalSSH(tmpdir)
+            first = accounting_record(1, 1000, 1010, 1020)
+            second = accounting_record(2, 1000, 1010, 2000)
+            with open(acct_file, 'w') as f:
+                f.write(first + second)
+            # no saved offset: start at the lookback window
+            cursor = sge.AccountingCursor(path=acct_file,
+                                          state_file=state_file)
+            cursor.restore(ssh, 1500)
+            assert cursor.offset == len(first)
+            assert cursor.read(ssh) == second
+            # a restarted balancer resumes at the saved offset
+            cursor = sge.AccountingCursor(path=acct_file,
+                                          state_file=state_file)
+            cursor.restore(ssh, 0)
+            assert cursor.offset == len(first + second)
+            # a rotated file (new inode) is searched again
+            with open(acct_file + '.new', 'w') as f:
+                f.write(second + first)
+            os.rename(acct_file + '.new', acct_file)
+            cursor = sge.AccountingCursor(path=acct_file,
+                                          state_file=state_file)
+            cursor.restore(ssh, 0)
+            assert cursor.offset == 0
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_stats_bundle(self):
+        commands = [('lines', "printf 'a\\nb'"), ('fail', 'false'),
+                    ('quoted', "echo '*'")]
+        for compress in [False, True]:
+            script = sge.build_stats_script(commands, compress=compress)
+            bundle = subprocess.Popen(['bash', '-c', 'echo motd; ' + script],
+                                      stdout=subprocess.PIPE).communicate()[0]
+            frames = sge.parse_stats_bundle(bundle, compress=compress)
+            assert sorted(frames) == ['fail', 'lines', 'quoted']
+            assert frames['lines'].stdout == 'a\nb'
+            assert frames['fail'].exit_status == 1
+            assert frames['quoted'].stdout == '*\n'
+            assert frames['quoted'].elapsed >= 0
+
+    def test_get_stats_single_round_trip(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            acct_file = os.path.join(tmpdir, 'accounting')
+            now = int(time.time())
+            with open(acct_file, 'w') as f:
+                f.write(accounting_record(1, now - 30, now - 20, now - 10))
+            lb = sge.SGELoadBalancer()
+            lb._cluster = FakeCluster(FakeMaster(LocalSSH(tmpdir)))
+            lb._accounting = sge.AccountingCursor(path=acct_file)
+            stat = lb._get_stats()
+            assert stat.count_hosts() == 10
+            assert stat.count_queued_tasks() == 188
+            assert len(stat.jobstats) == 1
+            assert lb._accounting.offset == os.path.getsize(acct_file)
+            assert 'qstat' in lb.stats_latency
+            assert 'total' in lb.stats_latency
+            with open(acct_file, 'a') as f:
+                f.write(accounting_record(2, now - 30, now - 10, now))
+            lb._get_stats()
+            assert len(stat.jobstats) == 2
+            assert stat.max_job_id == 2
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_loaded_qstat_parser(self):
         stat = sge.SGEStats()
         stat_hash = stat.parse_qstat(sge_balancer.loaded_qstat_xml)
@@ -77,5 +326,64 @@ class TestSGELoadBalancer(StarClusterTest):
         assert stat.slots_per_host() == 8
 
     def test_node_working(self):
-        # TODO : FINISH THIS
-        pass
+        stat = sge.SGEStats()
+        stat.parse_qstat(sge_balancer.qstat_xml)
+        working = FakeNode('ip-10-196-142-180.ec2.internal')
+        assert stat.is_node_working(working)
+        assert len(stat.get_jobs_for_host(working.alias)) == 1
+        # prefix of a working host's name must not match
+        idle = FakeNode('ip-10-196-142-18')
+        assert not stat.is_node_working(idle)
+        assert stat.get_jobs_for_host(idle.alias) == []
+
+    def _get_policy_balancer(self, policy, used_slots):
+        """
+        Returns a balancer with two 8-slot nodes, an empty queue and a
+        policy that has seen used_slots slots start within the last minute
+        """
+        lb = sge.SGELoadBalancer(max_nodes=10, min_nodes=1, add_pi=4,
+                                 policy=policy)
+        nodes = [FakeNode('master'), FakeNode('node001')]
+        lb._cluster = FakeCluster(None, nodes=nodes)
+        lb._stat = FakeQueue()
+        lb.has_cluster_stabilized = lambda: True
+        kwargs = dict(total_slots=16, slots_per_host=8, avg_duration=600)
+        lb.policy.observe(sge_policy.ClusterState(0, 2, **kwargs))
+        lb._state = sge_policy.ClusterState(60, 2, used_slots=used_slots,
+                                            **kwargs)
+        lb.policy.observe(lb._state)
+        return lb
+
+    def test_predictive_adds_with_empty_queue(self):
+        # 16 slots started in 60s of 600s jobs: ~160 slots of demand
+        lb = self._get_policy_balancer('predictive', used_slots=16)
+        lb._eval_add_node()
+        assert lb._cluster.added == [4]
+        # nothing is added when the predicted demand fits
+        lb = self._get_policy_balancer('predictive', used_slots=0)
+        lb._eval_add_node()
+        assert lb._cluster.added == []
+        # the reactive policy still waits for queued jobs
+        lb = self._get_policy_balancer('reactive', used_slots=16)
+        lb._eval_add_node()
+        assert lb._cluster.added == []
+
+    def test_heterogeneous_slots(self):
+        stat = sge.SGEStats()
+        stat.parse_qstat(sge_balancer.hetero_qstat_xml)
+        assert stat.get_host_slots() == {'master': 8, 'node001': 32}
+        assert stat.count_total_slots() == 40
+        assert stat.count_total_slots('gpu.q') == 32
+        # mixed instance types no longer raise
+        assert stat.slots_per_host() == 20
+        assert stat.slots_per_host('cpu.q') == 8
+        queued = stat.get_queued_jobs()
+        assert [j.cluster_queue for j in queued] == ['gpu.q', 'cpu.q', None]
+        queues = stat.get_queue_stats()
+        assert sorted(queues) == ['all.q', 'cpu.q', 'gpu.q']
+        assert queues['all.q']['used_slots'] == 0
+        assert queues['all.q']['queued_slots'] == 48
+        assert queues['cpu.q']['used_slots'] == 8
+        assert queues['cpu.q']['queued_slots'] == 24
+        assert queues['gpu.q']['queued_slots'] == 64
+        assert queues['gpu.q']['hosts'] == {'node001': 32}
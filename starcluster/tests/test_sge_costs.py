@@ -0,0 +1,115 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+
+from starcluster import utils
+from starcluster import exception
+from starcluster.balancers import sge
+from starcluster.balancers.sge import costs
+from starcluster.balancers.sge import policy
+from starcluster.tests import StarClusterTest
+from starcluster.tests.templates import sge_balancer
+
+cost_table_csv = """\
+# instance_type,slots,memory_gb,gpus,price,spot_price
+c5.2xlarge,8,16,0,0.34,0.13
+c5.9xlarge,36,72,0,1.53,0.58
+m4.16xlarge,64,256,,3.20,
+p3.2xlarge,8,61,,3.06,3.50
+p3.8xlarge,32,244,,12.24,
+"""
+
+
+class TestCostTable(StarClusterTest):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write(cost_table_csv)
+        self.table = costs.get_cost_table(self.path)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def _get_state(self):
+        stat = sge.SGEStats()
+        stat.parse_qstat(sge_balancer.hetero_qstat_xml)
+        host_types = dict(master='c5.2xlarge', node001='p3.8xlarge')
+        return policy.ClusterState.from_stats(stat, 2, utils.get_utc_now(),
+                                              host_types=host_types)
+
+    def test_load_table(self):
+        assert self.table.instance_types == [
+            'c5.2xlarge', 'c5.9xlarge', 'm4.16xlarge', 'p3.2xlarge',
+            'p3.8xlarge']
+        c5 = self.table.get('c5.2xlarge')
+        assert (c5.slots, c5.memory, c5.gpus) == (8, 16, 0)
+        assert c5.use_spot and c5.hourly_price == 0.13
+        # gpus default to static.GPU_COUNTS
+        assert self.table.get('p3.8xlarge').gpus == 4
+        assert not self.table.get('p3.2xlarge').use_spot
+        assert self.table.get('m4.large').price is None
+        assert costs.get_cost_table(self.table) is self.table
+        with open(self.path, 'a') as f:
+            f.write('bogus.type,8,,,1.0,\n')
+        self.assertRaises(exception.BaseException, costs.CostTable.from_file,
+                          self.path)
+
+    def test_choose_cheapest_type(self):
+        state = self._get_state()
+        candidates = self.table.instance_types
+        # cpu.q needs 24 slots: 3 c5.2xlarge spot (0.39) beat 1 c5.9xlarge
+        # spot (0.58) and GPU types are not added to cpu.q
+        cpu = state.queues['cpu.q']
+        assert cpu.max_job_memory == 4
+        assert self.table.choose(cpu, candidates) == ('c5.2xlarge', 8)
+        # tasks needing more memory than a c5.2xlarge rule it out
+        cpu.max_job_memory = 32
+        assert self.table.choose(cpu, candidates) == ('c5.9xlarge', 36)
+        # gpu.q needs 64 slots: only GPU types are considered
+        gpu = state.queues['gpu.q']
+        assert self.table.choose(gpu, candidates) == ('p3.8xlarge', 32)
+        cpu.max_job_memory = 100
+        assert self.table.choose(cpu, candidates) == ('m4.16xlarge', 64)
+        cpu.max_job_gpus = 1
+        assert self.table.choose(cpu, candidates) == (None, None)
+
+    def test_choose_without_prices(self):
+        state = self._get_state()
+        table = costs.CostTable()
+        # slots are learned from the hosts already in the queue
+        gpu = state.queues['gpu.q']
+        assert table.choose(gpu, ['p3.8xlarge', 'p3.2xlarge']) == \
+            ('p3.8xlarge', 32)
+        assert table.choose(gpu, ['p3.2xlarge']) == (None, None)
+
+    def test_plan_and_launch_options(self):
+        state = self._get_state()
+        plan = policy.plan_additions(state, 4, costs=self.table,
+                                     instance_types=self.table.instance_types)
+        # gpu.q: 2 p3.8xlarge cost the same as 8 p3.2xlarge but fewer
+        # nodes win, cpu.q and all.q use c5.2xlarge
+        assert plan == [('c5.2xlarge', 2), ('p3.8xlarge', 2)]
+        assert self.table.launch_options('c5.9xlarge') == \
+            dict(spot_bid=1.53)
+        assert self.table.launch_options('c5.9xlarge', spot_bid=0.9) == \
+            dict(spot_bid=0.9)
+        assert self.table.launch_options('p3.8xlarge') == \
+            dict(force_flat=True)
+        assert self.table.launch_options('m4.large') == {}
@@ -0,0 +1,138 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import datetime
+import tempfile
+
+from starcluster import utils
+from starcluster import exception
+from starcluster.balancers import sge
+from starcluster.balancers.sge import policy
+from starcluster.tests import StarClusterTest
+from starcluster.tests.templates import sge_balancer
+
+
+def write_stats_csv(rows):
+    """
+    Write (hosts, running, queued, slots, avg_duration) rows in the CSV format
+    written by older versions of the load balancer, one row per minute
+    """
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    start = utils.get_utc_now()
+    with os.fdopen(fd, 'w') as f:
+        for i, (hosts, running, queued, slots, duration) in enumerate(rows):
+            now = start + datetime.timedelta(minutes=i)
+            bits = [now, hosts, running, queued, slots, duration, 0, 0.5]
+            f.write(','.join(str(b) for b in bits) + '\n')
+    return path
+
+
+class TestScalingPolicy(StarClusterTest):
+
+    def test_reactive_waits_for_old_jobs(self):
+        reactive = policy.ReactivePolicy(longest_allowed_queue_time=900)
+        state = policy.ClusterState(0, 2, total_slots=16, used_slots=16,
+                                    queued_slots=32, slots_per_host=8,
+                                    oldest_queued_age=600)
+        assert reactive.nodes_to_add(state) == 0
+        state.oldest_queued_age = 901
+        assert reactive.nodes_to_add(state) == 4
+        state.queued_slots = 0
+        assert reactive.nodes_to_add(state) == 0
+        assert reactive.nodes_to_keep(state) == 0
+
+    def test_predictive_adds_ahead_of_demand(self):
+        predictive = policy.PredictivePolicy(longest_allowed_queue_time=900,
+                                             boot_time=300)
+        first = policy.ClusterState(0, 2, total_slots=16, used_slots=16,
+                                    queued_slots=0, slots_per_host=8,
+                                    avg_duration=600)
+        predictive.observe(first)
+        assert predictive.arrival_rate is None
+        # no history yet - falls back to the reactive policy
+        assert predictive.nodes_to_add(first) == 0
+        # 16 slots queued in 60s while 1.6 slots completed
+        second = policy.ClusterState(60, 2, total_slots=16, used_slots=16,
+                                     queued_slots=16, slots_per_host=8,
+                                     avg_duration=600, oldest_queued_age=60)
+        predictive.observe(second)
+        assert abs(predictive.arrival_rate - 17.6 / 60) < 1e-9
+        assert predictive.nodes_to_add(second) > 0
+        assert policy.ReactivePolicy().nodes_to_add(second) == 0
+        assert predictive.nodes_to_keep(second) == 22
+
+    def test_predictive_boot_time(self):
+        predictive = policy.PredictivePolicy(boot_time=300, smoothing=0.5)
+        predictive.record_boot_time(500)
+        assert predictive.boot_time == 400
+
+    def test_get_policy(self):
+        assert isinstance(policy.get_policy('predictive'),
+                          policy.PredictivePolicy)
+        reactive = policy.ReactivePolicy()
+        assert policy.get_policy(reactive) is reactive
+        self.assertRaises(exception.BaseException, policy.get_policy, 'bogus')
+
+    def test_plan_additions_per_queue(self):
+        stat = sge.SGEStats()
+        stat.parse_qstat(sge_balancer.hetero_qstat_xml)
+        host_types = dict(master='c5.2xlarge', node001='p3.8xlarge')
+        state = policy.ClusterState.from_stats(stat, 2, utils.get_utc_now(),
+                                               host_types=host_types)
+        assert state.slots_per_host == 20
+        gpu = state.queues['gpu.q']
+        assert gpu.deficit == 64
+        assert gpu.instance_type == 'p3.8xlarge'
+        assert gpu.slots_per_host(gpu.instance_type) == 32
+        # all.q: 1 default node, cpu.q: 3 c5.2xlarge, gpu.q: 2 p3.8xlarge
+        assert policy.plan_additions(state, 6) == \
+            [(None, 1), ('c5.2xlarge', 3), ('p3.8xlarge', 2)]
+        # nodes go to the queues that need the most first
+        assert policy.plan_additions(state, 3) == \
+            [('c5.2xlarge', 2), ('p3.8xlarge', 1)]
+        # nodes beyond the queued demand use the default instance type
+        assert policy.plan_additions(state, 8) == \
+            [(None, 3), ('c5.2xlarge', 3), ('p3.8xlarge', 2)]
+        state.queues = {}
+        assert policy.plan_additions(state, 2) == [(None, 2)]
+
+    def test_replay_stats_csv(self):
+        rows = [(2, 16, 0, 16, 600)] * 3
+        rows += [(2, 16, 8 * i, 16, 600) for i in range(1, 20)]
+        path = write_stats_csv(rows)
+        try:
+            states = list(policy.read_stats_csv(path))
+            assert len(states) == len(rows)
+            assert len(list(policy.read_stats(path))) == len(rows)
+            assert states[0].oldest_queued_age is None
+            assert states[4].oldest_queued_age == 60
+            assert states[4].slots_per_host == 8
+            results = {}
+            for name in ['reactive', 'predictive']:
+                p = policy.get_policy(name, longest_allowed_queue_time=900)
+                result = policy.replay(states, p, add_nodes_per_iteration=2,
+                                       max_nodes=10)
+                results[name] = result.summary()
+            reactive = results['reactive']
+            predictive = results['predictive']
+            assert reactive['iterations'] == len(rows)
+            assert predictive['first_add_after'] < reactive['first_add_after']
+            assert predictive['starved_iterations'] < \
+                reactive['starved_iterations']
+        finally:
+            os.unlink(path)
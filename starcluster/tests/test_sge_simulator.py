@@ -0,0 +1,107 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+logging.disable(logging.WARN)
+
+from starcluster.balancers.sge import simulator
+from starcluster.tests import StarClusterTest
+from starcluster.tests.templates import sge_balancer
+
+
+class TestSGESimulator(StarClusterTest):
+
+    def _burst(self, num_jobs, duration=600):
+        return [simulator.SimJob(i + 1, 0, duration)
+                for i in range(num_jobs)]
+
+    def test_balancer_sees_simulated_queue(self):
+        sim = simulator.Simulator(self._burst(20), slots_per_node=8,
+                                  num_nodes=2, cluster_size=2)
+        sim.advance(0)
+        lb = sim.balancer
+        lb._update_stats()
+        assert lb.stat.count_hosts() == 2
+        assert lb.stat.count_total_slots() == 16
+        assert lb.stat.count_running_tasks() == 16
+        assert lb.stat.count_queued_tasks() == 4
+        assert lb.stat.is_node_working(sim.cluster.master_node)
+        sim.advance(600)
+        lb._update_stats()
+        assert lb.stat.count_running_tasks() == 4
+        assert lb.stat.count_queued_tasks() == 0
+        assert lb.stat.avg_job_duration() == 600
+        assert lb.stat.avg_wait_time() == 0
+
+    def test_burst_scales_up_and_down(self):
+        sim = simulator.Simulator(self._burst(64), slots_per_node=8,
+                                  num_nodes=1, boot_time=300, interval=60,
+                                  max_nodes=5, add_pi=2, wait_time=300,
+                                  stab=180)
+        report = sim.run(3 * 60 * 60)
+        summary = report.summary()
+        assert summary['jobs_submitted'] == 64
+        assert summary['jobs_completed'] == 64
+        assert summary['jobs_pending'] == 0
+        assert summary['peak_nodes'] == 5
+        assert summary['nodes_added'] == 4
+        assert summary['nodes_removed'] == 4
+        assert summary['killed_jobs'] == 0
+        assert len(sim.cluster.nodes) == 1
+        # the first nodes are requested once the oldest job has waited
+        # longer than wait_time and take boot_time to come up
+        assert report.actions[0] == (360, 'add', 2)
+        assert min(report.waits) == 0
+        assert report.wait_percentile(100) == summary['max_wait']
+        assert summary['max_wait'] > 660
+        assert summary['billed_hours'] >= int(summary['node_hours'])
+
+    def test_remove_node_requeues_jobs(self):
+        sim = simulator.Simulator(self._burst(10), slots_per_node=8,
+                                  num_nodes=2, cluster_size=2)
+        sim.advance(0)
+        node = sim.cluster.nodes[1]
+        assert node.used_slots == 2
+        sim.remove_node(node)
+        assert sim.killed_jobs == 2
+        assert len(sim.queue) == 2
+        sim.advance(600)
+        assert len(sim.queue) == 0
+        sim.advance(1200)
+        report = simulator.SimulationReport(sim)
+        assert report.jobs_completed == 10
+
+    def test_workloads(self):
+        jobs = simulator.synthetic_workload(100, 0.5, 300, seed=1)
+        assert len(jobs) == 100
+        assert jobs == sorted(jobs, key=lambda j: j.submit)
+        again = simulator.synthetic_workload(100, 0.5, 300, seed=1)
+        assert [j.duration for j in jobs] == [j.duration for j in again]
+        records = '\n'.join([
+            '# Version: 6.2u5',
+            'all.q:node001:sgeadmin:sgeadmin:sleep:1:sge:0:'
+            '1279000000:1279000010:1279000070:0:0',
+            'all.q:node001:sgeadmin:sgeadmin:sleep:2:sge:0:'
+            '1279000030:0:0:0:0',
+            'all.q:node002:sgeadmin:sgeadmin:sleep:3:sge:0:'
+            '1279000060:1279000060:1279000360:0:0'])
+        jobs = simulator.workload_from_accounting(records)
+        assert [(j.job_id, j.submit, j.duration) for j in jobs] == \
+            [(1, 0, 60), (3, 60, 300)]
+        jobs = simulator.workload_from_qstat(sge_balancer.qstat_xml, 60)
+        assert len(jobs) == 23
+        assert set([j.submit for j in jobs]) == set([0])
@@ -0,0 +1,134 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import datetime
+
+from starcluster import utils
+from starcluster import exception
+from starcluster.balancers.sge import policy
+from starcluster.balancers.sge import timeseries
+from starcluster.tests import StarClusterTest
+
+# on an hour boundary
+START = 1400000400
+
+
+class TestTimeSeriesStore(StarClusterTest):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'sge-stats.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _fill(self, store, minutes, start=START):
+        for i in range(minutes):
+            store.append([start + i * 60, 2, 16, i % 10, 16, 600.0, 30.0,
+                          0.5])
+
+    def test_append_and_read(self):
+        store = timeseries.TimeSeriesStore(self.path)
+        assert store.read() == []
+        now = utils.get_utc_now()
+        store.append([now, 2, 16, 4, 16, 600, 30, 0.75])
+        store.append([now + datetime.timedelta(minutes=1), 3, 24, 0, 24,
+                      610, 0, 1.5])
+        assert os.path.getsize(self.path) == \
+            timeseries.HEADER_SIZE + 2 * timeseries.RECORD_SIZE
+        records = timeseries.TimeSeriesStore(self.path).read()
+        assert len(records) == 2
+        assert records[0][0] == utils.datetime_to_unix_time(now) + \
+            now.microsecond / 1e6
+        assert records[0][1:] == (2, 16, 4, 16, 600.0, 30.0, 0.75)
+        assert records[1][1:5] == (3, 24, 0, 24)
+        # a partially written record is ignored by readers and dropped by the
+        # next append
+        with open(self.path, 'ab') as f:
+            f.write('\0' * 10)
+        size = os.path.getsize(self.path)
+        assert len(timeseries.TimeSeriesStore(self.path).read()) == 2
+        assert os.path.getsize(self.path) == size
+        tsfile = timeseries.TimeSeriesFile(self.path)
+        tsfile.append(timeseries.to_record(records[1]))
+        assert os.path.getsize(self.path) == \
+            timeseries.HEADER_SIZE + 3 * timeseries.RECORD_SIZE
+        with open(self.path, 'wb') as f:
+            f.write('2014-01-01 00:00:00,1,2,3,4,5,6,0.5\n')
+        self.assertRaises(exception.BaseException,
+                          timeseries.TimeSeriesStore(self.path).read)
+
+    def test_time_range(self):
+        store = timeseries.TimeSeriesStore(self.path)
+        self._fill(store, 30)
+        records = store.read(start=START + 600, end=START + 900)
+        assert [r[0] for r in records] == \
+            [START + 600 + i * 60 for i in range(5)]
+        assert store.read(start=START + 3600) == []
+
+    def test_downsampling(self):
+        store = timeseries.TimeSeriesStore(self.path)
+        self._fill(store, 59)
+        fivemin, hourly = store.tiers[1:]
+        assert fivemin.path == self.path + '.300s'
+        records = fivemin.read()
+        # the last (partial) bucket is only written once it is complete
+        assert len(records) == 11
+        assert records[1][0] == START + 300
+        assert records[1][1:4] == (2, 16, 7)
+        assert hourly.read() == []
+        # a reopened store picks up the partial bucket from the raw samples
+        store = timeseries.TimeSeriesStore(self.path)
+        self._fill(store, 10, start=START + 59 * 60)
+        records = fivemin.read()
+        assert len(records) == 13
+        assert records[11][0] == START + 11 * 300
+        # queued jobs 5, 6, 7, 8 before the restart and 0 after
+        assert records[11][3] == 5
+        assert len(hourly.read()) == 1
+
+    def test_retention(self):
+        tiers = [(0, 3600), (600, 6 * 3600)]
+        store = timeseries.TimeSeriesStore(self.path, tiers=tiers)
+        self._fill(store, 4 * 60)
+        raw = store.raw.read()
+        assert raw[-1][0] == START + (4 * 60 - 1) * 60
+        # raw samples are trimmed to the retention period once they exceed
+        # it by timeseries.COMPACT_SLACK
+        assert raw[-1][0] - raw[0][0] <= 3600 * (1 + timeseries.COMPACT_SLACK)
+        assert store.tiers[1].first_time() <= START
+        # the finest tier holding the requested range is used
+        assert store.select_tier(start=raw[0][0]) is store.raw
+        assert store.select_tier(start=START) is store.tiers[1]
+        assert store.select_tier() is store.tiers[1]
+        assert len(store.read(start=START)) == 4 * 60 // 10 - 1
+        # the header of the compacted file is validated again
+        store.raw.compact(START + 24 * 3600)
+        assert not store.raw._checked
+        assert len(store.raw) == 0
+
+    def test_replay_store(self):
+        store = timeseries.TimeSeriesStore(self.path)
+        self._fill(store, 20)
+        states = list(policy.read_stats(self.path))
+        assert len(states) == 20
+        assert states[0].oldest_queued_age is None
+        assert states[3].oldest_queued_age == 120
+        assert states[3].slots_per_host == 8
@@ -0,0 +1,71 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+import threading
+logging.disable(logging.WARN)
+
+from starcluster.tests import StarClusterTest
+
+try:
+    from starcluster.balancers.sge import visualizer
+except ImportError:
+    # matplotlib and numpy are optional
+    visualizer = None
+
+
+@unittest.skipIf(visualizer is None, "matplotlib and numpy are required")
+class TestSGEVisualizer(StarClusterTest):
+
+    def setUp(self):
+        self.vis = visualizer.SGEVisualizer('sge-stats.dat', '/tmp')
+        self.redrawn = threading.Event()
+        self.renders = 0
+        self.vis.graph_all = self._graph_all
+
+    def tearDown(self):
+        self.vis.stop(timeout=5)
+
+    def _graph_all(self):
+        self.renders += 1
+        self.redrawn.set()
+        if self.renders == 1:
+            raise Exception("render failed")
+
+    def test_notify_wakes_redraw(self):
+        self.vis.start()
+        assert self.renders == 0
+        for i in range(2):
+            self.redrawn.clear()
+            self.vis.notify()
+            self.redrawn.wait(5)
+            assert self.redrawn.is_set()
+        # a failed render doesn't stop the thread
+        assert self.renders == 2
+        assert self.vis._thread.isAlive()
+
+    def test_stop_joins(self):
+        self.vis.start()
+        thread = self.vis._thread
+        # starting again keeps the running thread
+        self.vis.start()
+        assert self.vis._thread is thread
+        self.vis.stop(timeout=5)
+        assert not thread.isAlive()
+        assert self.vis._thread is None
+        assert self.renders == 0
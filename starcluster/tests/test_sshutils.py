@@ -0,0 +1,133 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+logging.disable(logging.WARN)
+
+from starcluster import tests
+from starcluster import sshutils
+
+
+class FakeTransport(object):
+    def __init__(self, username='root'):
+        self.active = True
+        self.username = username
+
+    def get_username(self):
+        return self.username
+
+    def is_active(self):
+        return self.active
+
+    def send_ignore(self):
+        pass
+
+    def close(self):
+        self.active = False
+
+
+class TestSSHConnectionPool(tests.StarClusterTest):
+
+    key = ('node001', 22, 'root')
+
+    def test_hit_and_miss(self):
+        pool = sshutils.SSHConnectionPool()
+        assert pool.acquire(self.key) is None
+        transport = FakeTransport()
+        assert pool.add(self.key, transport)
+        assert pool.acquire(self.key) is transport
+        assert pool.acquire(('node002', 22, 'root')) is None
+        stats = pool.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 2
+        assert stats['size'] == 1
+
+    def test_release_keeps_transport_open(self):
+        pool = sshutils.SSHConnectionPool()
+        transport = FakeTransport()
+        pool.add(self.key, transport)
+        pool.release(self.key, transport)
+        assert transport.is_active()
+        assert pool.acquire(self.key) is transport
+
+    def test_unhealthy_transport_evicted(self):
+        pool = sshutils.SSHConnectionPool()
+        transport = FakeTransport()
+        pool.add(self.key, transport)
+        transport.active = False
+        assert pool.acquire(self.key) is None
+        assert len(pool) == 0
+        assert pool.evictions == 1
+
+    def test_idle_eviction(self):
+        pool = sshutils.SSHConnectionPool(idle_timeout=0)
+        leased = FakeTransport()
+        idle = FakeTransport()
+        pool.add(self.key, leased)
+        pool.add(('node002', 22, 'root'), idle)
+        pool.release(('node002', 22, 'root'), idle)
+        assert pool.acquire(('node003', 22, 'root')) is None
+        assert not idle.is_active()
+        assert leased.is_active()
+        assert len(pool) == 1
+
+    def test_bounded_size(self):
+        pool = sshutils.SSHConnectionPool(max_size=1)
+        first = FakeTransport()
+        second = FakeTransport()
+        assert pool.add(self.key, first)
+        assert not pool.add(('node002', 22, 'root'), second)
+        pool.release(self.key, first)
+        assert pool.add(('node002', 22, 'root'), second)
+        assert not first.is_active()
+        assert len(pool) == 1
+
+
+class TestPooledSSHClient(tests.StarClusterTest):
+
+    def _get_client(self, pool, password='secret'):
+        return sshutils.SSHClient('node001', username='root',
+                                  password=password, pool=pool)
+
+    def test_pool_key_includes_credentials(self):
+        pool = sshutils.SSHConnectionPool()
+        ssh = self._get_client(pool)
+        key = ssh._get_pool_key('node001', 22, 'root', password='secret')
+        pool.add(key, FakeTransport())
+        other = self._get_client(pool, password='other')
+        other_key = other._get_pool_key('node001', 22, 'root',
+                                        password='other')
+        assert other_key != key
+        assert pool.acquire(other_key) is None
+
+    def test_switch_user_rebuilds_scp(self):
+        pool = sshutils.SSHConnectionPool()
+        ssh = self._get_client(pool)
+        transports = {}
+        for user in ['root', 'sgeadmin']:
+            transports[user] = FakeTransport(user)
+            key = ssh._get_pool_key('node001', 22, user, password='secret')
+            pool.add(key, transports[user])
+            pool.release(key, transports[user])
+        ssh.connect()
+        assert ssh.scp.transport is transports['root']
+        ssh.switch_user('sgeadmin')
+        assert ssh.get_current_user() == 'sgeadmin'
+        assert ssh.scp.transport is transports['sgeadmin']
+        # the root transport went back to the pool rather than being closed
+        assert transports['root'].is_active()
+        ssh.close()
@@ -15,11 +15,13 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
+import time
 import logging
 import tempfile
 logging.disable(logging.WARN)
 
 from starcluster import tests
+from starcluster import utils
 from starcluster import exception
 from starcluster import threadpool
 
@@ -137,3 +139,95 @@ class TestThreadPool(tests.StarClusterTest):
         except exception.ThreadPoolException, e:
             assert len(e.exceptions) == r
             assert self.pool._exception_queue.qsize() == 0
+
+    def test_wait_returns_on_completion(self):
+        start = time.time()
+        for i in range(self._jobs):
+            self.pool.simple_job(time.sleep, 0.01, jobid=i)
+        self.pool.wait(numtasks=self._jobs)
+        assert time.time() - start < 0.5
+
+    def test_submit(self):
+        futures = [self.pool.submit(self._args_and_kwargs, i,
+                                    kwargs=dict(mykw=self._mykw), jobid=i)
+                   for i in range(self._jobs)]
+        for i, f in enumerate(futures):
+            assert f.result() == (i, dict(mykw=self._mykw))
+            assert f.exception() is None
+            assert f.jobid == i
+
+    def test_submit_exception(self):
+        f = self.pool.submit(lambda x: x ** 2, 'x', jobid='x')
+        assert isinstance(f.exception(), TypeError)
+        try:
+            f.result()
+        except TypeError:
+            pass
+        else:
+            raise Exception("job exception was not re-raised")
+        assert self.pool._exception_queue.qsize() == 0
+
+    def test_map_preserves_order(self):
+        r = 20
+        calc = self.pool.map(lambda x: time.sleep(0.001 * (r - x)) or x,
+                             range(r))
+        assert calc == range(r)
+
+    def test_as_completed(self):
+        futures = [self.pool.submit(time.sleep, 0.05, jobid='slow'),
+                   self.pool.submit(lambda: None, jobid='fast')]
+        done = [f.jobid for f in threadpool.as_completed(futures)]
+        assert done == ['fast', 'slow']
+
+    def test_task_graph(self):
+        order = []
+        graph = threadpool.TaskGraph(self.pool)
+        graph.add_task('a', order.append, ('a',))
+        graph.add_task('b', order.append, ('b',), deps=['a'])
+        graph.add_task('c', order.append, ('c',), deps=['a'])
+        graph.add_task('d', order.append, ('d',), deps=['b', 'c'])
+        results = graph.run()
+        assert sorted(results.keys()) == ['a', 'b', 'c', 'd']
+        assert order[0] == 'a' and order[-1] == 'd'
+
+    def test_task_graph_stages(self):
+        messages = []
+        log = threadpool.log
+        threadpool.log = utils.AttributeDict(info=messages.append,
+                                             debug=log.debug)
+        try:
+            graph = threadpool.TaskGraph(self.pool)
+            graph.add_task('a', lambda: None, stage='stage 1')
+            for name in ['b', 'c']:
+                graph.add_task(name, lambda: None, deps=['a'],
+                               stage='stage 2')
+            graph.add_task('d', lambda: None, deps=['b', 'c'])
+            graph.run()
+        finally:
+            threadpool.log = log
+        assert messages == ['stage 1', 'stage 2']
+
+    def test_task_graph_skips_dependents(self):
+        order = []
+        graph = threadpool.TaskGraph(self.pool)
+        graph.add_task('fail', lambda: 1 / 0)
+        graph.add_task('skipped', order.append, ('skipped',), deps=['fail'])
+        graph.add_task('ok', order.append, ('ok',))
+        try:
+            graph.run()
+        except exception.ThreadPoolException, e:
+            assert [jobid for exc, tb, jobid in e.exceptions] == ['fail']
+        else:
+            raise Exception("ThreadPoolException not raised")
+        assert order == ['ok']
+
+    def test_task_graph_cycle(self):
+        graph = threadpool.TaskGraph(self.pool)
+        graph.add_task('a', lambda: None, deps=['b'])
+        graph.add_task('b', lambda: None, deps=['a'])
+        try:
+            graph.run()
+        except exception.BaseException, e:
+            assert 'cycle' in e.msg
+        else:
+            raise Exception("cycle not detected")
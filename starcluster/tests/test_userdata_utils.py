@@ -106,3 +106,31 @@ def test_cloudinit_remove_no_compression():
 
 def test_non_cloudinit_remove():
     _test_remove_userdata(use_cloudinit=False)
+
+
+def _test_userdata_bundle(compress=True, use_cloudinit=True):
+    ud = _get_sample_userdata(compress=compress, use_cloudinit=use_cloudinit)
+    unbundled = userdata.unbundle_userdata(ud, decompress=compress)
+    files = utils.strings_to_files([BASH_SCRIPT], fname_prefix='sc')
+    files[0].name = 'sc_1'
+    bundle = userdata.UserDataBundle(files, compress=compress,
+                                     use_cloudinit=use_cloudinit)
+    for i in range(2):
+        ignored = utils.string_to_file(IGNORED, 'sc_0')
+        new_ud = bundle.bundle([ignored])
+        assert userdata.unbundle_userdata(new_ud,
+                                          decompress=compress) == unbundled
+    report = bundle.size_report(new_ud)
+    assert 'sc_1' in report and 'limit: 16KB' in report
+
+
+def test_cloudinit_bundle():
+    _test_userdata_bundle(compress=True, use_cloudinit=True)
+
+
+def test_cloudinit_bundle_no_compression():
+    _test_userdata_bundle(compress=False, use_cloudinit=True)
+
+
+def test_non_cloudinit_bundle():
+    _test_userdata_bundle(use_cloudinit=False)
@@ -21,6 +21,7 @@ ThreadPool module for StarCluster based on WorkerPool
 import time
 import Queue
 import thread
+import threading
 import traceback
 import workerpool
 
@@ -87,6 +88,127 @@ class SimpleJob(workerpool.jobs.SimpleJob):
         return r
 
 
+class Future(object):
+    """
+    Holds the eventual result (or exception) of a job submitted via
+    ThreadPool.submit
+    """
+    def __init__(self, jobid=None):
+        self.jobid = jobid
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+        self._traceback = None
+        self._callbacks = []
+
+    def __repr__(self):
+        state = 'finished' if self.done() else 'pending'
+        return '<Future: jobid=%s (%s)>' % (self.jobid, state)
+
+    def done(self):
+        return self._done.is_set()
+
+    def _wait(self, timeout=None):
+        # Event.wait() without a timeout cannot be interrupted by Ctrl-C
+        deadline = timeout and time.time() + timeout
+        while not self._done.is_set():
+            wait = 1
+            if deadline:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    raise exception.ThreadPoolTimeout(self.jobid)
+            self._done.wait(min(wait, 1))
+
+    def result(self, timeout=None):
+        """
+        Returns the job's return value, re-raising the job's exception if it
+        failed. Blocks until the job finishes or timeout seconds have passed.
+        """
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Returns the exception raised by the job or None if it succeeded
+        """
+        self._wait(timeout)
+        return self._exception
+
+    def traceback(self, timeout=None):
+        self._wait(timeout)
+        return self._traceback
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn(future) when the job finishes (immediately if it already has)
+        """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self, result=None, exc=None, tb_msg=None):
+        with self._lock:
+            self._result = result
+            self._exception = exc
+            self._traceback = tb_msg
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                log.error("error in callback for job %s" % self.jobid,
+                          exc_info=True)
+
+
+class FutureJob(SimpleJob):
+    """
+    Job that reports its result or exception to a Future rather than to a
+    results queue
+    """
+    def __init__(self, method, args=[], kwargs={}, jobid=None):
+        SimpleJob.__init__(self, method, args, kwargs, jobid)
+        self.future = Future(jobid)
+
+    def run(self):
+        try:
+            r = SimpleJob.run(self)
+        except Exception, e:
+            self.future._finish(exc=e, tb_msg=traceback.format_exc())
+        else:
+            self.future._finish(result=r)
+
+
+def as_completed(futures, timeout=None):
+    """
+    Iterate over futures yielding each one as soon as its job finishes. Raises
+    exception.ThreadPoolTimeout if all jobs have not finished after timeout
+    seconds.
+    """
+    finished = Queue.Queue()
+    for f in futures:
+        f.add_done_callback(finished.put)
+    deadline = timeout and time.time() + timeout
+    for i in range(len(futures)):
+        while True:
+            wait = 1
+            if deadline:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    raise exception.ThreadPoolTimeout(
+                        [f.jobid for f in futures if not f.done()])
+            try:
+                yield finished.get(True, min(wait, 1))
+                break
+            except Queue.Empty:
+                pass
+
+
 class ThreadPool(workerpool.WorkerPool):
     def __init__(self, size=1, maxjobs=0, worker_factory=_worker_factory,
                  disable_threads=False):
@@ -94,6 +216,7 @@ class ThreadPool(workerpool.WorkerPool):
         self._exception_queue = Queue.Queue()
         self._results_queue = Queue.Queue()
         self._progress_bar = None
+        self._completion = threading.Condition()
         if self.disable_threads:
             size = 0
         workerpool.WorkerPool.__init__(self, size, maxjobs, worker_factory)
@@ -119,6 +242,19 @@ class ThreadPool(workerpool.WorkerPool):
         else:
             return job.run()
 
+    def submit(self, method, args=[], kwargs={}, jobid=None):
+        """
+        Same as simple_job but returns a Future for the job's result. Job
+        exceptions are stored in the Future rather than in the pool's
+        exception queue so they are never seen by unrelated callers of wait().
+        """
+        job = FutureJob(method, args, kwargs, jobid)
+        if not self.disable_threads:
+            self.put(job)
+        else:
+            job.run()
+        return job.future
+
     def get_results(self):
         results = []
         for i in range(self._results_queue.qsize()):
@@ -137,36 +273,72 @@ class ThreadPool(workerpool.WorkerPool):
         If the kwarg jobid_fn is specified then each threadpool job will be
         assigned a jobid based on the return value of jobid_fn(item) for each
         item in the map.
+
+        Results are returned in the same order as the input sequence(s). If
+        any job fails a ThreadPoolException containing every failed job's
+        exception is raised once all jobs have finished.
         """
-        if self._results_queue.qsize() > 0:
-            self.get_results()
         args = zip(*seq)
         jobid_fn = kwargs.get('jobid_fn')
+        futures = []
         for seq in args:
             jobid = None
             if jobid_fn:
                 jobid = jobid_fn(*seq)
-            self.simple_job(fn, seq, jobid=jobid)
-        return self.wait(numtasks=len(args))
+            futures.append(self.submit(fn, seq, jobid=jobid))
+        return self.wait_for_futures(futures)
+
+    def wait_for_futures(self, futures):
+        """
+        Wait for all futures to finish, updating the progress bar as each job
+        completes, and return their results in the same order as futures.
+        Raises ThreadPoolException if any of the jobs failed.
+        """
+        pbar = self.progress_bar.reset()
+        pbar.maxval = len(futures)
+        for i, f in enumerate(as_completed(futures)):
+            pbar.update(i + 1)
+        if pbar.maxval != 0:
+            pbar.finish()
+        excs = [[f.exception(), f.traceback(), f.jobid]
+                for f in futures if f.exception() is not None]
+        if excs:
+            raise exception.ThreadPoolException(
+                "An error occurred in ThreadPool", excs)
+        return [f.result() for f in futures]
 
     def store_exception(self, e):
         self._exception_queue.put(e)
 
+    def task_done(self):
+        """
+        Marks a job as finished and wakes up any threads blocked in wait()
+        """
+        workerpool.WorkerPool.task_done(self)
+        with self._completion:
+            self._completion.notify_all()
+
     def shutdown(self):
         log.info("Shutting down threads...")
         workerpool.WorkerPool.shutdown(self)
         self.wait(numtasks=self.size())
 
     def wait(self, numtasks=None, return_results=True):
+        """
+        Block until all jobs have finished. Wakes up each time a job finishes
+        to update the progress bar rather than polling on a fixed interval.
+        """
         pbar = self.progress_bar.reset()
         pbar.maxval = self.unfinished_tasks
         if numtasks is not None:
             pbar.maxval = max(numtasks, self.unfinished_tasks)
-        while self.unfinished_tasks != 0:
-            finished = pbar.maxval - self.unfinished_tasks
-            pbar.update(finished)
-            log.debug("unfinished_tasks = %d" % self.unfinished_tasks)
-            time.sleep(1)
+        with self._completion:
+            while self.unfinished_tasks != 0:
+                finished = pbar.maxval - self.unfinished_tasks
+                pbar.update(finished)
+                log.debug("unfinished_tasks = %d" % self.unfinished_tasks)
+                # timeout keeps the wait interruptible (e.g. Ctrl-C)
+                self._completion.wait(1)
         if pbar.maxval != 0:
             pbar.finish()
         self.join()
@@ -184,6 +356,136 @@ class ThreadPool(workerpool.WorkerPool):
         self.join()
 
 
+class TaskGraph(object):
+    """
+    Runs a graph of named tasks on a ThreadPool. Each task is submitted as soon
+    as every task it depends on has finished, rather than waiting for whole
+    stages of tasks to complete. If a task fails, every task that depends on
+    it (directly or indirectly) is skipped.
+
+    Tasks can be grouped into a stage by passing a message as stage. The
+    message is logged once when the first task of the stage starts.
+
+    Example:
+
+        graph = TaskGraph(pool)
+        graph.add_task('master', setup_master)
+        for node in nodes:
+            graph.add_task(node.alias, setup_node, (node,), deps=['master'],
+                           stage="Configuring nodes...")
+        results = graph.run()
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self._tasks = {}
+        self._stages = {}
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def add_task(self, name, method, args=[], kwargs={}, deps=[],
+                 stage=None):
+        if name in self._tasks:
+            raise exception.BaseException("duplicate task: %s" % name)
+        self._tasks[name] = (method, args, kwargs, list(deps))
+        if stage:
+            self._stages[name] = stage
+
+    def _get_dependents(self):
+        dependents = dict((name, []) for name in self._tasks)
+        for name, task in self._tasks.items():
+            for dep in task[3]:
+                if dep not in self._tasks:
+                    raise exception.BaseException(
+                        "task %s depends on unknown task %s" % (name, dep))
+                dependents[dep].append(name)
+        # check for cycles by topologically sorting the graph
+        indegree = dict((n, len(set(t[3]))) for n, t in self._tasks.items())
+        ready = [n for n, d in indegree.items() if d == 0]
+        visited = 0
+        while ready:
+            visited += 1
+            for dependent in set(dependents[ready.pop()]):
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    ready.append(dependent)
+        if visited != len(self._tasks):
+            raise exception.BaseException("task graph contains a cycle")
+        return dependents
+
+    def run(self):
+        """
+        Run all tasks and block until they have finished or been skipped.
+        Returns a dictionary mapping task names to their results. Raises
+        ThreadPoolException if any task fails.
+        """
+        dependents = self._get_dependents()
+        waiting = dict((n, set(t[3])) for n, t in self._tasks.items())
+        futures = {}
+        skipped = set()
+        started = set()
+        cond = threading.Condition()
+
+        def _skip(name):
+            for dependent in dependents[name]:
+                if dependent not in skipped:
+                    log.debug("skipping task %s (%s failed)" %
+                              (dependent, name))
+                    skipped.add(dependent)
+                    _skip(dependent)
+
+        def _submit(name):
+            method, args, kwargs, deps = self._tasks[name]
+            stage = self._stages.get(name)
+            with cond:
+                first = stage and stage not in started
+                started.add(stage)
+            if first:
+                log.info(stage)
+            future = self.pool.submit(method, args, kwargs, jobid=name)
+            with cond:
+                futures[name] = future
+            future.add_done_callback(_done)
+
+        def _done(future):
+            ready = []
+            with cond:
+                if future.exception() is not None:
+                    _skip(future.jobid)
+                else:
+                    for dependent in dependents[future.jobid]:
+                        waiting[dependent].discard(future.jobid)
+                        if not waiting[dependent] and \
+                                dependent not in skipped:
+                            ready.append(dependent)
+                cond.notify_all()
+            for name in ready:
+                _submit(name)
+
+        for name in [n for n, deps in waiting.items() if not deps]:
+            _submit(name)
+        pbar = self.pool.progress_bar.reset()
+        pbar.maxval = len(self._tasks)
+
+        def _finished():
+            done = [f for f in futures.values() if f.done()]
+            return len(done) + len(skipped)
+
+        with cond:
+            while _finished() != len(self._tasks):
+                pbar.update(_finished())
+                # timeout keeps the wait interruptible (e.g. Ctrl-C)
+                cond.wait(1)
+        if pbar.maxval != 0:
+            pbar.finish()
+        excs = [[f.exception(), f.traceback(), name]
+                for name, f in futures.items() if f.exception() is not None]
+        if excs:
+            raise exception.ThreadPoolException(
+                "An error occurred in ThreadPool", excs)
+        return dict((name, f.result()) for name, f in futures.items())
+
+
 def get_thread_pool(size=10, worker_factory=_worker_factory,
                     disable_threads=False):
     return ThreadPool(size=size, worker_factory=_worker_factory,
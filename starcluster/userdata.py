@@ -30,6 +30,7 @@ from email.mime import text
 from email.mime import multipart
 
 from starcluster import utils
+from starcluster import static
 from starcluster import exception
 
 
@@ -57,38 +58,44 @@ def _get_type_from_fp(fp):
     raise exception.BaseException("invalid user data type: %s" % line)
 
 
+def _get_mime_part(fp, index):
+    mtype = _get_type_from_fp(fp)
+    maintype, subtype = mtype.split('/', 1)
+    if maintype == 'text':
+        # Note: we should handle calculating the charset
+        msg = text.MIMEText(fp.read(), _subtype=subtype)
+        fp.close()
+    else:
+        if hasattr(fp, 'name'):
+            fp = open(fp.name, 'rb')
+        msg = base.MIMEBase(maintype, subtype)
+        msg.set_payload(fp.read())
+        fp.close()
+        # Encode the payload using Base64
+        encoders.encode_base64(msg)
+    # Set the filename parameter
+    fname = getattr(fp, 'name', "sc_%d" % index)
+    msg.add_header('Content-Disposition', 'attachment',
+                   filename=os.path.basename(fname))
+    return msg
+
+
+def _gzip(string):
+    s = StringIO.StringIO()
+    gfile = gzip.GzipFile(fileobj=s, mode='w')
+    gfile.write(string)
+    gfile.close()
+    s.seek(0)
+    return s.read()
+
+
 def mp_userdata_from_files(files, compress=False, multipart_mime=None):
     outer = multipart_mime or multipart.MIMEMultipart()
-    mtypes = []
     for i, fp in enumerate(files):
-        mtype = _get_type_from_fp(fp)
-        mtypes.append(mtype)
-        maintype, subtype = mtype.split('/', 1)
-        if maintype == 'text':
-            # Note: we should handle calculating the charset
-            msg = text.MIMEText(fp.read(), _subtype=subtype)
-            fp.close()
-        else:
-            if hasattr(fp, 'name'):
-                fp = open(fp.name, 'rb')
-            msg = base.MIMEBase(maintype, subtype)
-            msg.set_payload(fp.read())
-            fp.close()
-            # Encode the payload using Base64
-            encoders.encode_base64(msg)
-        # Set the filename parameter
-        fname = getattr(fp, 'name', "sc_%d" % i)
-        msg.add_header('Content-Disposition', 'attachment',
-                       filename=os.path.basename(fname))
-        outer.attach(msg)
+        outer.attach(_get_mime_part(fp, i))
     userdata = outer.as_string()
     if compress:
-        s = StringIO.StringIO()
-        gfile = gzip.GzipFile(fileobj=s, mode='w')
-        gfile.write(userdata)
-        gfile.close()
-        s.seek(0)
-        userdata = s.read()
+        userdata = _gzip(userdata)
     return userdata
 
 
@@ -169,28 +176,114 @@ open(akf, 'w').write(fixed)
 """
 
 
-def bundle_userdata_files(fileobjs, tar_fname=None, compress=True,
-                          use_cloudinit=True):
+def _convert_ignored_file(fobj):
+    """
+    Returns fobj with #!/bin/false prepended if it's an #ignored file
+    """
+    if _get_type_from_fp(fobj) == starts_with_mappings['#ignored']:
+        return utils.string_to_file("#!/bin/false\n" + fobj.read(),
+                                    fobj.name)
+    return fobj
+
+
+def _prepare_userdata_files(fileobjs, use_cloudinit=True):
     script_type = starts_with_mappings['#!']
-    ignored_type = starts_with_mappings['#ignored']
     for i, fobj in enumerate(fileobjs):
-        ftype = _get_type_from_fp(fobj)
-        if ftype == ignored_type:
-            fileobjs[i] = utils.string_to_file("#!/bin/false\n" + fobj.read(),
-                                               fobj.name)
-            continue
-        elif ftype != script_type:
+        fobj = fileobjs[i] = _convert_ignored_file(fobj)
+        if _get_type_from_fp(fobj) != script_type:
             use_cloudinit = True
     if use_cloudinit:
         fileobjs += [utils.string_to_file('#cloud-config\ndisable_root: 0',
                                           'starcluster_cloud_config.txt')]
-        return mp_userdata_from_files(fileobjs, compress=compress)
     else:
         fileobjs += [utils.string_to_file(ENABLE_ROOT_LOGIN_SCRIPT,
                                           'starcluster_enable_root_login.sh')]
+    return fileobjs, use_cloudinit
+
+
+def bundle_userdata_files(fileobjs, tar_fname=None, compress=True,
+                          use_cloudinit=True):
+    fileobjs, use_cloudinit = _prepare_userdata_files(fileobjs,
+                                                      use_cloudinit)
+    if use_cloudinit:
+        return mp_userdata_from_files(fileobjs, compress=compress)
+    else:
         return userdata_script_from_files(fileobjs, tar_fname=tar_fname)
 
 
+class UserDataBundle(object):
+    """
+    User data built from a fixed set of files that are read and serialized
+    once. bundle() only serializes the (small) files that differ between
+    launch requests, e.g. node aliases, and splices them into the cached
+    multi-part MIME message. The per-request files must be #ignored files or
+    shell scripts so that they don't change the user data format.
+    """
+    def __init__(self, fileobjs, tar_fname=None, compress=True,
+                 use_cloudinit=True):
+        self.tar_fname = tar_fname
+        self.compress = compress
+        self.sizes = []
+        files = []
+        for f in fileobjs:
+            data = f.read()
+            f.close()
+            name = os.path.basename(f.name)
+            self.sizes.append((name, len(data)))
+            files.append(utils.string_to_file(data, name))
+        files, self.use_cloudinit = _prepare_userdata_files(files,
+                                                            use_cloudinit)
+        self._files = None
+        self._mime = None
+        self._boundary = None
+        if self.use_cloudinit:
+            outer = multipart.MIMEMultipart()
+            self._mime = mp_userdata_from_files(files, multipart_mime=outer)
+            self._boundary = '--%s\n' % outer.get_boundary()
+        else:
+            self._files = [(f.name, f.read()) for f in files]
+
+    def bundle(self, fileobjs=[]):
+        """
+        Returns the user data string for the cached files plus fileobjs
+        """
+        fileobjs = [_convert_ignored_file(f) for f in fileobjs]
+        for f in fileobjs:
+            if _get_type_from_fp(f) != starts_with_mappings['#!']:
+                raise exception.BaseException(
+                    "invalid per-request user data file: %s" % f.name)
+        if not self.use_cloudinit:
+            files = [utils.string_to_file(data, name)
+                     for name, data in self._files]
+            return userdata_script_from_files(fileobjs + files,
+                                              tar_fname=self.tar_fname)
+        parts = [_get_mime_part(f, i).as_string()
+                 for i, f in enumerate(fileobjs)]
+        if [p for p in parts if self._boundary in p]:
+            mpmime = get_mp_from_userdata(self._mime)
+            return mp_userdata_from_files(fileobjs, multipart_mime=mpmime,
+                                          compress=self.compress)
+        head, tail = self._mime.split(self._boundary, 1)
+        userdata = ''.join([head, self._boundary] +
+                           [p + '\n' + self._boundary for p in parts] +
+                           [tail])
+        if self.compress:
+            userdata = _gzip(userdata)
+        return userdata
+
+    def size_report(self, userdata):
+        """
+        Returns a printable summary of the size of each cached file and of
+        the final userdata compared to the EC2 limit (static.MAX_USERDATA_KB)
+        """
+        lines = ['%-40s %6d bytes' % (name, size)
+                 for name, size in self.sizes]
+        lines.append('%-40s %6.2fKB (limit: %dKB)' %
+                     ('total', utils.size_in_kb(userdata),
+                      static.MAX_USERDATA_KB))
+        return '\n'.join(lines)
+
+
 def unbundle_userdata(string, decompress=True):
     udata = {}
     if string.startswith('#!'):
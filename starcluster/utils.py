@@ -286,6 +286,13 @@ def iso_to_unix_time(iso):
     return secs
 
 
+def datetime_to_unix_time(dtup):
+    """
+    Converts a timezone-aware datetime tuple to seconds since the epoch
+    """
+    return calendar.timegm(dtup.utctimetuple())
+
+
 def iso_to_javascript_timestamp(iso):
     """
     Convert dates to Javascript timestamps (number of milliseconds since
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Run the SGE load balancer offline against a simulated cluster and report
+queue wait times, node-hours and scaling actions. The workload is either
+synthetic (Poisson arrivals) or replayed from a recorded SGE accounting file
+(--accounting).
+
+Each --interval/--stab/--add_nodes_per_iter/--policy value may be repeated
+to compare every combination against the same workload.
+
+Usage:
+    python utils/sge_balancer_sim.py [options]
+"""
+import sys
+import logging
+import optparse
+import itertools
+
+from starcluster.balancers.sge import policy
+from starcluster.balancers.sge import simulator
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option("--accounting", dest="accounting", default=None,
+                      help="replay the jobs in this SGE accounting file")
+    parser.add_option("--jobs", dest="num_jobs", type="int", default=500,
+                      help="number of synthetic jobs to submit")
+    parser.add_option("--rate", dest="rate", type="float", default=0.1,
+                      help="synthetic job arrival rate (jobs/sec)")
+    parser.add_option("--job-duration", dest="job_duration", type="int",
+                      default=600,
+                      help="average synthetic job duration (secs)")
+    parser.add_option("--seed", dest="seed", type="int", default=None,
+                      help="random seed for the synthetic workload")
+    parser.add_option("--duration", dest="duration", type="int",
+                      default=6 * 60 * 60, help="simulated time (secs)")
+    parser.add_option("--slots", dest="slots", type="int", default=8,
+                      help="slots per node")
+    parser.add_option("--boot-time", dest="boot_time", type="int",
+                      default=300, help="time to add nodes (secs)")
+    parser.add_option("-i", "--interval", dest="intervals", type="int",
+                      action="append", default=[],
+                      help="polling interval (secs, default: 60)")
+    parser.add_option("-s", "--stab", dest="stabs", type="int",
+                      action="append", default=[],
+                      help="stabilization time (secs, default: 180)")
+    parser.add_option("-a", "--add_nodes_per_iter", dest="add_pis",
+                      type="int", action="append", default=[],
+                      help="nodes to add per iteration (default: 1)")
+    parser.add_option("-p", "--policy", dest="policies", action="append",
+                      default=[], choices=sorted(policy.POLICIES),
+                      help="autoscaling policy (default: reactive)")
+    parser.add_option("-w", "--job_wait_time", dest="wait_time", type="int",
+                      default=900, help="longest allowed queue time (secs)")
+    parser.add_option("-n", "--min_nodes", dest="min_nodes", type="int",
+                      default=1, help="minimum # of nodes in cluster")
+    parser.add_option("-m", "--max_nodes", dest="max_nodes", type="int",
+                      default=10, help="maximum # of nodes in cluster")
+    parser.add_option("-l", "--kill-after", dest="kill_after", type="int",
+                      default=45, help="minutes past the hour to kill nodes")
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true",
+                      default=False, help="show the balancer's log output")
+    parser.add_option("--actions", dest="actions", action="store_true",
+                      default=False, help="list every scaling action")
+    opts, args = parser.parse_args()
+    if not opts.verbose:
+        logging.disable(logging.WARN)
+    if opts.accounting:
+        with open(opts.accounting) as acct:
+            jobs = simulator.workload_from_accounting(acct.read())
+    else:
+        jobs = simulator.synthetic_workload(opts.num_jobs, opts.rate,
+                                            opts.job_duration, seed=opts.seed)
+    fields = ['policy', 'interval', 'stab', 'add_pi', 'avg_wait', 'p95_wait',
+              'max_wait', 'jobs_pending', 'node_hours', 'billed_hours',
+              'peak_nodes', 'scale_ups', 'nodes_removed']
+    print ' '.join(['%-13s' % f for f in fields])
+    combos = itertools.product(opts.policies or ['reactive'],
+                               opts.intervals or [60], opts.stabs or [180],
+                               opts.add_pis or [1])
+    for name, interval, stab, add_pi in combos:
+        sim = simulator.Simulator(jobs, slots_per_node=opts.slots,
+                                  num_nodes=opts.min_nodes,
+                                  boot_time=opts.boot_time, policy=name,
+                                  interval=interval, stab=stab, add_pi=add_pi,
+                                  wait_time=opts.wait_time,
+                                  min_nodes=opts.min_nodes,
+                                  max_nodes=opts.max_nodes,
+                                  kill_after=opts.kill_after)
+        report = sim.run(opts.duration)
+        summary = report.summary()
+        summary.update(interval=interval, stab=stab, add_pi=add_pi)
+        row = []
+        for f in fields:
+            value = summary[f]
+            if isinstance(value, float):
+                value = '%.1f' % value
+            row.append('%-13s' % value)
+        print ' '.join(row)
+        if opts.actions:
+            for t, action, arg in report.actions:
+                print '    %6ds %-6s %s' % (t, action, arg)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Benchmark SGEStats.parse_qstat/parse_qhost against the original minidom-based
+parser using the fixtures in starcluster/tests/templates/sge_balancer.py.
+
+The pending jobs in the loaded qstat fixture are replicated --scale times to
+simulate large queues. Each parser runs in a forked child process so that the
+reported peak RSS is not skewed by the other parser.
+
+Usage:
+    python utils/sge_parser_benchmark.py [--scale 500] [--repeat 3]
+"""
+import os
+import re
+import sys
+import time
+import optparse
+import xml.dom.minidom
+
+from starcluster.balancers import sge
+from starcluster.tests.templates import sge_balancer
+
+
+def minidom_parse_qhost(qhost_out):
+    hosts = []
+    doc = xml.dom.minidom.parseString(qhost_out)
+    for h in doc.getElementsByTagName("host"):
+        hash = {"name": h.getAttribute("name")}
+        for stat in h.getElementsByTagName("hostvalue"):
+            for hvalue in stat.childNodes:
+                val = ""
+                if hvalue.nodeType == xml.dom.minidom.Node.TEXT_NODE:
+                    val = hvalue.data
+                hash[stat.attributes['name'].value] = val
+        if hash['name'] != u'global':
+            hosts.append(hash)
+    return hosts
+
+
+def _minidom_parse_job(job, queue_name=None):
+    jdict = dict(job_state=job.getAttribute("state"), queue_name=queue_name)
+    for node in job.childNodes:
+        if node.nodeType == xml.dom.minidom.Node.ELEMENT_NODE:
+            for child in node.childNodes:
+                jdict[node.nodeName] = child.data
+    return [jdict]
+
+
+def minidom_parse_qstat(qstat_out):
+    jobs = []
+    doc = xml.dom.minidom.parseString(qstat_out)
+    for q in doc.getElementsByTagName("Queue-List"):
+        name = q.getElementsByTagName("name")[0].childNodes[0].data
+        for job in q.getElementsByTagName("job_list"):
+            jobs.extend(_minidom_parse_job(job, queue_name=name))
+    for job in doc.getElementsByTagName("job_list"):
+        if job.parentNode.nodeName == 'job_info':
+            jobs.extend(_minidom_parse_job(job))
+    return jobs
+
+
+def scale_qstat(qstat_xml, scale):
+    """
+    Replicate the pending job_list entries of qstat_xml scale times
+    """
+    start = qstat_xml.index('<job_info>', qstat_xml.index('</queue_info>'))
+    start += len('<job_info>')
+    end = qstat_xml.rindex('</job_info>', 0, qstat_xml.rindex('</job_info>'))
+    pending = qstat_xml[start:end]
+    return qstat_xml[:start] + pending * scale + qstat_xml[end:]
+
+
+def run_child(func, arg, repeat):
+    """
+    Run func(arg) repeat times in a forked child and return the best wall time
+    and the child's peak RSS in KB
+    """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        best = None
+        for i in range(repeat):
+            start = time.time()
+            func(arg)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        os.write(wfd, repr(best))
+        os._exit(0)
+    os.close(wfd)
+    best = float(os.read(rfd, 64))
+    os.close(rfd)
+    pid, status, rusage = os.wait4(pid, 0)
+    return best, rusage.ru_maxrss
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option("--scale", type="int", default=500,
+                      help="number of times to replicate pending jobs")
+    parser.add_option("--repeat", type="int", default=3,
+                      help="number of timed runs per parser (best is shown)")
+    opts, args = parser.parse_args()
+    stats = sge.SGEStats()
+    big_qstat = scale_qstat(sge_balancer.loaded_qstat_xml, opts.scale)
+    njobs = len(re.findall('<job_list', big_qstat))
+    cases = [
+        ('qhost', sge_balancer.loaded_qhost_xml,
+         minidom_parse_qhost, stats.parse_qhost),
+        ('qstat', sge_balancer.loaded_qstat_xml,
+         minidom_parse_qstat, stats.parse_qstat),
+        ('qstat x%d (%d jobs)' % (opts.scale, njobs), big_qstat,
+         minidom_parse_qstat, stats.parse_qstat),
+    ]
+    print "%-28s %10s %10s %12s %12s" % ('input', 'minidom', 'stream',
+                                         'minidom RSS', 'stream RSS')
+    for name, data, old, new in cases:
+        old_time, old_rss = run_child(old, data, opts.repeat)
+        new_time, new_rss = run_child(new, data, opts.repeat)
+        row = (name, old_time, new_time, old_rss, new_rss)
+        print "%-28s %9.4fs %9.4fs %10dKB %10dKB" % row
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+Replay the stats recorded by 'starcluster loadbalance --dump-stats' through
+one or more SGE load balancer autoscaling policies and compare the scaling
+decisions each policy would have made.
+
+Usage:
+    python utils/sge_policy_replay.py [options] sge-stats.dat
+"""
+import sys
+import optparse
+
+from starcluster.balancers.sge import policy
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option("-p", "--policy", dest="policies", action="append",
+                      default=[], choices=sorted(policy.POLICIES),
+                      help="policy to evaluate (may be repeated, "
+                      "default: all)")
+    parser.add_option("-w", "--job_wait_time", dest="wait_time", type="int",
+                      default=900, help="longest allowed queue time (secs)")
+    parser.add_option("-a", "--add_nodes_per_iter", dest="add_pi",
+                      type="int", default=1,
+                      help="Number of nodes to add per iteration")
+    parser.add_option("-m", "--max_nodes", dest="max_nodes", type="int",
+                      default=None, help="Maximum # of nodes in cluster")
+    opts, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("please specify a stats file")
+    states = list(policy.read_stats(args[0]))
+    fields = ['policy', 'iterations', 'scale_ups', 'nodes_added',
+              'starved_iterations', 'first_add_after']
+    print ' '.join(['%-18s' % f for f in fields])
+    for name in opts.policies or sorted(policy.POLICIES):
+        p = policy.get_policy(name, longest_allowed_queue_time=opts.wait_time)
+        result = policy.replay(states, p,
+                               add_nodes_per_iteration=opts.add_pi,
+                               max_nodes=opts.max_nodes)
+        summary = result.summary()
+        print ' '.join(['%-18s' % summary[f] for f in fields])
+
+
+if __name__ == '__main__':
+    sys.exit(main())